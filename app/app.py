@@ -1,125 +1,190 @@
-import os
-
+import book_stats
+import catalog
+import catalog_import
 import config
+import covers
+import facets
+import jobs
+import migrate
+import mysql.connector
+import rendering
+import similar_books
+from autorization import bp as auth_bp
+from autorization import init_login_manager
+from covers import bp as covers_bp
+from extensions import db_connector
 from flask import (
     Flask,
+    abort,
+    current_app,
     flash,
+    get_template_attribute,
+    jsonify,
     redirect,
     render_template,
     request,
-    session,
     url_for,
 )
 from flask_login import (
-    UserMixin,
     current_user,
     login_required,
 )
-from mysqldb import (
-    DBConnector,
-)
-from werkzeug.utils import secure_filename
-
-app = Flask(__name__)
-app.config.update(
-    MYSQL_USER=config.MYSQL_USER,
-    MYSQL_PASSWORD=config.MYSQL_PASSWORD,
-    MYSQL_HOST=config.MYSQL_HOST,
-    MYSQL_DATABASE=config.MYSQL_DATABASE,
-    SECRET_KEY=config.SECRET_KEY,
-    ADMIN_ROLE_ID=config.ADMIN_ROLE_ID,
-    MODERATOR_ROLE_ID=config.MODERATOR_ROLE_ID,
-)
-
-application = app
-
-
-with app.app_context():
-    db_connector = DBConnector(app)
-    from autorization import bp as auth_bp
-    from autorization import init_login_manager
-    from users import bp as users_bp
-
-app.register_blueprint(auth_bp)
-app.register_blueprint(users_bp)
-init_login_manager(app)
-
-
-if __name__ == '__main__':
-    app.run(debug=True)
-
-
-@app.route('/')
-@app.route('/page/<int:page>')
+from metrics import init_metrics
+from mysql.connector import errorcode
+from parallel import init_parallel, parallel_queries
+from query_inspector import init_query_inspector
+from reference_data import init_reference_data, reference_data
+from search import bp as search_bp
+from throttle import init_throttle
+from users import bp as users_bp
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+
+def create_app(config_object=config):
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    # За доверенным прокси request.remote_addr — адрес клиента, а не прокси:
+    # на нём основаны ограничение попыток входа и METRICS_ALLOWED_IPS
+    if app.config['PROXY_FIX_X_FOR'] or app.config['PROXY_FIX_X_PROTO']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'],
+                                x_proto=app.config['PROXY_FIX_X_PROTO'])
+
+    db_connector.init_app(app)
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(users_bp)
+    app.register_blueprint(covers_bp)
+    app.register_blueprint(catalog_import.bp)
+    app.register_blueprint(search_bp)
+    register_views(app)
+    app.cli.add_command(book_stats.cli)
+    app.cli.add_command(facets.cli)
+    app.cli.add_command(catalog_import.import_books_command)
+    app.cli.add_command(migrate.cli)
+    app.cli.add_command(jobs.cli)
+    app.cli.add_command(similar_books.cli)
+    app.cli.add_command(rendering.cli)
+    init_login_manager(app)
+    init_reference_data(app)
+    init_throttle(app)
+    init_metrics(app)
+    init_parallel(app)
+    jobs.init_jobs(app)
+    init_query_inspector(app)
+    warm_up(app)
+    return app
+
+
+def warm_up(app):
+    # При запуске gunicorn --preload приложение создаёт главный процесс:
+    # скомпилированные шаблоны и справочники (init_reference_data) рабочие
+    # процессы получают после fork без повторной загрузки. Соединения
+    # закрываются до fork, рабочие процессы открывают свои
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    db_connector.dispose()
+
+
+def register_views(app):
+    app.add_url_rule('/', view_func=index)
+    app.add_url_rule('/page/<int:page>', view_func=index)
+    app.add_url_rule('/books/<int:book_id>', view_func=view_book)
+    app.add_url_rule('/books/<int:book_id>/reviews', view_func=book_reviews)
+    app.add_url_rule('/books/create', view_func=create_book, methods=['GET', 'POST'])
+    app.add_url_rule('/books/<int:book_id>/edit', view_func=edit_book,
+                     methods=['GET', 'POST'])
+    app.add_url_rule('/books/<int:book_id>/delete', view_func=delete_book,
+                     methods=['GET'])
+    app.add_url_rule('/books/<int:book_id>/review', view_func=write_review,
+                     methods=['GET', 'POST'])
+
+
+@db_connector.read_only
 def index(page=1):
-    per_page = 10
-    offset = (page - 1) * per_page
-
-    conn = db_connector.connect()
-    cursor = conn.cursor(dictionary=True)
-
-    # Обновленный запрос для получения средней оценки, количества рецензий и жанров
-    query = """
-        SELECT Books.*, 
-               AVG(Reviews.rating) AS avg_rating, 
-               COUNT(Reviews.id) AS review_count,
-               GROUP_CONCAT(Genres.name SEPARATOR ', ') AS genres
-        FROM Books
-        LEFT JOIN Reviews ON Books.id = Reviews.book_id
-        LEFT JOIN Book_genre ON Books.id = Book_genre.book_id
-        LEFT JOIN Genres ON Book_genre.genre_id = Genres.id
-        GROUP BY Books.id
-        ORDER BY year DESC
-        LIMIT %s OFFSET %s
-    """
-    cursor.execute(query, (per_page, offset))
-    books = cursor.fetchall()
-
-    cursor.execute('SELECT COUNT(*) AS count FROM Books')
-    total_books = cursor.fetchone()['count']
-    conn.close()
+    per_page = catalog.PER_PAGE
+    genre_id = request.args.get('genre', type=int)
+    year = request.args.get('year', type=int)
+
+    def load_books(cursor):
+        return catalog.load_page(
+            cursor, page=page, after=request.args.get('after'),
+            before=request.args.get('before'), per_page=per_page,
+            genre_id=genre_id, year=year)
+
+    def load_counts(cursor):
+        # Счётчики фильтров читаются из Catalog_facets, а не группировкой книг
+        catalog_facets = facets.load_facets(cursor)
+        if genre_id is None and year is None:
+            return catalog_facets, catalog.count_books(cursor)
+        return catalog_facets, facets.count_books(cursor, catalog_facets,
+                                                  genre_id, year)
+
+    # Переход по курсорам (?after=/?before=) не зависит от глубины страницы,
+    # /page/<page> оставлен для старых ссылок. Страница и количество книг
+    # читаются одновременно на разных соединениях
+    try:
+        (books, prev_cursor, next_cursor), (catalog_facets, total_books) = (
+            parallel_queries.run(load_books, load_counts))
+    except catalog.InvalidCursorError:
+        abort(400)
 
     total_pages = (total_books + per_page - 1) // per_page
+    if 'after' in request.args or 'before' in request.args:
+        page = None
 
+    filters = {'genre': genre_id, 'year': year}
+    args = {name: value for name, value in filters.items() if value is not None}
     return render_template('index.html', books=books, page=page,
-                           total_pages=total_pages, per_page=per_page)
+                           total_pages=total_pages, per_page=per_page,
+                           prev_cursor=prev_cursor, next_cursor=next_cursor,
+                           facets=catalog_facets, filters=filters, args=args)
 
 
-
-@app.route('/books/<int:book_id>')
+@db_connector.read_only
 def view_book(book_id):
-    conn = db_connector.connect()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT * FROM Books WHERE id = %s', (book_id,))
-    book = cursor.fetchone()
-
-    # Получение жанров книги
-    cursor.execute('SELECT Genres.name FROM Genres JOIN Book_genre ON Genres.id = Book_genre.genre_id WHERE Book_genre.book_id = %s', (book_id,))
-    genres = cursor.fetchall()
-    book['genres'] = [genre['name'] for genre in genres]
-
-    # Получение рецензий и имён пользователей
-    cursor.execute('SELECT Reviews.*, Users.login AS user_name FROM Reviews JOIN Users ON Reviews.user_id = Users.id WHERE book_id = %s', (book_id,))
-    reviews = cursor.fetchall()
-
-    # Получение пути к обложке книги
-    cursor.execute('SELECT file_name FROM Covers WHERE id = %s', (book['cover_id'],))
-    cover = cursor.fetchone()
-    book['cover_image'] = cover['file_name'] if cover else None
-
-    has_user_reviewed = False
-    if current_user.is_authenticated:
-        cursor.execute('SELECT * FROM Reviews WHERE book_id = %s AND user_id = %s', (book_id, current_user.id))
-        user_review = cursor.fetchone()
-        has_user_reviewed = user_review is not None
-
-    conn.close()
-    return render_template('view_book.html', book=book, reviews=reviews, has_user_reviewed=has_user_reviewed)
-
+    user_id = current_user.id if current_user.is_authenticated else None
+    review_order = request.args.get('order', 'newest')
+    if review_order not in catalog.REVIEW_ORDERS:
+        abort(400)
+
+    if parallel_queries.enabled:
+        # Карточка, первая порция рецензий и похожие книги зависят только
+        # от book_id и читаются одновременно
+        book, (reviews, reviews_cursor), similar = parallel_queries.run(
+            lambda cursor: catalog.load_book(cursor, book_id, user_id),
+            lambda cursor: catalog.load_reviews(cursor, book_id, review_order),
+            lambda cursor: catalog.load_similar(cursor, book_id))
+        if book is not None:
+            book.reviews, book.reviews_cursor = reviews, reviews_cursor
+            book.similar = similar
+    else:
+        with db_connector.connect().cursor(dictionary=True) as cursor:
+            book = catalog.load_book_detail(cursor, book_id, user_id, review_order)
+
+    if book is None:
+        abort(404)
+    return render_template('view_book.html', book=book, reviews=book.reviews,
+                           has_user_reviewed=book.has_user_reviewed,
+                           review_order=review_order)
+
+
+@db_connector.read_only
+def book_reviews(book_id):
+    # Следующая порция рецензий для подгрузки при прокрутке страницы книги
+    review_order = request.args.get('order', 'newest')
+    if review_order not in catalog.REVIEW_ORDERS:
+        abort(400)
+
+    with db_connector.connect().cursor(dictionary=True) as cursor:
+        try:
+            reviews, next_cursor = catalog.load_reviews(
+                cursor, book_id, review_order, after=request.args.get('after'))
+        except catalog.InvalidCursorError:
+            abort(400)
 
+    render_reviews = get_template_attribute('reviews.html', 'render_reviews')
+    return jsonify(html=str(render_reviews(reviews)), next_cursor=next_cursor)
 
 
-@app.route('/books/create', methods=['GET', 'POST'])
 @login_required
 def create_book():
     if not current_user.is_admin():
@@ -138,37 +203,26 @@ def create_book():
             cover_image = request.files['cover_image']
 
             if cover_image and cover_image.filename:
-                image_hash = generate_md5_hash(cover_image.read())
-                cover_image.seek(0)
-                cover_image_filename = secure_filename(cover_image.filename)  # Использование secure_filename
-
-                with db_connector.connect() as conn:  # Использование контекстного менеджера
+                # Обложка потоково сохраняется во временный файл с подсчётом MD5;
+                # в итоговый каталог она попадает под именем по хэшу содержимого
+                covers_dir = current_app.config['COVERS_DIR']
+                staged_cover = covers.stage_upload(
+                    cover_image.stream, current_app.config['COVERS_UPLOAD_DIR'],
+                    current_app.config['COVER_MAX_BYTES'])
+
+                # Использование контекстного менеджера
+                with staged_cover, db_connector.connect() as conn:
                     cursor = conn.cursor(dictionary=True)
-                    cursor.execute('SELECT * FROM Covers WHERE md5_hash = %s', (image_hash,))
-                    existing_image = cursor.fetchone()
-
-                    if existing_image:
-                        cover_id = existing_image['id']
-                    else:
-                        cover_image_directory = os.path.join('static', 'images')
-                        if not os.path.exists(cover_image_directory):
-                            os.makedirs(cover_image_directory)
-                        cover_image_path = os.path.join(cover_image_directory,
-                                                        cover_image_filename)
-
-                        cursor.execute('INSERT INTO Covers '
-                                       '(file_name, mime_type, md5_hash) '
-                                       'VALUES (%s, %s, %s)',
-                                       (cover_image_filename, cover_image.content_type,
-                                        image_hash))
-                        cover_id = cursor.lastrowid
-                        cover_image.save(cover_image_path)
+                    cover_id, created = covers.save_cover(conn, staged_cover)
 
                     # Транзакция для добавления книги и жанров
                     cursor.execute('INSERT INTO Books (title, short_description, '
+                                   'description_html, description_renderer, '
                                    'year, publisher, author, pages, cover_id) '
-                                   'VALUES (%s, %s, %s, %s, %s, %s, %s)',
-                                   (title, short_description, year,
+                                   'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                                   (title, short_description,
+                                    rendering.render(short_description),
+                                    rendering.RENDERER_VERSION, year,
                                     publisher, author, page_count, cover_id))
                     book_id = cursor.lastrowid
 
@@ -176,25 +230,36 @@ def create_book():
                         cursor.execute('INSERT INTO Book_genre (book_id, genre_id) '
                                        'VALUES (%s, %s)',
                                        (book_id, genre_id))
+                    book_stats.set_genres(cursor, book_id, genres)
+                    facets.book_added(cursor, int(year) if year else None, genres)
+                    similar_books.book_changed(cursor, book_id)
+
+                    # Одинаковые файлы имеют одно имя, поэтому одновременные
+                    # загрузки одной обложки безопасно перезаписывают друг друга
+                    if created:
+                        staged_cover.publish(covers_dir)
                     conn.commit()  # Одно подтверждение транзакции
-                    flash('Книга успешно добавлена.')
-                    return redirect(url_for('index'))
+
+                catalog.total_books.invalidate()
+                facets.invalidate()
+                similar_books.schedule_refresh()
+                flash('Книга успешно добавлена.')
+                return redirect(url_for('index'))
             else:
                 flash('Невозможно добавить книгу без обложки')
                 return redirect(url_for('create_book'))
+        except covers.CoverError as e:
+            flash(str(e))
+            return redirect(url_for('create_book'))
         except Exception as e:
             flash(f'Произошла ошибка: {e}')
             return redirect(url_for('create_book'))
 
-    # Получение жанров вынесено за пределы POST запроса для их отображения в форме
-    with db_connector.connect() as conn:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT id, name FROM Genres')
-        genres = cursor.fetchall()
+    # Жанры для формы берутся из справочника в памяти
+    genres = reference_data.get('genres')
     return render_template('create_book.html', genres=genres)
 
 
-@app.route('/books/<int:book_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_book(book_id):
     if not current_user.is_admin() and not current_user.is_moderator():
@@ -205,110 +270,126 @@ def edit_book(book_id):
     cursor = conn.cursor(dictionary=True)
     cursor.execute('SELECT * FROM Books WHERE id = %s', (book_id,))
     book = cursor.fetchone()
+    if book is None:
+        conn.close()
+        abort(404)
 
     # Получение текущих жанров книги для отображения в форме
     cursor.execute('SELECT genre_id FROM Book_genre WHERE book_id = %s', (book_id,))
     book['genres'] = [genre['genre_id'] for genre in cursor.fetchall()]
+    cursor.close()
 
-    cursor.execute('SELECT id, name FROM Genres')
-    genres = cursor.fetchall()
+    genres = reference_data.get('genres')
 
     if request.method == 'POST':
         try:
             title = request.form['title']
-            genres = request.form.getlist('genres')
+            genre_ids = {int(genre_id) for genre_id in request.form.getlist('genres')}
             year = request.form['year']
             description = request.form['description']
             publisher = request.form['publisher']
             author = request.form['author']
             pages = request.form['pages']
 
-            cursor.execute('UPDATE Books SET title = %s, '
-                           'year = %s, short_description = %s, '
-                           'publisher = %s, author = %s, '
-                           'pages = %s WHERE id = %s',
-                           (title, year, description, publisher, author, pages, book_id))
-            conn.commit()
-
-            # Удаление всех текущих жанров для этой книги
-            cursor.execute('DELETE FROM Book_genre WHERE book_id = %s', (book_id,))
-            conn.commit()
-
-            # Вставка выбранных жанров для этой книги
-            for genre_id in genres:
-                cursor.execute('INSERT INTO Book_genre (book_id, genre_id) VALUES (%s, %s)', (book_id, genre_id))
-                conn.commit()
+            # Книга и её жанры изменяются одной транзакцией
+            with db_connector.transaction() as unit:
+                unit.cursor.execute('SELECT year FROM Books WHERE id = %s FOR UPDATE',
+                                    (book_id,))
+                old_year = unit.cursor.fetchone()['year']
+                unit.cursor.execute('UPDATE Books SET title = %s, '
+                                    'year = %s, short_description = %s, '
+                                    'description_html = %s, '
+                                    'description_renderer = %s, '
+                                    'publisher = %s, author = %s, '
+                                    'pages = %s WHERE id = %s',
+                                    (title, year, description,
+                                     rendering.render(description),
+                                     rendering.RENDERER_VERSION, publisher, author,
+                                     pages, book_id))
+
+                # Изменяются только добавленные и удалённые жанры
+                unit.cursor.execute('SELECT genre_id FROM Book_genre '
+                                    'WHERE book_id = %s FOR UPDATE', (book_id,))
+                current_ids = {row['genre_id'] for row in unit.cursor.fetchall()}
+                removed = current_ids - genre_ids
+                added = genre_ids - current_ids
+                if removed:
+                    unit.cursor.executemany(
+                        'DELETE FROM Book_genre WHERE book_id = %s AND genre_id = %s',
+                        [(book_id, genre_id) for genre_id in removed])
+                if added:
+                    unit.cursor.executemany(
+                        'INSERT INTO Book_genre (book_id, genre_id) VALUES (%s, %s)',
+                        [(book_id, genre_id) for genre_id in added])
+                if removed or added:
+                    book_stats.set_genres(unit.cursor, book_id, genre_ids)
+                    similar_books.book_genres_changed(unit.cursor, book_id)
+                    unit.after_commit(similar_books.schedule_refresh)
+
+                new_year = int(year) if year else None
+                if removed or added or old_year != new_year:
+                    facets.book_changed(unit.cursor, old_year, new_year, added, removed)
+                    unit.after_commit(facets.invalidate)
 
             flash('Книга успешно обновлена.')
             return redirect(url_for('view_book', book_id=book_id))
         except Exception as e:
             flash(f'Произошла ошибка при редактировании книги: {e}')
             return redirect(url_for('edit_book', book_id=book_id))
-        finally:
-            conn.close()
 
-    conn.close()
     return render_template('edit_book.html', book=book, genres=genres)
 
 
-
-
-
-@app.route('/books/<int:book_id>/delete', methods=['GET'])
 @login_required
 def delete_book(book_id):
     if not current_user.is_admin():
         flash('У вас недостаточно прав для выполнения данного действия.')
         return redirect(url_for('index'))
 
-    conn = db_connector.connect()
-    cursor = conn.cursor(dictionary=True)
-
     try:
-        cursor.execute('SET foreign_key_checks = 0')
-        cursor.execute('SELECT * FROM Books WHERE id = %s', (book_id,))
-        book = cursor.fetchall()
-
-        if len(book) == 1:
-            book = book[0]
-            if book['cover_id']:
-                cursor.execute('SELECT file_name FROM Covers WHERE id = %s',
-                            (book['cover_id'],))
-                cover = cursor.fetchone()
-                if cover:
-                    cursor.execute('DELETE FROM Covers WHERE id = %s',
-                            (book['cover_id'],))
-                    conn.commit()
-                    cover_image_path = os.path.join('static', 'images', cover['file_name'])
-                    if os.path.exists(cover_image_path):
-                        os.remove(cover_image_path)
-
-            cursor.execute('DELETE FROM Reviews WHERE book_id = %s', (book_id,))
-            cursor.execute('DELETE FROM Book_genre WHERE book_id = %s', (book_id,))
-            cursor.execute('DELETE FROM Books WHERE id = %s', (book_id,))
-            conn.commit()
+        with db_connector.transaction() as unit:
+            cursor = unit.cursor
+            cursor.execute('SELECT Books.cover_id, Books.year, Covers.file_name '
+                           'FROM Books '
+                           'LEFT JOIN Covers ON Covers.id = Books.cover_id '
+                           'WHERE Books.id = %s FOR UPDATE', (book_id,))
+            book = cursor.fetchone()
+
+            if book is not None:
+                cursor.execute('SELECT genre_id FROM Book_genre WHERE book_id = %s',
+                               (book_id,))
+                facets.book_removed(cursor, book['year'],
+                                    [row['genre_id'] for row in cursor.fetchall()])
+                similar_books.book_removed(cursor, book_id)
+
+                # Жанры, рецензии и Book_stats удаляются каскадом (миграция 0006),
+                # обложка — после книги
+                cursor.execute('DELETE FROM Books WHERE id = %s', (book_id,))
+
+                # Одна обложка может принадлежать нескольким книгам
+                if book['cover_id']:
+                    cursor.execute('SELECT 1 FROM Books WHERE cover_id = %s LIMIT 1',
+                                   (book['cover_id'],))
+                    if cursor.fetchone() is None:
+                        cursor.execute('DELETE FROM Covers WHERE id = %s',
+                                       (book['cover_id'],))
+                        unit.after_commit(jobs.enqueue, 'covers.remove_file',
+                                          {'file_name': book['file_name']},
+                                          key=f'covers.remove_file:{book["cover_id"]}')
+                unit.after_commit(catalog.total_books.invalidate)
+                unit.after_commit(facets.invalidate)
+                unit.after_commit(similar_books.schedule_refresh)
+
+        if book is not None:
             flash('Книга и связанные записи успешно удалены.')
         else:
             flash('Книга не найдена.')
     except Exception as e:
-        conn.rollback()
         flash(f'Произошла ошибка при удалении книги: {e}')
-    finally:
-        cursor.execute('SET foreign_key_checks = 1')
-        cursor.close()
-        conn.close()
 
     return redirect(url_for('index'))
 
 
-def generate_md5_hash(file_data):
-    import hashlib
-    hash_md5 = hashlib.md5()
-    hash_md5.update(file_data)
-    return hash_md5.hexdigest()
-
-
-@app.route('/books/<int:book_id>/review', methods=['GET', 'POST'])
 @login_required
 def write_review(book_id):
     if request.method == 'POST':
@@ -318,14 +399,26 @@ def write_review(book_id):
         conn = db_connector.connect()
         cursor = conn.cursor()
         try:
-            cursor.execute('INSERT INTO Reviews (book_id, user_id, rating, review_text) VALUES (%s, %s, %s, %s)',
-                           (book_id, current_user.id, rating, review_text))
+            cursor.execute('INSERT INTO Reviews (book_id, user_id, rating, '
+                           'review_text, review_html, review_renderer) '
+                           'VALUES (%s, %s, %s, %s, %s, %s)',
+                           (book_id, current_user.id, rating, review_text,
+                            rendering.render(review_text), rendering.RENDERER_VERSION))
+            book_stats.add_review(cursor, book_id, rating)
+            similar_books.review_added(cursor, book_id, current_user.id, rating)
             conn.commit()
+            similar_books.schedule_refresh()
             flash('Рецензия успешно добавлена.')
             return redirect(url_for('view_book', book_id=book_id))
         except Exception as e:
+            conn.rollback()
+            # Повторная рецензия пользователя на книгу (uq_reviews_book_user)
+            if (isinstance(e, mysql.connector.IntegrityError)
+                    and e.errno == errorcode.ER_DUP_ENTRY):
+                flash('Вы уже оставили рецензию на эту книгу.')
+                return redirect(url_for('view_book', book_id=book_id))
             flash(f'Произошла ошибка при добавлении рецензии: {e}')
-            return redirect(url_for('review_book', book_id=book_id))
+            return redirect(url_for('write_review', book_id=book_id))
         finally:
             conn.close()
 
@@ -334,4 +427,8 @@ def write_review(book_id):
     cursor.execute('SELECT title FROM Books WHERE id = %s', (book_id,))
     book = cursor.fetchone()
     conn.close()
-    return render_template('write_review.html', book=book)
\ No newline at end of file
+    return render_template('write_review.html', book=book)
+
+
+if __name__ == '__main__':
+    create_app().run(debug=True)
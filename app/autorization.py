@@ -1,9 +1,13 @@
+import math
 from functools import wraps
 
+from cache import TTLCache
+from extensions import db_connector
 from flask import (
     Blueprint,
     current_app,
     flash,
+    make_response,
     redirect,
     render_template,
     request,
@@ -17,12 +21,15 @@ from flask_login import (
     login_user,
     logout_user,
 )
+from throttle import login_throttle
 from users_policy import UsersPolicy
 
-from app import db_connector
-
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+# id, login и role_id пользователей для user_loader. В других процессах
+# изменения видны не позже чем через USER_CACHE_TTL секунд.
+identity_cache = TTLCache()
+
 
 class User(UserMixin):
     def __init__(self, user_id, user_login, role_id):
@@ -48,16 +55,29 @@ def init_login_manager(app):
     login_manager.login_message = 'Авторизируйтесь для доступа на эту страницу.'
     login_manager.login_message_category = 'warning'
     login_manager.user_loader(load_user)
+    identity_cache.maxsize = app.config['USER_CACHE_SIZE']
+    identity_cache.ttl = app.config['USER_CACHE_TTL']
 
 
-def load_user(user_id):
-    with db_connector.connect().cursor(dictionary=True) as cursor:
-        query = 'SELECT * FROM Users WHERE id = %s'
+def fetch_identity(user_id):
+    # Промах кэша читается с основного сервера, даже в обработчике read_only:
+    # отстающая реплика после forget_user() вернула бы прежнюю роль, и она
+    # осталась бы в кэше на USER_CACHE_TTL секунд
+    with db_connector.connect_primary().cursor(dictionary=True) as cursor:
+        query = 'SELECT id, login, role_id FROM Users WHERE id = %s'
         cursor.execute(query, (user_id,))
-        user = cursor.fetchone()
+        return cursor.fetchone()
+
+
+def load_user(user_id):
+    user = identity_cache.get(int(user_id), lambda: fetch_identity(user_id))
     return User(user['id'], user['login'], user['role_id']) if user else None
 
 
+def forget_user(user_id):
+    identity_cache.invalidate(int(user_id))
+
+
 def can_user(action):
     def decorator(function):
         @wraps(function)
@@ -82,18 +102,30 @@ def login():
         password = request.form['password']
         remember = bool(request.form.get('remember'))
 
+        # Лишние попытки отклоняются до получения соединения с БД
+        retry_after = login_throttle.check(request.remote_addr, username)
+        if retry_after:
+            retry_after = math.ceil(retry_after)
+            flash(f'Слишком много попыток входа. Повторите через {retry_after} с.',
+                  category='danger')
+            response = make_response(render_template('login.html'), 429)
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+
         with db_connector.connect().cursor(dictionary=True) as cursor:
             query = 'SELECT * FROM Users WHERE login = %s AND password = SHA2(%s, 256)'
             cursor.execute(query, (username, password))
             user = cursor.fetchone()
 
         if user:
+            login_throttle.succeeded(request.remote_addr, username)
             user_obj = User(user['id'], user['login'], user['role_id'])
             login_user(user_obj, remember=remember)
             flash('Успешная авторизация!', category='success')
             ref_url = request.form.get('next')
             return redirect(ref_url) if ref_url else redirect(url_for('index'))
 
+        login_throttle.failed(request.remote_addr, username)
         flash('Неверный логин или пароль!', category='danger')
     return render_template('login.html')
 
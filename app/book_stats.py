@@ -0,0 +1,123 @@
+import click
+from extensions import db_connector
+from flask.cli import AppGroup
+
+cli = AppGroup('book-stats', help='Агрегаты по книгам (оценки, рецензии, жанры).')
+
+# Фактические значения агрегатов, посчитанные по исходным таблицам.
+# Коррелированные подзапросы не перемножают рецензии на жанры.
+ACTUAL_STATS_QUERY = """
+    SELECT Books.id AS book_id,
+           (SELECT COUNT(*) FROM Reviews
+            WHERE Reviews.book_id = Books.id) AS review_count,
+           (SELECT COALESCE(SUM(Reviews.rating), 0) FROM Reviews
+            WHERE Reviews.book_id = Books.id) AS rating_sum,
+           (SELECT COALESCE(GROUP_CONCAT(Book_genre.genre_id
+                                         ORDER BY Book_genre.genre_id), '')
+            FROM Book_genre
+            WHERE Book_genre.book_id = Books.id) AS genre_ids
+    FROM Books
+"""
+
+
+def format_genre_ids(genre_ids):
+    return ','.join(str(genre_id) for genre_id in sorted({int(i) for i in genre_ids}))
+
+
+def parse_genre_ids(value):
+    return [int(genre_id) for genre_id in value.split(',')] if value else []
+
+
+def genre_names(value, genres_by_id):
+    return ', '.join(genres_by_id[genre_id] for genre_id in parse_genre_ids(value)
+                     if genre_id in genres_by_id)
+
+
+def add_review(cursor, book_id, rating):
+    cursor.execute('INSERT INTO Book_stats (book_id, review_count, rating_sum) '
+                   'VALUES (%s, 1, %s) '
+                   'ON DUPLICATE KEY UPDATE review_count = review_count + 1, '
+                   'rating_sum = rating_sum + VALUES(rating_sum)',
+                   (book_id, rating))
+
+
+def remove_user_reviews(cursor, user_id):
+    # Вызывается до удаления пользователя: его рецензии удаляются каскадом
+    cursor.execute('UPDATE Book_stats '
+                   'JOIN (SELECT book_id, COUNT(*) AS review_count, '
+                   'SUM(rating) AS rating_sum FROM Reviews '
+                   'WHERE user_id = %s GROUP BY book_id) AS removed '
+                   'ON removed.book_id = Book_stats.book_id '
+                   'SET Book_stats.review_count = '
+                   'Book_stats.review_count - removed.review_count, '
+                   'Book_stats.rating_sum = Book_stats.rating_sum - removed.rating_sum',
+                   (user_id,))
+
+
+def set_genres(cursor, book_id, genre_ids):
+    cursor.execute('INSERT INTO Book_stats (book_id, genre_ids) VALUES (%s, %s) '
+                   'ON DUPLICATE KEY UPDATE genre_ids = VALUES(genre_ids)',
+                   (book_id, format_genre_ids(genre_ids)))
+
+
+def rebuild(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute('DELETE FROM Book_stats')
+        cursor.execute('INSERT INTO Book_stats '
+                       '(book_id, review_count, rating_sum, genre_ids) '
+                       f'{ACTUAL_STATS_QUERY}')
+        rebuilt = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return rebuilt
+
+
+def verify(conn):
+    with conn.cursor(dictionary=True) as cursor:
+        cursor.execute(f"""
+            SELECT actual.book_id,
+                   actual.review_count, Book_stats.review_count AS stored_review_count,
+                   actual.rating_sum, Book_stats.rating_sum AS stored_rating_sum,
+                   actual.genre_ids, Book_stats.genre_ids AS stored_genre_ids
+            FROM ({ACTUAL_STATS_QUERY}) AS actual
+            LEFT JOIN Book_stats ON Book_stats.book_id = actual.book_id
+            WHERE NOT (Book_stats.review_count <=> actual.review_count
+                       AND Book_stats.rating_sum <=> actual.rating_sum
+                       AND Book_stats.genre_ids <=> actual.genre_ids)
+        """)  # noqa: S608
+        mismatches = cursor.fetchall()
+
+        cursor.execute('SELECT Book_stats.book_id FROM Book_stats '
+                       'LEFT JOIN Books ON Books.id = Book_stats.book_id '
+                       'WHERE Books.id IS NULL')
+        orphans = [row['book_id'] for row in cursor.fetchall()]
+    return mismatches, orphans
+
+
+@cli.command('rebuild')
+def rebuild_command():
+    """Пересчитать агрегаты по всем книгам."""
+    rebuilt = rebuild(db_connector.connect())
+    click.echo(f'Пересчитано книг: {rebuilt}')
+
+
+@cli.command('verify')
+def verify_command():
+    """Сверить агрегаты с исходными таблицами."""
+    mismatches, orphans = verify(db_connector.connect())
+    for row in mismatches:
+        click.echo(f"Книга {row['book_id']}: "
+                   f"рецензий {row['stored_review_count']} != {row['review_count']}, "
+                   f"сумма оценок {row['stored_rating_sum']} != {row['rating_sum']}, "
+                   f"жанры '{row['stored_genre_ids']}' != '{row['genre_ids']}'")
+    for book_id in orphans:
+        click.echo(f'Лишняя запись для удалённой книги {book_id}')
+    if mismatches or orphans:
+        msg = 'Агрегаты расходятся с данными, выполните flask book-stats rebuild'
+        raise click.ClickException(msg)
+    click.echo('Агрегаты совпадают с данными')
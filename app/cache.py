@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CachedValue:
+    # Одно значение с временем жизни. Версия защищает от записи в кэш
+    # значения, загруженного до вызова invalidate().
+    def __init__(self, ttl=60) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires_at = 0.0
+        self._version = 0
+
+    def get(self, loader, ttl=None):
+        with self._lock:
+            if time.monotonic() < self._expires_at:
+                return self._value
+            version = self._version
+
+        value = loader()
+
+        with self._lock:
+            if version == self._version:
+                self._value = value
+                self._expires_at = time.monotonic() + (ttl or self.ttl)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._expires_at = 0.0
+            self._value = None
+
+
+class TTLCache:
+    # Ограниченный по размеру кэш с временем жизни записей; при
+    # переполнении вытесняются давно не использованные ключи.
+    def __init__(self, maxsize=1024, ttl=60) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.monotonic() < entry[0]:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = loader()
+
+        with self._lock:
+            if value is not None and generation == self._generation:
+                self._data[key] = (time.monotonic() + self.ttl, value)
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
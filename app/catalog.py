@@ -0,0 +1,320 @@
+from dataclasses import dataclass, field
+
+import book_stats
+import rendering
+from cache import CachedValue
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from markupsafe import Markup
+from reference_data import reference_data
+
+PER_PAGE = 10
+
+total_books = CachedValue()
+
+BOOK_LIST_QUERY = """
+    SELECT Books.id, Books.title, Books.year,
+           Book_stats.avg_rating,
+           COALESCE(Book_stats.review_count, 0) AS review_count,
+           Book_stats.genre_ids
+    FROM Books
+    LEFT JOIN Book_stats ON Book_stats.book_id = Books.id
+"""
+CATALOG_ORDER = (('Books.year', 'year', int), ('Books.id', 'id', int))
+
+# Карточка книги загружается за один вызов из трёх запросов:
+# книга с обложкой, жанрами и признаком рецензии текущего пользователя,
+# первая порция рецензий с логинами авторов и похожие книги.
+BOOK_DETAIL_QUERY = """
+    SELECT Books.id, Books.title, Books.short_description, Books.description_html,
+           Books.year,
+           Books.publisher, Books.author, Books.pages, Books.cover_id,
+           Covers.file_name AS cover_image, Covers.md5_hash AS cover_hash,
+           (SELECT GROUP_CONCAT(Genres.name ORDER BY Genres.name SEPARATOR '\n')
+            FROM Book_genre
+            JOIN Genres ON Genres.id = Book_genre.genre_id
+            WHERE Book_genre.book_id = Books.id) AS genres,
+           EXISTS(SELECT 1 FROM Reviews
+                  WHERE Reviews.book_id = Books.id
+                  AND Reviews.user_id = %(user_id)s) AS has_user_reviewed
+    FROM Books
+    LEFT JOIN Covers ON Covers.id = Books.cover_id
+    WHERE Books.id = %(book_id)s
+"""
+
+# Соседи книги из Book_similar (similar_books.py) в порядке сходства
+SIMILAR_BOOKS_QUERY = """
+    SELECT Books.id, Books.title, Books.author, Covers.md5_hash AS cover_hash
+    FROM Book_similar
+    JOIN Books ON Books.id = Book_similar.similar_book_id
+    LEFT JOIN Covers ON Covers.id = Books.cover_id
+    WHERE Book_similar.book_id = %(book_id)s
+    ORDER BY Book_similar.`rank`
+"""
+
+REVIEWS_PER_PAGE = 20
+REVIEW_LIST_QUERY = """
+    SELECT Reviews.id, Reviews.rating, Reviews.review_text, Reviews.review_html,
+           Users.login AS user_name
+    FROM Reviews
+    JOIN Users ON Users.id = Reviews.user_id
+"""
+# Оба порядка читаются по индексам Reviews: (book_id) — id в InnoDB
+# входит в каждый вторичный индекс — и ix_reviews_book_rating (book_id, rating)
+REVIEW_ORDERS = {
+    'newest': (('Reviews.id', 'id', int),),
+    'rating': (('Reviews.rating', 'rating', int), ('Reviews.id', 'id', int)),
+}
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+@dataclass
+class Review:
+    id: int
+    user_name: str
+    rating: int
+    review_text: str
+    review_html: Markup
+
+
+@dataclass
+class SimilarBook:
+    id: int
+    title: str
+    author: str
+    cover_hash: str | None
+
+
+@dataclass
+class BookDetail:
+    id: int
+    title: str
+    short_description: str
+    description_html: Markup
+    year: int
+    publisher: str
+    author: str
+    pages: int
+    cover_id: int | None
+    cover_image: str | None
+    cover_hash: str | None
+    genres: list[str] = field(default_factory=list)
+    reviews: list[Review] = field(default_factory=list)
+    reviews_cursor: str | None = None
+    has_user_reviewed: bool = False
+    similar: list[SimilarBook] = field(default_factory=list)
+
+
+def _serializer(salt):
+    return URLSafeSerializer(current_app.secret_key, salt=salt)
+
+
+def encode_cursor(values, salt='catalog-cursor'):
+    return _serializer(salt).dumps(list(values))
+
+
+def decode_cursor(token, salt='catalog-cursor', size=2):
+    try:
+        values = _serializer(salt).loads(token)
+    except (BadSignature, TypeError, ValueError) as e:
+        msg = 'Некорректный курсор страницы'
+        raise InvalidCursorError(msg) from e
+    if not isinstance(values, list) or len(values) != size:
+        msg = 'Некорректный курсор страницы'
+        raise InvalidCursorError(msg)
+    return values
+
+
+def count_books(cursor):
+    def load():
+        cursor.execute('SELECT COUNT(*) AS count FROM Books')
+        return cursor.fetchone()['count']
+
+    return total_books.get(load, ttl=current_app.config.get('CATALOG_COUNT_TTL'))
+
+
+def order_sql(order_by, direction='DESC'):
+    return ', '.join(f'{sql} {direction}' for sql, _, _ in order_by)
+
+
+def row_cursor(row, order_by, salt='catalog-cursor'):
+    return encode_cursor([row[name] for _, name, _ in order_by], salt)
+
+
+def fetch_keyset_page(cursor, query, order_by, *, conditions=(), params=None,
+                      page=1, after=None, before=None, per_page=PER_PAGE,
+                      salt='catalog-cursor'):
+    # Строки упорядочены по убыванию ключей order_by: ((выражение, поле, тип), ...),
+    # последний ключ делает порядок однозначным. Курсоры after/before содержат
+    # ключ последней/первой строки соседней страницы, поэтому переход не
+    # зависит от глубины; номер page используется только без курсора.
+    params = dict(params or {})
+    conditions = list(conditions)
+
+    token = after if after is not None else before
+    if token is not None:
+        values = decode_cursor(token, salt, len(order_by))
+        op = '<' if after is not None else '>'
+        seek = []
+        for index, (sql, _, value_type) in enumerate(order_by):
+            try:
+                params[f'seek_{index}'] = value_type(values[index])
+            except (TypeError, ValueError) as e:
+                msg = 'Некорректный курсор страницы'
+                raise InvalidCursorError(msg) from e
+            equal = [f'{order_by[prev][0]} = %(seek_{prev})s' for prev in range(index)]
+            seek.append(f'({" AND ".join([*equal, f"{sql} {op} %(seek_{index})s"])})')
+        conditions.append(f'({" OR ".join(seek)})')
+
+    direction = 'ASC' if before is not None else 'DESC'
+    where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+    limit = 'LIMIT %(limit)s'
+    params['limit'] = per_page + 1
+    if token is None:
+        limit += ' OFFSET %(offset)s'
+        params['offset'] = (max(page, 1) - 1) * per_page
+
+    cursor.execute(f"""{query} {where}
+        ORDER BY {order_sql(order_by, direction)}
+        {limit}
+    """, params)  # noqa: S608
+    rows = cursor.fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if before is not None:
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    elif after is not None:
+        has_prev, has_next = True, has_more
+    else:
+        has_prev, has_next = page > 1, has_more
+
+    prev_cursor = row_cursor(rows[0], order_by, salt) if rows and has_prev else None
+    next_cursor = row_cursor(rows[-1], order_by, salt) if rows and has_next else None
+    return rows, prev_cursor, next_cursor
+
+
+def attach_genre_names(books):
+    genres_by_id = reference_data.names_by_id('genres')
+    for book in books:
+        book['genres'] = book_stats.genre_names(book.pop('genre_ids'), genres_by_id)
+
+
+def load_page(cursor, page=1, after=None, before=None, per_page=PER_PAGE,
+              genre_id=None, year=None):
+    # Книги упорядочены по (year, id); id делает порядок стабильным
+    # при одинаковых годах
+    conditions = []
+    params = {}
+    if genre_id is not None:
+        conditions.append('EXISTS (SELECT 1 FROM Book_genre '
+                          'WHERE Book_genre.book_id = Books.id '
+                          'AND Book_genre.genre_id = %(genre_id)s)')
+        params['genre_id'] = genre_id
+    if year is not None:
+        conditions.append('Books.year = %(year)s')
+        params['year'] = year
+
+    books, prev_cursor, next_cursor = fetch_keyset_page(
+        cursor, BOOK_LIST_QUERY, CATALOG_ORDER, conditions=conditions,
+        params=params, page=page, after=after, before=before, per_page=per_page)
+    attach_genre_names(books)
+    return books, prev_cursor, next_cursor
+
+
+def _review(row):
+    return Review(id=row['id'], user_name=row['user_name'], rating=row['rating'],
+                  review_text=row['review_text'],
+                  review_html=rendering.stored_html(row['review_html'],
+                                                    row['review_text']))
+
+
+def load_reviews(cursor, book_id, order='newest', after=None,
+                 per_page=REVIEWS_PER_PAGE):
+    rows, _, next_cursor = fetch_keyset_page(
+        cursor, REVIEW_LIST_QUERY, REVIEW_ORDERS[order],
+        conditions=['Reviews.book_id = %(book_id)s'], params={'book_id': book_id},
+        after=after, per_page=per_page, salt=f'reviews-cursor-{order}')
+    return [_review(row) for row in rows], next_cursor
+
+
+def _similar_book(row):
+    return SimilarBook(id=row['id'], title=row['title'], author=row['author'],
+                       cover_hash=row['cover_hash'])
+
+
+def load_similar(cursor, book_id):
+    cursor.execute(SIMILAR_BOOKS_QUERY, {'book_id': book_id})
+    return [_similar_book(row) for row in cursor.fetchall()]
+
+
+def _book_detail(row, review_rows=(), reviews_cursor=None, similar_rows=()):
+    return BookDetail(
+        id=row['id'],
+        title=row['title'],
+        short_description=row['short_description'],
+        description_html=rendering.stored_html(row['description_html'],
+                                               row['short_description']),
+        year=row['year'],
+        publisher=row['publisher'],
+        author=row['author'],
+        pages=row['pages'],
+        cover_id=row['cover_id'],
+        cover_image=row['cover_image'],
+        cover_hash=row['cover_hash'],
+        genres=row['genres'].split('\n') if row['genres'] else [],
+        reviews=[_review(review) for review in review_rows],
+        reviews_cursor=reviews_cursor,
+        has_user_reviewed=bool(row['has_user_reviewed']),
+        similar=[_similar_book(similar) for similar in similar_rows],
+    )
+
+
+def load_book(cursor, book_id, user_id=None):
+    # Карточка без рецензий: при параллельной загрузке рецензии читаются
+    # load_reviews на другом соединении
+    cursor.execute(BOOK_DETAIL_QUERY, {'book_id': book_id, 'user_id': user_id})
+    row = cursor.fetchone()
+    return _book_detail(row) if row is not None else None
+
+
+def load_book_detail(cursor, book_id, user_id=None, review_order='newest',
+                     reviews_per_page=REVIEWS_PER_PAGE):
+    # Первая порция рецензий совпадает с тем, что вернул бы load_reviews
+    # без курсора, остальные страница подгружает по курсору
+    order_by = REVIEW_ORDERS[review_order]
+    query = f"""{BOOK_DETAIL_QUERY};
+        {REVIEW_LIST_QUERY}
+        WHERE Reviews.book_id = %(book_id)s
+        ORDER BY {order_sql(order_by)}
+        LIMIT %(reviews_limit)s;
+        {SIMILAR_BOOKS_QUERY}
+    """
+    results = cursor.execute(query, {'book_id': book_id, 'user_id': user_id,
+                                     'reviews_limit': reviews_per_page + 1},
+                             multi=True)
+    book_rows, review_rows, similar_rows = [], [], []
+    for index, result in enumerate(results):
+        if result.with_rows:
+            rows = result.fetchall()
+            if index == 0:
+                book_rows = rows
+            elif index == 1:
+                review_rows = rows
+            else:
+                similar_rows = rows
+
+    if not book_rows:
+        return None
+
+    reviews_cursor = None
+    if len(review_rows) > reviews_per_page:
+        review_rows = review_rows[:reviews_per_page]
+        reviews_cursor = row_cursor(review_rows[-1], order_by,
+                                    f'reviews-cursor-{review_order}')
+
+    return _book_detail(book_rows[0], review_rows, reviews_cursor, similar_rows)
@@ -0,0 +1,398 @@
+import csv
+import io
+import json
+import os
+import time
+
+import book_stats
+import catalog
+import click
+import covers
+import facets
+import rendering
+import similar_books
+from extensions import db_connector
+from flask import (
+    Blueprint,
+    current_app,
+    flash,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+from flask.cli import with_appcontext
+from flask_login import current_user, login_required
+from reference_data import reference_data
+
+bp = Blueprint('catalog_import', __name__)
+
+REQUIRED_FIELDS = ('title', 'author', 'publisher', 'year', 'pages')
+# Сколько ошибок показывать администратору после загрузки через форму
+REJECTS_SHOWN = 5
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportStats:
+    def __init__(self, offset=0) -> None:
+        self.offset = offset
+        self.imported = 0
+        self.rejected = 0
+        self.started_at = time.monotonic()
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started_at
+        return (self.imported + self.rejected) / elapsed if elapsed > 0 else 0.0
+
+
+def read_rows(stream, fmt):
+    # Строки читаются по одной, файл целиком в память не загружается
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield {'_error': f'Некорректный JSON: {e}'}
+
+
+def detect_format(file_name):
+    return 'csv' if file_name.lower().endswith('.csv') else 'jsonl'
+
+
+class CatalogImporter:
+    # Книги вставляются пачками по batch_size строк через executemany,
+    # транзакция подтверждается каждые transaction_size строк входного файла.
+    # После подтверждения вызывается on_commit(stats) — по stats.offset
+    # можно продолжить прерванный импорт.
+    def __init__(self, conn, *, batch_size=1000, transaction_size=10000,
+                 covers_source=None, rejects=None, on_commit=None) -> None:
+        self.conn = conn
+        self.batch_size = batch_size
+        self.transaction_size = transaction_size
+        self.covers_source = covers_source
+        self.rejects = rejects
+        self.on_commit = on_commit
+        self._genre_ids = {}
+        self._pending_rejects = []
+        self._staged_covers = []
+        self._id_step = 1
+
+    def run(self, rows, start_offset=0):
+        stats = ImportStats(start_offset)
+        genres = reference_data.get('genres')
+        self._genre_ids = {genre['name'].strip().lower(): genre['id']
+                           for genre in genres}
+        self._genre_ids.update({str(genre['id']): genre['id'] for genre in genres})
+
+        batch = []
+        rows_in_transaction = 0
+        cursor = self.conn.cursor()
+        try:
+            # Шаг автоинкремента сервера (больше 1 в кластерах с несколькими
+            # источниками записи) нужен, чтобы восстановить id вставленных книг
+            cursor.execute('SELECT @@auto_increment_increment')
+            self._id_step = int(cursor.fetchone()[0])
+            for offset, row in enumerate(rows):
+                if offset < start_offset:
+                    continue
+                try:
+                    batch.append((offset, row, self._validate(row)))
+                except RowError as e:
+                    self._reject(stats, offset, row, e)
+                rows_in_transaction += 1
+
+                if len(batch) >= self.batch_size:
+                    self._insert_batch(cursor, stats, batch)
+                    batch = []
+                if rows_in_transaction >= self.transaction_size:
+                    self._insert_batch(cursor, stats, batch)
+                    batch = []
+                    self._commit(stats, offset + 1)
+                    rows_in_transaction = 0
+
+            self._insert_batch(cursor, stats, batch)
+            self._commit(stats, stats.offset + rows_in_transaction)
+        except BaseException:
+            self.conn.rollback()
+            self._discard_covers()
+            raise
+        finally:
+            cursor.close()
+        return stats
+
+    def _validate(self, row):
+        if '_error' in row:
+            raise RowError(row['_error'])
+        missing = [name for name in REQUIRED_FIELDS
+                   if not str(row.get(name) or '').strip()]
+        if missing:
+            msg = f'Не заполнены поля: {", ".join(missing)}'
+            raise RowError(msg)
+        try:
+            year = int(row['year'])
+            pages = int(row['pages'])
+        except (TypeError, ValueError) as e:
+            msg = 'Год и объём должны быть целыми числами'
+            raise RowError(msg) from e
+
+        raw_genres = row.get('genres') or []
+        if isinstance(raw_genres, str):
+            raw_genres = [name for name in raw_genres.split(';') if name.strip()]
+        genre_ids = []
+        for name in raw_genres:
+            genre_id = self._genre_ids.get(str(name).strip().lower())
+            if genre_id is None:
+                msg = f'Неизвестный жанр: {name}'
+                raise RowError(msg)
+            genre_ids.append(genre_id)
+
+        cover_md5 = (row.get('cover_md5') or '').strip().lower() or None
+        cover_file = (row.get('cover') or '').strip() or None
+        if cover_file and self.covers_source is None:
+            msg = 'Файлы обложек можно указывать только при импорте из командной строки'
+            raise RowError(msg)
+
+        return {
+            'title': row['title'].strip(),
+            'short_description': (row.get('short_description')
+                                  or row.get('description') or '').strip(),
+            'year': year,
+            'publisher': row['publisher'].strip(),
+            'author': row['author'].strip(),
+            'pages': pages,
+            'genre_ids': sorted(set(genre_ids)),
+            'cover_md5': cover_md5,
+            'cover_file': cover_file,
+        }
+
+    def _stage_cover(self, book):
+        path = os.path.join(self.covers_source, book['cover_file'])
+        try:
+            with open(path, 'rb') as stream:
+                staged = covers.stage_upload(stream,
+                                             current_app.config['COVERS_UPLOAD_DIR'],
+                                             current_app.config['COVER_MAX_BYTES'])
+        except OSError as e:
+            msg = f'Не удалось прочитать обложку {book["cover_file"]}: {e}'
+            raise RowError(msg) from e
+        except covers.CoverError as e:
+            raise RowError(str(e)) from e
+        book['cover_md5'] = staged.md5_hash
+        return staged
+
+    def _resolve_covers(self, cursor, stats, batch):
+        # Обложки сверяются с Covers по md5 одним запросом на пачку;
+        # новые файлы публикуются перед подтверждением транзакции
+        staged_by_hash = {}
+        resolved = []
+        for offset, row, book in batch:
+            if book['cover_file']:
+                try:
+                    staged = self._stage_cover(book)
+                except RowError as e:
+                    self._reject(stats, offset, row, e)
+                    continue
+                if staged.md5_hash in staged_by_hash:
+                    staged.discard()
+                else:
+                    staged_by_hash[staged.md5_hash] = staged
+            resolved.append((offset, row, book))
+
+        hashes = {book['cover_md5'] for _, _, book in resolved if book['cover_md5']}
+        cover_ids = self._find_covers(cursor, hashes)
+
+        new_covers = [staged for md5_hash, staged in staged_by_hash.items()
+                      if md5_hash not in cover_ids]
+        for staged in staged_by_hash.values():
+            if staged.md5_hash in cover_ids:
+                staged.discard()
+        if new_covers:
+            cursor.executemany('INSERT INTO Covers (file_name, mime_type, md5_hash) '
+                               'VALUES (%s, %s, %s)',
+                               [(staged.file_name, staged.mime_type, staged.md5_hash)
+                                for staged in new_covers])
+            cover_ids.update(self._find_covers(cursor, {staged.md5_hash
+                                                        for staged in new_covers}))
+            self._staged_covers.extend(new_covers)
+
+        books = []
+        for offset, row, book in resolved:
+            if book['cover_md5'] and book['cover_md5'] not in cover_ids:
+                self._reject(stats, offset, row,
+                             RowError(f'Обложка {book["cover_md5"]} не найдена'))
+                continue
+            book['cover_id'] = cover_ids.get(book['cover_md5'])
+            books.append(book)
+        return books
+
+    @staticmethod
+    def _find_covers(cursor, hashes):
+        if not hashes:
+            return {}
+        placeholders = ', '.join(['%s'] * len(hashes))
+        cursor.execute('SELECT md5_hash, id FROM Covers '
+                       f'WHERE md5_hash IN ({placeholders})', tuple(hashes))  # noqa: S608
+        return dict(cursor.fetchall())
+
+    def _insert_batch(self, cursor, stats, batch):
+        if not batch:
+            return
+        books = self._resolve_covers(cursor, stats, batch)
+        if not books:
+            return
+
+        # Пачка вставляется одним многострочным INSERT: InnoDB выделяет такому
+        # запросу (с известным числом строк) id одним блоком, начиная
+        # с lastrowid, с шагом auto_increment_increment
+        values = ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(books))
+        cursor.execute('INSERT INTO Books (title, short_description, '
+                       'description_html, description_renderer, year, '
+                       'publisher, author, pages, cover_id) '
+                       f'VALUES {values}',
+                       [value for book in books
+                        for value in (book['title'], book['short_description'],
+                                      rendering.render(book['short_description']),
+                                      rendering.RENDERER_VERSION, book['year'],
+                                      book['publisher'], book['author'],
+                                      book['pages'], book['cover_id'])])
+        first_id = cursor.lastrowid
+        book_ids = range(first_id, first_id + len(books) * self._id_step, self._id_step)
+
+        book_genres = [(book_id, genre_id)
+                       for book_id, book in zip(book_ids, books, strict=True)
+                       for genre_id in book['genre_ids']]
+        if book_genres:
+            cursor.executemany('INSERT INTO Book_genre (book_id, genre_id) '
+                               'VALUES (%s, %s)', book_genres)
+        cursor.executemany('INSERT INTO Book_stats (book_id, genre_ids) '
+                           'VALUES (%s, %s)',
+                           [(book_id, book_stats.format_genre_ids(book['genre_ids']))
+                            for book_id, book in zip(book_ids, books, strict=True)])
+        facets.books_added(cursor, books)
+        similar_books.books_changed(cursor, book_ids)
+        stats.imported += len(books)
+
+    def _commit(self, stats, offset):
+        for staged in self._staged_covers:
+            staged.publish(current_app.config['COVERS_DIR'])
+        self._staged_covers = []
+        self.conn.commit()
+
+        stats.offset = offset
+        if self.rejects is not None:
+            for line in self._pending_rejects:
+                self.rejects.write(line)
+            self.rejects.flush()
+        self._pending_rejects = []
+        catalog.total_books.invalidate()
+        facets.invalidate()
+        similar_books.schedule_refresh()
+        if self.on_commit is not None:
+            self.on_commit(stats)
+
+    def _reject(self, stats, offset, row, error):
+        stats.rejected += 1
+        self._pending_rejects.append(json.dumps(
+            {'offset': offset, 'error': str(error), 'row': row},
+            ensure_ascii=False, default=str) + '\n')
+
+    def _discard_covers(self):
+        for staged in self._staged_covers:
+            staged.discard()
+        self._staged_covers = []
+
+
+def read_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return 0
+    with open(path, encoding='utf-8') as checkpoint:
+        return json.load(checkpoint)['offset']
+
+
+def write_checkpoint(path, stats):
+    # Запись через временный файл, чтобы прерывание не испортило контрольную точку
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as checkpoint:
+        json.dump({'offset': stats.offset, 'imported': stats.imported,
+                   'rejected': stats.rejected}, checkpoint)
+    os.replace(temp_path, path)
+
+
+@click.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+              help='Формат файла (по умолчанию по расширению).')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Строк в одном executemany.')
+@click.option('--transaction-size', default=10000, show_default=True,
+              help='Строк входного файла в одной транзакции.')
+@click.option('--rejects', type=click.Path(dir_okay=False),
+              help='Файл для отклонённых строк (по умолчанию PATH.rejects.jsonl).')
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='Файл контрольной точки (по умолчанию PATH.checkpoint).')
+@click.option('--covers-dir', type=click.Path(exists=True, file_okay=False),
+              help='Каталог с файлами обложек из колонки cover.')
+@with_appcontext
+def import_books_command(path, fmt, batch_size, transaction_size, rejects,
+                         checkpoint, covers_dir):
+    """Импортировать книги из CSV или JSONL."""
+    fmt = fmt or detect_format(path)
+    rejects = rejects or f'{path}.rejects.jsonl'
+    checkpoint = checkpoint or f'{path}.checkpoint'
+    start_offset = read_checkpoint(checkpoint)
+    if start_offset:
+        click.echo(f'Продолжение со строки {start_offset}')
+
+    def report(stats):
+        write_checkpoint(checkpoint, stats)
+        click.echo(f'Обработано строк: {stats.offset}, добавлено: {stats.imported}, '
+                   f'отклонено: {stats.rejected}, {stats.rate:.0f} строк/с')
+
+    with open(path, encoding='utf-8-sig', newline='') as source, \
+            open(rejects, 'a', encoding='utf-8') as rejects_file:
+        importer = CatalogImporter(db_connector.connect(), batch_size=batch_size,
+                                   transaction_size=transaction_size,
+                                   covers_source=covers_dir, rejects=rejects_file,
+                                   on_commit=report)
+        stats = importer.run(read_rows(source, fmt), start_offset)
+
+    click.echo(f'Импорт завершён: добавлено {stats.imported}, '
+               f'отклонено {stats.rejected} (см. {rejects})')
+
+
+@bp.route('/books/import', methods=['GET', 'POST'])
+@login_required
+def import_books():
+    if not current_user.is_admin():
+        flash('У вас недостаточно прав для выполнения данного действия.')
+        return redirect(url_for('index'))
+
+    if request.method == 'POST':
+        upload = request.files.get('catalog')
+        if not upload or not upload.filename:
+            flash('Выберите файл каталога')
+            return redirect(url_for('catalog_import.import_books'))
+
+        rejects = io.StringIO()
+        source = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        importer = CatalogImporter(db_connector.connect(), rejects=rejects)
+        try:
+            stats = importer.run(read_rows(source, detect_format(upload.filename)))
+        except Exception as e:  # noqa: BLE001
+            flash(f'Произошла ошибка при импорте: {e}')
+            return redirect(url_for('catalog_import.import_books'))
+
+        flash(f'Добавлено книг: {stats.imported}, отклонено строк: {stats.rejected}.')
+        for line in rejects.getvalue().splitlines()[:REJECTS_SHOWN]:
+            reject = json.loads(line)
+            flash(f'Строка {reject["offset"] + 1}: {reject["error"]}', 'warning')
+        return redirect(url_for('catalog_import.import_books'))
+
+    return render_template('import_books.html')
@@ -6,9 +6,152 @@ load_dotenv()
 
 SECRET_KEY = os.getenv('SECRET_KEY')
 
-MYSQL_USER = 'std_2585_exam'
-MYSQL_DATABASE = 'std_2585_exam'
-MYSQL_PASSWORD = '12345678'
-MYSQL_HOST = 'std-mysql.ist.mospolytech.ru'
+# Параметры подключения задаются в окружении или в .env (см. .env.template);
+# без MYSQL_USER, MYSQL_HOST и MYSQL_DATABASE приложение не запускается
+MYSQL_USER = os.getenv('MYSQL_USER')
+MYSQL_DATABASE = os.getenv('MYSQL_DATABASE')
+MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD')
+MYSQL_HOST = os.getenv('MYSQL_HOST')
 ADMIN_ROLE_ID = 1
 MODERATOR_ROLE_ID = 2
+
+# Реплики для чтения: адреса host[:port] через запятую (пусто — все запросы
+# на MYSQL_HOST). Обработчики с db_connector.read_only читают с реплик;
+# после записи сессия DB_READ_AFTER_WRITE_WINDOW секунд читает с основного
+# сервера. Реплика, отстающая больше DB_REPLICA_MAX_LAG секунд, исключается
+# из ротации; отставание проверяется раз в DB_REPLICA_CHECK_INTERVAL секунд
+# (пользователю БД нужна привилегия REPLICATION CLIENT).
+MYSQL_REPLICA_HOSTS = [host.strip() for host
+                       in os.getenv('MYSQL_REPLICA_HOSTS', '').split(',')
+                       if host.strip()]
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', '5'))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', '5'))
+DB_READ_AFTER_WRITE_WINDOW = float(os.getenv('DB_READ_AFTER_WRITE_WINDOW', '5'))
+
+# Пул соединений с БД
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '3600'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+
+# Время жизни закэшированного количества книг в каталоге, секунды
+CATALOG_COUNT_TTL = int(os.getenv('CATALOG_COUNT_TTL', '60'))
+
+# Кэш данных пользователей для flask-login (количество записей, секунды)
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '60'))
+
+# Время жизни справочников (жанры, роли) в памяти, секунды
+REFERENCE_DATA_TTL = int(os.getenv('REFERENCE_DATA_TTL', '300'))
+
+# Время жизни счётчиков книг по жанрам и годам в памяти, секунды
+FACETS_TTL = int(os.getenv('FACETS_TTL', '60'))
+
+# Каталог файлов обложек и максимальный размер загружаемой обложки
+COVERS_DIR = os.getenv('COVERS_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'static', 'images'))
+COVER_MAX_BYTES = int(os.getenv('COVER_MAX_BYTES', str(10 * 1024 * 1024)))
+# Каталог для загрузок, ещё не прошедших проверку. Не должен раздаваться
+# веб-сервером и должен быть на той же файловой системе, что COVERS_DIR:
+# проверенная обложка переносится в COVERS_DIR переименованием
+COVERS_UPLOAD_DIR = os.getenv('COVERS_UPLOAD_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'uploads'))
+
+# Отдача обложек: 'direct' — приложением, 'x-sendfile' — заголовком
+# X-Sendfile, 'x-accel' — через X-Accel-Redirect на internal-location nginx
+COVER_MAX_AGE = int(os.getenv('COVER_MAX_AGE', str(24 * 60 * 60)))
+COVERS_SEND_MODE = os.getenv('COVERS_SEND_MODE', 'direct')
+COVERS_ACCEL_PREFIX = os.getenv('COVERS_ACCEL_PREFIX', '/protected-covers/')
+
+# Ограничение попыток входа: корзины токенов по IP и по логину (запас и
+# пополнение в минуту), блокировка на BASE * 2^n секунд (не больше MAX)
+# после BACKOFF_AFTER неудачных попыток; неудачи забываются по одной
+# за THROTTLE_FAILURE_WINDOW секунд. THROTTLE_STORAGE_URL (redis://...)
+# делает состояние общим для всех процессов.
+THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', '1') == '1'
+THROTTLE_STORAGE_URL = os.getenv('THROTTLE_STORAGE_URL', '')
+THROTTLE_MAX_KEYS = int(os.getenv('THROTTLE_MAX_KEYS', '100000'))
+THROTTLE_IP_BURST = int(os.getenv('THROTTLE_IP_BURST', '20'))
+THROTTLE_IP_PER_MINUTE = float(os.getenv('THROTTLE_IP_PER_MINUTE', '10'))
+THROTTLE_LOGIN_BURST = int(os.getenv('THROTTLE_LOGIN_BURST', '5'))
+THROTTLE_LOGIN_PER_MINUTE = float(os.getenv('THROTTLE_LOGIN_PER_MINUTE', '5'))
+THROTTLE_BACKOFF_AFTER = int(os.getenv('THROTTLE_BACKOFF_AFTER', '3'))
+THROTTLE_BACKOFF_BASE = float(os.getenv('THROTTLE_BACKOFF_BASE', '1'))
+THROTTLE_BACKOFF_MAX = float(os.getenv('THROTTLE_BACKOFF_MAX', '300'))
+THROTTLE_FAILURE_WINDOW = float(os.getenv('THROTTLE_FAILURE_WINDOW', '60'))
+
+# Число доверенных прокси (nginx и т.п.) перед приложением: адрес клиента
+# берётся из X-Forwarded-For, схема — из X-Forwarded-Proto. 0 — приложение
+# принимает соединения напрямую, заголовки игнорируются
+PROXY_FIX_X_FOR = int(os.getenv('PROXY_FIX_X_FOR', '0'))
+PROXY_FIX_X_PROTO = int(os.getenv('PROXY_FIX_X_PROTO', '0'))
+
+# Метрики Prometheus на /metrics; METRICS_ALLOWED_IPS — адреса через
+# запятую, которым доступен /metrics (пусто — всем)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_ALLOWED_IPS = [ip.strip() for ip
+                       in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+
+# Проверка SQL в отладке и на canary-серверах: 'debug' — каждый запрос,
+# 'canary' — доля DB_INSPECT_SAMPLE_RATE запросов, 'off' — выключено.
+# Повтор одной формы запроса DB_REPEAT_THRESHOLD раз и запросы дольше
+# DB_SLOW_QUERY_MS записываются в журнал с местом вызова; при
+# DB_INSPECT_STRICT превышение QUERY_BUDGETS завершает запрос ошибкой.
+DB_INSPECT_MODE = os.getenv('DB_INSPECT_MODE', 'off')
+DB_INSPECT_SAMPLE_RATE = float(os.getenv('DB_INSPECT_SAMPLE_RATE', '0.01'))
+DB_REPEAT_THRESHOLD = int(os.getenv('DB_REPEAT_THRESHOLD', '5'))
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '200'))
+DB_INSPECT_STRICT = os.getenv('DB_INSPECT_STRICT', '0') == '1'
+
+# Допустимое число SQL-запросов на обработчик, включая загрузку
+# пользователя и справочников при пустом кэше
+QUERY_BUDGETS = {
+    'index': 5,
+    'view_book': 4,
+    'book_reviews': 2,
+    'search.search': 3,
+    'users.get_users_list': 2,
+    'auth.login': 1,
+    'covers.get_cover': 2,
+    'covers.get_cover_by_hash': 2,
+}
+
+# Параллельное чтение независимых запросов (главная страница, карточка
+# книги): PARALLEL_QUERY_WORKERS потоков на процесс, 0 — выключено.
+# Каждая задача занимает отдельное соединение, поэтому DB_POOL_SIZE +
+# DB_POOL_MAX_OVERFLOW должно покрывать потоки сервера и эти потоки.
+# Запросы дольше PARALLEL_QUERY_TIMEOUT секунд прерываются, ответ — 503.
+PARALLEL_QUERY_WORKERS = int(os.getenv('PARALLEL_QUERY_WORKERS', '4'))
+PARALLEL_QUERY_TIMEOUT = float(os.getenv('PARALLEL_QUERY_TIMEOUT', '5'))
+
+# Фоновые задачи (jobs.py): очередь в SQLite, JOBS_WORKERS потоков-исполнителей
+# в каждом процессе сервера (0 — только отдельный процесс flask jobs worker).
+# Неудачная задача повторяется через JOBS_RETRY_BASE * 2^(попытка - 1) секунд,
+# не больше JOBS_RETRY_MAX, всего JOBS_MAX_ATTEMPTS попыток; задача, не
+# завершённая за JOBS_LEASE секунд, возвращается в очередь. Выполненные
+# задачи и их ключи идемпотентности хранятся JOBS_KEEP_DONE секунд.
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'jobs.sqlite3'))
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', '1'))
+JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', '1'))
+JOBS_MAX_ATTEMPTS = int(os.getenv('JOBS_MAX_ATTEMPTS', '5'))
+JOBS_RETRY_BASE = float(os.getenv('JOBS_RETRY_BASE', '2'))
+JOBS_RETRY_MAX = float(os.getenv('JOBS_RETRY_MAX', '600'))
+JOBS_LEASE = float(os.getenv('JOBS_LEASE', '300'))
+JOBS_KEEP_DONE = float(os.getenv('JOBS_KEEP_DONE', '86400'))
+
+# Похожие книги (similar_books.py): SIMILAR_BOOKS_COUNT соседей на книгу,
+# сходство — SIMILAR_BOOKS_GENRE_WEIGHT * сходство жанров + остаток * сходство
+# читателей (оценки не ниже SIMILAR_BOOKS_MIN_RATING). Изменения собираются
+# и пересчитываются фоновой задачей раз в SIMILAR_BOOKS_REFRESH_DELAY секунд,
+# по SIMILAR_BOOKS_BATCH_SIZE книг в транзакции.
+SIMILAR_BOOKS_COUNT = int(os.getenv('SIMILAR_BOOKS_COUNT', '6'))
+SIMILAR_BOOKS_GENRE_WEIGHT = float(os.getenv('SIMILAR_BOOKS_GENRE_WEIGHT', '0.5'))
+SIMILAR_BOOKS_MIN_RATING = int(os.getenv('SIMILAR_BOOKS_MIN_RATING', '4'))
+SIMILAR_BOOKS_BATCH_SIZE = int(os.getenv('SIMILAR_BOOKS_BATCH_SIZE', '1000'))
+SIMILAR_BOOKS_REFRESH_DELAY = float(os.getenv('SIMILAR_BOOKS_REFRESH_DELAY', '60'))
+
+# HTML описаний и рецензий пересоздаётся после смены версии отрисовки
+# (rendering.py) пачками по RENDER_BATCH_SIZE записей
+RENDER_BATCH_SIZE = int(os.getenv('RENDER_BATCH_SIZE', '500'))
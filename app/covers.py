@@ -0,0 +1,237 @@
+import contextlib
+import hashlib
+import os
+import re
+import tempfile
+from email.utils import formatdate
+from http import HTTPStatus
+
+import jobs
+import mysql.connector
+from extensions import db_connector
+from flask import Blueprint, abort, current_app, make_response, request
+from mysql.connector import errorcode
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+bp = Blueprint('covers', __name__, url_prefix='/covers')
+
+CHUNK_SIZE = 64 * 1024
+
+# Сигнатуры поддерживаемых форматов: (смещение, байты, MIME-тип, расширение)
+IMAGE_SIGNATURES = (
+    (0, b'\xff\xd8\xff', 'image/jpeg', 'jpg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png', 'png'),
+    (0, b'GIF87a', 'image/gif', 'gif'),
+    (0, b'GIF89a', 'image/gif', 'gif'),
+    (8, b'WEBP', 'image/webp', 'webp'),
+)
+SNIFF_SIZE = 16
+MD5_HASH_RE = re.compile(r'^[0-9a-f]{32}$')
+# Адреса по хэшу содержимого никогда не меняют ответ
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class CoverError(ValueError):
+    pass
+
+
+class StagedCover:
+    # Загруженная обложка во временном файле в COVERS_UPLOAD_DIR: на той же
+    # файловой системе, что итоговый каталог, поэтому публикация — атомарное
+    # переименование, но до неё файл не раздаётся как статика.
+    def __init__(self, temp_path, md5_hash, mime_type, extension, size) -> None:
+        self.temp_path = temp_path
+        self.md5_hash = md5_hash
+        self.mime_type = mime_type
+        self.extension = extension
+        self.size = size
+
+    @property
+    def file_name(self):
+        return f'{self.md5_hash}.{self.extension}'
+
+    def publish(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        os.replace(self.temp_path, os.path.join(directory, self.file_name))
+        self.temp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Файл уже опубликован, а запись о нём не сохранилась: обложку без
+        # записи в Covers удалит фоновая задача. Временный файл удаляется всегда
+        if exc_type is not None and self.temp_path is None:
+            jobs.enqueue('covers.remove_file', {'file_name': self.file_name})
+        self.discard()
+
+    def discard(self):
+        if self.temp_path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.temp_path)
+            self.temp_path = None
+
+
+def sniff_image_type(head):
+    for offset, signature, mime_type, extension in IMAGE_SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            if mime_type == 'image/webp' and not head.startswith(b'RIFF'):
+                continue
+            return mime_type, extension
+    return None
+
+
+def copy_upload(stream, out, md5, max_size):
+    # Возвращает начало файла (для определения типа) и размер
+    head = b''
+    size = 0
+    while chunk := stream.read(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            msg = f'Размер обложки превышает {max_size // (1024 * 1024)} МБ'
+            raise CoverError(msg)
+        if len(head) < SNIFF_SIZE:
+            head += chunk[:SNIFF_SIZE - len(head)]
+        md5.update(chunk)
+        out.write(chunk)
+    return head, size
+
+
+def require_image_type(head):
+    image_type = sniff_image_type(head)
+    if image_type is None:
+        msg = 'Обложка должна быть изображением JPEG, PNG, GIF или WebP'
+        raise CoverError(msg)
+    return image_type
+
+
+def stage_upload(stream, directory, max_size):
+    # Файл читается порциями: MD5 считается по мере записи во временный
+    # файл, целиком в память загрузка не попадает.
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.tmp')
+    md5 = hashlib.md5()  # noqa: S324
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            head, size = copy_upload(stream, out, md5, max_size)
+        mime_type, extension = require_image_type(head)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+
+    return StagedCover(temp_path, md5.hexdigest(), mime_type, extension, size)
+
+
+def save_cover(conn, staged):
+    # Возвращает (id записи Covers, создана ли она). Обложки с одинаковым
+    # содержимым имеют одну запись
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT id FROM Covers WHERE md5_hash = %s', (staged.md5_hash,))
+        row = cursor.fetchone()
+        if row is not None:
+            return row[0], False
+        try:
+            cursor.execute('INSERT INTO Covers (file_name, mime_type, md5_hash) '
+                           'VALUES (%s, %s, %s)',
+                           (staged.file_name, staged.mime_type, staged.md5_hash))
+        except mysql.connector.IntegrityError as e:
+            if e.errno != errorcode.ER_DUP_ENTRY:
+                raise
+        else:
+            return cursor.lastrowid, True
+        # Ту же обложку одновременно загрузил другой пользователь: его запись
+        # уже подтверждена, и её видит блокирующее чтение (обычное чтение
+        # видит снимок транзакции)
+        cursor.execute('SELECT id FROM Covers WHERE md5_hash = %s LOCK IN SHARE MODE',
+                       (staged.md5_hash,))
+        return cursor.fetchone()[0], False
+
+
+def remove_cover_file(directory, file_name):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(directory, file_name))
+
+
+@jobs.job('covers.remove_file')
+def remove_unused_cover_file(file_name):
+    # Файл с тем же содержимым могли загрузить снова, пока задача ждала
+    # в очереди: тогда он принадлежит новой записи Covers
+    with db_connector.connect().cursor() as cursor:
+        cursor.execute('SELECT 1 FROM Covers WHERE file_name = %s LIMIT 1',
+                       (file_name,))
+        if cursor.fetchone() is not None:
+            return
+    remove_cover_file(current_app.config['COVERS_DIR'], file_name)
+
+
+def send_cover(file_name, mime_type, md5_hash, max_age, *, immutable=False):
+    path = safe_join(current_app.config['COVERS_DIR'], file_name)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mode = current_app.config['COVERS_SEND_MODE']
+    if mode == 'x-accel':
+        # Байты отдаёт nginx из internal-location, приложение только
+        # сообщает путь и заголовки кэширования. На условный запрос
+        # с совпавшим ETag или датой приложение само отвечает 304, без
+        # перенаправления в nginx
+        response = make_response('')
+        response.mimetype = mime_type
+        response.set_etag(md5_hash)
+        response.headers['Last-Modified'] = formatdate(os.path.getmtime(path),
+                                                       usegmt=True)
+        response.make_conditional(request)
+        if response.status_code != HTTPStatus.NOT_MODIFIED:
+            response.headers['X-Accel-Redirect'] = (
+                current_app.config['COVERS_ACCEL_PREFIX'].rstrip('/') + '/' + file_name)
+    else:
+        # send_file обрабатывает If-None-Match, If-Modified-Since и Range
+        response = send_file(path, request.environ, mimetype=mime_type,
+                             etag=md5_hash, conditional=True, max_age=max_age,
+                             use_x_sendfile=mode == 'x-sendfile')
+
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+
+@bp.route('/<int:cover_id>')
+@db_connector.read_only
+def get_cover(cover_id):
+    with db_connector.connect().cursor(dictionary=True) as cursor:
+        cursor.execute('SELECT file_name, mime_type, md5_hash FROM Covers '
+                       'WHERE id = %s', (cover_id,))
+        cover = cursor.fetchone()
+    if cover is None:
+        abort(404)
+    return send_cover(cover['file_name'], cover['mime_type'], cover['md5_hash'],
+                      current_app.config['COVER_MAX_AGE'])
+
+
+@bp.route('/h/<md5_hash>')
+@db_connector.read_only
+def get_cover_by_hash(md5_hash):
+    if not MD5_HASH_RE.match(md5_hash):
+        abort(404)
+
+    # Хэш и есть ETag, поэтому повторная проверка не требует ни БД, ни диска
+    if md5_hash in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(md5_hash)
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
+    with db_connector.connect().cursor(dictionary=True) as cursor:
+        cursor.execute('SELECT file_name, mime_type FROM Covers '
+                       'WHERE md5_hash = %s LIMIT 1', (md5_hash,))
+        cover = cursor.fetchone()
+    if cover is None:
+        abort(404)
+    return send_cover(cover['file_name'], cover['mime_type'], md5_hash,
+                      IMMUTABLE_MAX_AGE, immutable=True)
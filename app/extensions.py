@@ -0,0 +1,11 @@
+import os
+
+from mysqldb import DBConnector
+
+# Объекты расширений создаются без приложения и настраиваются в create_app
+# (app.py), поэтому модули импортируют их отсюда, а не из app.py
+db_connector = DBConnector()
+
+# После fork (gunicorn --preload) рабочий процесс открывает свои соединения
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=db_connector.reset_after_fork)
@@ -0,0 +1,156 @@
+from collections import Counter
+
+import click
+from cache import CachedValue, TTLCache
+from extensions import db_connector
+from flask import current_app
+from flask.cli import AppGroup
+from reference_data import reference_data
+
+cli = AppGroup('facets', help='Счётчики книг по жанрам и годам.')
+
+# Все счётчики помещаются в память: строк столько, сколько жанров и годов
+facet_counts = CachedValue()
+# Количество книг для сочетания жанра и года, которого нет в Catalog_facets
+combined_counts = TTLCache(maxsize=1024)
+
+ACTUAL_FACETS_QUERY = """
+    SELECT 'genre' AS facet, genre_id AS value, COUNT(*) AS book_count
+    FROM Book_genre GROUP BY genre_id
+    UNION ALL
+    SELECT 'year' AS facet, year AS value, COUNT(*) AS book_count
+    FROM Books WHERE year IS NOT NULL GROUP BY year
+"""
+
+
+def adjust(cursor, facet, deltas):
+    rows = [(facet, value, delta) for value, delta in deltas.items()
+            if value is not None and delta]
+    if rows:
+        cursor.executemany('INSERT INTO Catalog_facets (facet, value, book_count) '
+                           'VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE '
+                           'book_count = book_count + VALUES(book_count)', rows)
+
+
+def book_added(cursor, year, genre_ids, count=1):
+    adjust(cursor, 'year', {year: count})
+    adjust(cursor, 'genre', {int(genre_id): count for genre_id in genre_ids})
+
+
+def book_removed(cursor, year, genre_ids):
+    book_added(cursor, year, genre_ids, count=-1)
+
+
+def books_added(cursor, books):
+    adjust(cursor, 'year', Counter(book['year'] for book in books))
+    adjust(cursor, 'genre', Counter(genre_id for book in books
+                                    for genre_id in book['genre_ids']))
+
+
+def book_changed(cursor, old_year, new_year, added_genres, removed_genres):
+    if old_year != new_year:
+        adjust(cursor, 'year', {old_year: -1, new_year: 1})
+    deltas = dict.fromkeys(added_genres, 1)
+    deltas.update(dict.fromkeys(removed_genres, -1))
+    adjust(cursor, 'genre', deltas)
+
+
+def invalidate():
+    facet_counts.invalidate()
+    combined_counts.clear()
+
+
+def load_facets(cursor):
+    def load():
+        cursor.execute('SELECT facet, value, book_count FROM Catalog_facets '
+                       'WHERE book_count > 0')
+        counts = {'genre': {}, 'year': {}}
+        for row in cursor.fetchall():
+            counts[row['facet']][row['value']] = row['book_count']
+        return counts
+
+    counts = facet_counts.get(load, ttl=current_app.config.get('FACETS_TTL'))
+    genre_names = reference_data.names_by_id('genres')
+    return {
+        'genres': sorted(((genre_id, genre_names[genre_id], count)
+                          for genre_id, count in counts['genre'].items()
+                          if genre_id in genre_names), key=lambda item: item[1]),
+        'years': sorted(counts['year'].items(), reverse=True),
+        'counts': counts,
+    }
+
+
+def count_books(cursor, facets, genre_id=None, year=None):
+    # Для одного фильтра количество уже есть в счётчиках, сочетание
+    # жанра и года считается запросом и кэшируется
+    if genre_id is not None and year is None:
+        return facets['counts']['genre'].get(genre_id, 0)
+    if year is not None and genre_id is None:
+        return facets['counts']['year'].get(year, 0)
+
+    def load():
+        cursor.execute('SELECT COUNT(*) AS count FROM Books '
+                       'JOIN Book_genre ON Book_genre.book_id = Books.id '
+                       'WHERE Book_genre.genre_id = %s AND Books.year = %s',
+                       (genre_id, year))
+        return cursor.fetchone()['count']
+
+    return combined_counts.get((genre_id, year), load)
+
+
+def rebuild(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute('DELETE FROM Catalog_facets')
+        cursor.execute('INSERT INTO Catalog_facets (facet, value, book_count) '
+                       f'{ACTUAL_FACETS_QUERY}')
+        rebuilt = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    invalidate()
+    return rebuilt
+
+
+def verify(conn):
+    with conn.cursor(dictionary=True) as cursor:
+        cursor.execute(f"""
+            SELECT actual.facet, actual.value, actual.book_count,
+                   Catalog_facets.book_count AS stored_book_count
+            FROM ({ACTUAL_FACETS_QUERY}) AS actual
+            LEFT JOIN Catalog_facets ON Catalog_facets.facet = actual.facet
+                AND Catalog_facets.value = actual.value
+            WHERE NOT (Catalog_facets.book_count <=> actual.book_count)
+            UNION ALL
+            SELECT Catalog_facets.facet, Catalog_facets.value, 0,
+                   Catalog_facets.book_count
+            FROM Catalog_facets
+            LEFT JOIN ({ACTUAL_FACETS_QUERY}) AS actual
+                ON actual.facet = Catalog_facets.facet
+                AND actual.value = Catalog_facets.value
+            WHERE actual.value IS NULL AND Catalog_facets.book_count <> 0
+        """)  # noqa: S608
+        return cursor.fetchall()
+
+
+@cli.command('rebuild')
+def rebuild_command():
+    """Пересчитать счётчики по жанрам и годам."""
+    rebuilt = rebuild(db_connector.connect())
+    click.echo(f'Пересчитано счётчиков: {rebuilt}')
+
+
+@cli.command('verify')
+def verify_command():
+    """Сверить счётчики с исходными таблицами."""
+    mismatches = verify(db_connector.connect())
+    for row in mismatches:
+        click.echo(f"{row['facet']} {row['value']}: "
+                   f"{row['stored_book_count']} != {row['book_count']}")
+    if mismatches:
+        msg = 'Счётчики расходятся с данными, выполните flask facets rebuild'
+        raise click.ClickException(msg)
+    click.echo('Счётчики совпадают с данными')
@@ -0,0 +1,261 @@
+import contextlib
+import json
+import random
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+cli = AppGroup('jobs', help='Фоновые задачи.')
+
+# Очередь хранится в SQLite рядом с приложением и переживает перезапуск.
+# Задачу забирает один исполнитель: потоки сервера или отдельный процесс
+# flask jobs worker. Задача, исполнитель которой завершился, снова
+# становится доступной после истечения lease, поэтому обработчики должны
+# быть идемпотентными.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        args TEXT NOT NULL,
+        idempotency_key TEXT UNIQUE,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        run_at REAL NOT NULL,
+        locked_until REAL,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        finished_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS ix_jobs_status_run_at ON jobs (status, run_at);
+"""
+STATUSES = ('pending', 'running', 'done', 'failed')
+# Как часто исполнитель удаляет старые выполненные задачи, секунды
+PURGE_INTERVAL = 3600
+
+handlers = {}
+
+
+def job(name):
+    def decorator(function):
+        handlers[name] = function
+        return function
+    return decorator
+
+
+class JobQueue:
+    def __init__(self, path=None) -> None:
+        self.path = path
+        self.max_attempts = 5
+        self.retry_base = 2
+        self.retry_max = 600
+        self.lease = 300
+        self.keep_done = 86400
+        self.wakeup = threading.Event()
+
+    def configure(self, config):
+        self.path = config['JOBS_DB_PATH']
+        self.max_attempts = config['JOBS_MAX_ATTEMPTS']
+        self.retry_base = config['JOBS_RETRY_BASE']
+        self.retry_max = config['JOBS_RETRY_MAX']
+        self.lease = config['JOBS_LEASE']
+        self.keep_done = config['JOBS_KEEP_DONE']
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Соединение на операцию: очередь используют разные потоки и процессы
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, name, args=None, *, key=None, delay=0):
+        # Задача с уже известным ключом идемпотентности не добавляется
+        # повторно, пока запись о ней хранится в очереди. Задача, исчерпавшая
+        # попытки, ставится заново с новыми аргументами
+        if name not in handlers:
+            msg = f'Неизвестная задача {name}'
+            raise ValueError(msg)
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'INSERT INTO jobs (name, args, idempotency_key, run_at, created_at) '
+                'VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (idempotency_key) DO UPDATE SET '
+                "args = excluded.args, status = 'pending', attempts = 0, "
+                'run_at = excluded.run_at, last_error = NULL, finished_at = NULL '
+                "WHERE jobs.status = 'failed'",
+                (name, json.dumps(args or {}), key, now + delay, now))
+            added = cursor.rowcount > 0
+        if added:
+            self.wakeup.set()
+        return added
+
+    def claim(self):
+        now = time.time()
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE блокирует запись: одну задачу не заберут двое
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT id, name, args, attempts FROM jobs "
+                "WHERE (status = 'pending' AND run_at <= ?) "
+                "OR (status = 'running' AND locked_until < ?) "
+                "ORDER BY run_at LIMIT 1", (now, now)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', locked_until = ?, "
+                             "attempts = attempts + 1 WHERE id = ?",
+                             (now + self.lease, row[0]))
+            conn.execute('COMMIT')
+        if row is None:
+            return None
+        job_id, name, args, attempts = row
+        return job_id, name, json.loads(args), attempts + 1
+
+    def complete(self, job_id):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'done', finished_at = ?, "
+                         "locked_until = NULL WHERE id = ?", (time.time(), job_id))
+
+    def fail(self, job_id, attempts, error):
+        # Экспоненциальная задержка со случайной добавкой, чтобы повторы
+        # после общего сбоя не выполнялись одновременно
+        if attempts >= self.max_attempts:
+            status, run_at = 'failed', None
+        else:
+            delay = min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+            status, run_at = 'pending', time.time() + delay * random.uniform(1, 1.5)  # noqa: S311
+        finished_at = time.time() if status == 'failed' else None
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET status = ?, run_at = COALESCE(?, run_at), '
+                         'locked_until = NULL, last_error = ?, finished_at = ? '
+                         'WHERE id = ?', (status, run_at, error, finished_at, job_id))
+        return status
+
+    def purge(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE status = 'done' AND finished_at < ?",
+                         (time.time() - self.keep_done,))
+
+    def retry_failed(self):
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE jobs SET status = 'pending', attempts = 0, "
+                                  "run_at = ? WHERE status = 'failed'", (time.time(),))
+            return cursor.rowcount
+
+    def counts(self):
+        with self._connect() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs '
+                                       'GROUP BY status').fetchall())
+        return {status: counts.get(status, 0) for status in STATUSES}
+
+
+job_queue = JobQueue()
+
+
+def run_one(app):
+    claimed = job_queue.claim()
+    if claimed is None:
+        return False
+    job_id, name, args, attempts = claimed
+    with app.app_context():
+        try:
+            handlers[name](**args)
+        except Exception as e:  # noqa: BLE001
+            status = job_queue.fail(job_id, attempts, f'{type(e).__name__}: {e}')
+            app.logger.warning('Задача %s #%d (попытка %d) завершилась ошибкой, '
+                               'статус %s: %s', name, job_id, attempts, status, e)
+        else:
+            job_queue.complete(job_id)
+    return True
+
+
+class Worker:
+    def __init__(self, app, threads=1, poll_interval=1.0) -> None:
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.started = False
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+        for number in range(self.threads):
+            threading.Thread(target=self.run, name=f'jobs-worker-{number}',
+                             daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        job_queue.wakeup.set()
+
+    def run(self):
+        last_purge = 0.0
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - last_purge > PURGE_INTERVAL:
+                    job_queue.purge()
+                    last_purge = time.monotonic()
+                if run_one(self.app):
+                    continue
+            except sqlite3.Error:
+                self.app.logger.exception('Ошибка очереди задач')
+            job_queue.wakeup.wait(self.poll_interval)
+            job_queue.wakeup.clear()
+
+
+def enqueue(name, args=None, *, key=None, delay=0):
+    return job_queue.enqueue(name, args, key=key, delay=delay)
+
+
+def start_worker():
+    worker = current_app.extensions['jobs_worker']
+    if not worker.started:
+        worker.start()
+
+
+def init_jobs(app):
+    job_queue.configure(app.config)
+    app.extensions['jobs_worker'] = Worker(app, app.config['JOBS_WORKERS'],
+                                           app.config['JOBS_POLL_INTERVAL'])
+    # Потоки запускаются с первым HTTP-запросом: команды CLI и процессы,
+    # созданные fork после импорта приложения, не получают лишних исполнителей
+    if app.config['JOBS_WORKERS'] > 0:
+        app.before_request(start_worker)
+
+
+@cli.command('worker')
+@click.option('--threads', default=1, show_default=True)
+def worker_command(threads):
+    """Выполнять задачи из очереди до остановки процесса."""
+    worker = current_app.extensions['jobs_worker']
+    worker.threads = threads
+    worker.start()
+    click.echo(f'Исполнитель задач запущен, потоков: {threads}')
+    try:
+        while True:
+            time.sleep(PURGE_INTERVAL)
+    except KeyboardInterrupt:
+        worker.stop()
+
+
+@cli.command('status')
+def status_command():
+    """Показать количество задач по статусам."""
+    for status, count in job_queue.counts().items():
+        click.echo(f'{status}: {count}')
+
+
+@cli.command('retry-failed')
+def retry_failed_command():
+    """Вернуть в очередь задачи, исчерпавшие попытки."""
+    click.echo(f'Возвращено задач: {job_queue.retry_failed()}')
@@ -0,0 +1,223 @@
+import bisect
+import threading
+import time
+
+from extensions import db_connector
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    before_render_template,
+    current_app,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+
+bp = Blueprint('metrics', __name__)
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Вид запроса по первому слову: ограничивает число меток у метрик SQL
+STATEMENT_KINDS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f'{self.name}{format_labels(self.labels, label_values)} {value}'
+                     for label_values, value in values)
+        return lines
+
+
+class Histogram:
+    # Накопительные счётчики по корзинам считаются при выводе, на запись
+    # приходится один bisect и три сложения под блокировкой.
+    def __init__(self, name, documentation, labels=(), buckets=TIME_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value, label_values=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1),
+                                                       0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} histogram']
+        with self._lock:
+            values = sorted((key, ([*counts], total, count))
+                            for key, (counts, total, count) in self._values.items())
+        for label_values, (counts, total, count) in values:
+            cumulative = 0
+            bounds = (*self.buckets, '+Inf')
+            for bound, bucket_count in zip(bounds, counts, strict=True):
+                cumulative += bucket_count
+                labels = format_labels((*self.labels, 'le'), (*label_values, bound))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                                      .replace('"', '\\"').replace('\n', '\\n'))
+                     for name, value in zip(names, values, strict=True))
+    return f'{{{pairs}}}'
+
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds',
+                             'Время обработки запроса', ('endpoint', 'method'))
+REQUESTS = Counter('http_requests_total', 'Обработанные запросы',
+                   ('endpoint', 'method', 'status'))
+TEMPLATE_DURATION = Histogram('template_render_seconds',
+                              'Время отрисовки шаблонов за запрос', ('endpoint',))
+QUERY_DURATION = Histogram('db_query_duration_seconds', 'Время выполнения SQL',
+                           ('endpoint', 'statement'))
+REQUEST_DB_TIME = Histogram('db_request_time_seconds',
+                            'Суммарное время SQL за запрос', ('endpoint',))
+REQUEST_QUERIES = Histogram('db_queries_per_request', 'Число SQL-запросов за запрос',
+                            ('endpoint',), buckets=COUNT_BUCKETS)
+QUERY_ROWS = Counter('db_query_rows_total',
+                     'Прочитанные и изменённые строки', ('endpoint',))
+METRICS = (REQUEST_DURATION, REQUESTS, TEMPLATE_DURATION, QUERY_DURATION,
+           REQUEST_DB_TIME, REQUEST_QUERIES, QUERY_ROWS)
+
+# Пулы соединений: 'primary' и адреса реплик (DBConnector.pool_stats)
+POOL_LABELS = ('pool',)
+POOL_GAUGES = (
+    ('db_pool_opened', 'opened', 'Открытые соединения пула', 'gauge'),
+    ('db_pool_in_use', 'in_use', 'Выданные соединения пула', 'gauge'),
+    ('db_pool_idle', 'idle', 'Свободные соединения пула', 'gauge'),
+    ('db_pool_waits_total', 'waits', 'Ожидания свободного соединения', 'counter'),
+    ('db_pool_wait_seconds_total', 'wait_time', 'Время ожидания соединений',
+     'counter'),
+    ('db_pool_checkout_failures_total', 'checkout_failures',
+     'Неудачные получения соединения', 'counter'),
+)
+
+
+def endpoint_label():
+    # Несовпавшие адреса сводятся к одной метке, иначе их число не ограничено
+    return request.endpoint or 'unmatched'
+
+
+def statement_kind(statement):
+    words = statement.split(None, 1)
+    kind = words[0].upper() if words else ''
+    return kind if kind in STATEMENT_KINDS else 'OTHER'
+
+
+def start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_queries = []
+    g.metrics_template_time = 0.0
+
+
+def record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def finish_request(exc=None):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    endpoint = endpoint_label()
+    REQUEST_DURATION.observe(time.perf_counter() - started, (endpoint, request.method))
+    status = g.pop('metrics_status', 500 if exc is not None else 200)
+    REQUESTS.inc((endpoint, request.method, str(status)))
+
+    queries = g.pop('metrics_queries', [])
+    REQUEST_QUERIES.observe(len(queries), (endpoint,))
+    REQUEST_DB_TIME.observe(sum(event.duration for event in queries), (endpoint,))
+    rows = sum(event.rows for event in queries)
+    if rows:
+        QUERY_ROWS.inc((endpoint,), rows)
+    template_time = g.pop('metrics_template_time', 0.0)
+    if template_time:
+        TEMPLATE_DURATION.observe(template_time, (endpoint,))
+
+
+def record_query(event):
+    # Запросы вне HTTP-запроса (команды CLI, фоновые потоки) не учитываются
+    if not has_request_context():
+        return
+    queries = g.get('metrics_queries')
+    if queries is None:
+        return
+    queries.append(event)
+    QUERY_DURATION.observe(event.duration,
+                           (endpoint_label(), statement_kind(event.statement)))
+
+
+def template_started(sender, template, context, **extra):
+    g.metrics_template_started = time.perf_counter()
+
+
+def template_finished(sender, template, context, **extra):
+    started = g.pop('metrics_template_started', None)
+    if started is not None and 'metrics_template_time' in g:
+        g.metrics_template_time += time.perf_counter() - started
+
+
+def expose(pool_stats):
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    for name, key, documentation, kind in POOL_GAUGES:
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} {kind}')
+        for pool, stats in pool_stats.items():
+            lines.append(f'{name}{format_labels(POOL_LABELS, (pool,))} {stats[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+@bp.route('/metrics')
+def metrics():
+    allowed = current_app.config['METRICS_ALLOWED_IPS']
+    if allowed and request.remote_addr not in allowed:
+        abort(404)
+    return Response(expose(db_connector.pool_stats()),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_metrics(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.before_request(start_request)
+    app.after_request(record_status)
+    app.teardown_request(finish_request)
+    db_connector.add_query_listener(record_query)
+    before_render_template.connect(template_started, app)
+    template_rendered.connect(template_finished, app)
+    app.register_blueprint(bp)
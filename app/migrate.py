@@ -0,0 +1,168 @@
+import hashlib
+import importlib.util
+import os
+import re
+
+import click
+import mysql.connector
+import rendering
+from extensions import db_connector
+from flask.cli import AppGroup
+
+cli = AppGroup('db', help='Миграции схемы БД.')
+
+# Миграции применяются по порядку номеров: NNNN_название.sql — операторы,
+# разделённые «;» в конце строки, NNNN_название.py — функция upgrade(cursor)
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'migrations')
+MIGRATION_RE = re.compile(r'^(\d{4})_(\w+)\.(sql|py)$')
+STATEMENT_END_RE = re.compile(r';[ \t]*$', re.MULTILINE)
+
+# Именованная блокировка MySQL: одновременно миграции применяет один процесс
+LOCK_NAME = 'schema_migrations'
+LOCK_TIMEOUT = 60
+
+# Объект уже существует: таблица (1050), колонка (1060), индекс (1061),
+# внешний ключ (1826). Так повторный запуск на базе, созданной до появления
+# миграций или частично обновлённой, пропускает уже сделанные изменения
+ALREADY_EXISTS_ERRORS = {1050, 1060, 1061, 1826}
+
+LEDGER_DDL = """
+    CREATE TABLE IF NOT EXISTS Schema_migrations (
+        version INT NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        checksum CHAR(64) NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (version)
+    ) ENGINE=InnoDB
+"""
+
+
+class Migration:
+    def __init__(self, version, name, path) -> None:
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, 'rb') as source:
+            self.checksum = hashlib.sha256(source.read()).hexdigest()
+
+    def __str__(self):
+        return f'{self.version:04d}_{self.name}'
+
+
+def discover(directory=MIGRATIONS_DIR):
+    migrations = {}
+    for file_name in sorted(os.listdir(directory)):
+        match = MIGRATION_RE.match(file_name)
+        if match is None:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            msg = f'Две миграции с номером {version:04d}'
+            raise click.ClickException(msg)
+        migrations[version] = Migration(version, match.group(2),
+                                        os.path.join(directory, file_name))
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def split_statements(sql):
+    statements = []
+    for chunk in STATEMENT_END_RE.split(sql):
+        code = '\n'.join(line for line in chunk.splitlines()
+                         if not line.strip().startswith('--'))
+        if code.strip():
+            statements.append(chunk.strip())
+    return statements
+
+
+def applied_migrations(cursor):
+    cursor.execute(LEDGER_DDL)
+    cursor.execute('SELECT version, checksum FROM Schema_migrations')
+    return dict(cursor.fetchall())
+
+
+def run_sql(cursor, migration):
+    with open(migration.path, encoding='utf-8') as source:
+        statements = split_statements(source.read())
+    for statement in statements:
+        try:
+            cursor.execute(statement)
+        except mysql.connector.Error as e:
+            if e.errno not in ALREADY_EXISTS_ERRORS:
+                raise
+            click.echo(f'  {migration}: пропущено, объект уже есть ({e.msg})')
+
+
+def run_python(cursor, migration):
+    spec = importlib.util.spec_from_file_location(f'migration_{migration}',
+                                                  migration.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.upgrade(cursor)
+
+
+def apply(conn, migration):
+    # DDL в MySQL подтверждается неявно, поэтому запись в журнал делается
+    # последней: прерванная миграция будет выполнена снова целиком
+    with conn.cursor() as cursor:
+        if migration.path.endswith('.py'):
+            run_python(cursor, migration)
+        else:
+            run_sql(cursor, migration)
+        cursor.execute('INSERT INTO Schema_migrations (version, name, checksum) '
+                       'VALUES (%s, %s, %s)',
+                       (migration.version, migration.name, migration.checksum))
+    conn.commit()
+
+
+def upgrade(conn):
+    migrations = discover()
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT GET_LOCK(%s, %s)', (LOCK_NAME, LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            msg = 'Миграции уже применяет другой процесс'
+            raise click.ClickException(msg)
+    try:
+        with conn.cursor() as cursor:
+            applied = applied_migrations(cursor)
+        conn.commit()
+        for migration in migrations:
+            if migration.version in applied:
+                if applied[migration.version] != migration.checksum:
+                    click.echo(f'Внимание: {migration} изменена после применения',
+                               err=True)
+                continue
+            click.echo(f'Применяется {migration}')
+            apply(conn, migration)
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT RELEASE_LOCK(%s)', (LOCK_NAME,))
+            cursor.fetchall()
+
+
+@cli.command('upgrade')
+def upgrade_command():
+    """Применить недостающие миграции схемы."""
+    upgrade(db_connector.connect())
+    # Записи, HTML которых получен прежней версией отрисовки (в том числе
+    # до миграции 0008), обновляются в фоне
+    rendering.schedule_rerender()
+    click.echo('Схема БД в актуальном состоянии')
+
+
+@cli.command('status')
+def status_command():
+    """Показать применённые и ожидающие миграции."""
+    conn = db_connector.connect()
+    with conn.cursor() as cursor:
+        applied = applied_migrations(cursor)
+    conn.commit()
+    for migration in discover():
+        checksum = applied.get(migration.version)
+        if checksum is None:
+            state = 'ожидает'
+        elif checksum != migration.checksum:
+            state = 'применена, файл изменён'
+        else:
+            state = 'применена'
+        click.echo(f'{migration}: {state}')
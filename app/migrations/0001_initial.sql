@@ -0,0 +1,81 @@
+-- Основные таблицы приложения. Внешние ключи книг каскадные: удаление
+-- книги удаляет её жанры и рецензии
+CREATE TABLE IF NOT EXISTS Roles (
+    id INT NOT NULL AUTO_INCREMENT,
+    name VARCHAR(100) NOT NULL,
+    description TEXT,
+    PRIMARY KEY (id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT IGNORE INTO Roles (id, name, description) VALUES
+    (1, 'Администратор', 'Полный доступ, в том числе добавление и удаление книг'),
+    (2, 'Модератор', 'Редактирование книг и модерация рецензий'),
+    (3, 'Пользователь', 'Написание рецензий');
+
+CREATE TABLE IF NOT EXISTS Users (
+    id INT NOT NULL AUTO_INCREMENT,
+    login VARCHAR(100) NOT NULL,
+    password CHAR(64) NOT NULL,
+    last_name VARCHAR(100) NOT NULL,
+    first_name VARCHAR(100) NOT NULL,
+    middle_name VARCHAR(100),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    role_id INT,
+    PRIMARY KEY (id),
+    UNIQUE KEY uq_users_login (login),
+    CONSTRAINT fk_users_role FOREIGN KEY (role_id) REFERENCES Roles (id)
+        ON DELETE SET NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS Genres (
+    id INT NOT NULL AUTO_INCREMENT,
+    name VARCHAR(100) NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE KEY uq_genres_name (name)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS Covers (
+    id INT NOT NULL AUTO_INCREMENT,
+    file_name VARCHAR(255) NOT NULL,
+    mime_type VARCHAR(100) NOT NULL,
+    md5_hash CHAR(32) NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE KEY uq_covers_md5_hash (md5_hash)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS Books (
+    id INT NOT NULL AUTO_INCREMENT,
+    title VARCHAR(255) NOT NULL,
+    short_description TEXT NOT NULL,
+    year INT NOT NULL,
+    publisher VARCHAR(255) NOT NULL,
+    author VARCHAR(255) NOT NULL,
+    pages INT NOT NULL,
+    cover_id INT,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_books_cover FOREIGN KEY (cover_id) REFERENCES Covers (id)
+        ON DELETE SET NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS Book_genre (
+    book_id INT NOT NULL,
+    genre_id INT NOT NULL,
+    PRIMARY KEY (book_id, genre_id),
+    CONSTRAINT fk_book_genre_book FOREIGN KEY (book_id) REFERENCES Books (id)
+        ON DELETE CASCADE,
+    CONSTRAINT fk_book_genre_genre FOREIGN KEY (genre_id) REFERENCES Genres (id)
+        ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS Reviews (
+    id INT NOT NULL AUTO_INCREMENT,
+    book_id INT NOT NULL,
+    user_id INT NOT NULL,
+    rating TINYINT NOT NULL,
+    review_text TEXT NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_reviews_book FOREIGN KEY (book_id) REFERENCES Books (id)
+        ON DELETE CASCADE,
+    CONSTRAINT fk_reviews_user FOREIGN KEY (user_id) REFERENCES Users (id)
+        ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,30 @@
+-- Агрегаты по книгам для главной страницы. Поддерживаются приложением
+-- при записи рецензий и изменении книг; полный пересчёт и сверка:
+--   flask book-stats rebuild
+--   flask book-stats verify
+CREATE TABLE IF NOT EXISTS Book_stats (
+    book_id INT NOT NULL,
+    review_count INT NOT NULL DEFAULT 0,
+    rating_sum INT NOT NULL DEFAULT 0,
+    avg_rating DECIMAL(6, 4) AS (rating_sum / NULLIF(review_count, 0)) VIRTUAL,
+    genre_ids VARCHAR(255) NOT NULL DEFAULT '',
+    PRIMARY KEY (book_id),
+    CONSTRAINT fk_book_stats_book FOREIGN KEY (book_id) REFERENCES Books (id)
+        ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- Агрегаты существующих книг (как ACTUAL_STATS_QUERY в app/book_stats.py)
+INSERT INTO Book_stats (book_id, review_count, rating_sum, genre_ids)
+SELECT Books.id,
+       (SELECT COUNT(*) FROM Reviews
+        WHERE Reviews.book_id = Books.id),
+       (SELECT COALESCE(SUM(Reviews.rating), 0) FROM Reviews
+        WHERE Reviews.book_id = Books.id),
+       (SELECT COALESCE(GROUP_CONCAT(Book_genre.genre_id
+                                     ORDER BY Book_genre.genre_id), '')
+        FROM Book_genre
+        WHERE Book_genre.book_id = Books.id)
+FROM Books
+ON DUPLICATE KEY UPDATE review_count = VALUES(review_count),
+                        rating_sum = VALUES(rating_sum),
+                        genre_ids = VALUES(genre_ids);
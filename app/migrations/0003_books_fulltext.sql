@@ -0,0 +1,4 @@
+-- Полнотекстовый поиск по каталогу (/search). Колонки индекса должны
+-- совпадать с выражением MATCH в search.py
+ALTER TABLE Books
+    ADD FULLTEXT INDEX ft_books_search (title, author, publisher, short_description);
@@ -0,0 +1,18 @@
+-- Количество книг по жанрам (facet = 'genre', value = Genres.id) и годам
+-- (facet = 'year', value = Books.year) для фильтров главной страницы.
+-- Поддерживается приложением при изменении книг; полный пересчёт и сверка:
+--   flask facets rebuild
+--   flask facets verify
+CREATE TABLE IF NOT EXISTS Catalog_facets (
+    facet ENUM('genre', 'year') NOT NULL,
+    value INT NOT NULL,
+    book_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (facet, value)
+) ENGINE=InnoDB;
+
+-- Счётчики существующих книг (как ACTUAL_FACETS_QUERY в app/facets.py)
+INSERT INTO Catalog_facets (facet, value, book_count)
+SELECT 'genre', genre_id, COUNT(*) FROM Book_genre GROUP BY genre_id
+UNION ALL
+SELECT 'year', year, COUNT(*) FROM Books WHERE year IS NOT NULL GROUP BY year
+ON DUPLICATE KEY UPDATE book_count = VALUES(book_count);
@@ -0,0 +1,21 @@
+-- Индексы под запросы приложения. Первичный ключ id InnoDB добавляет
+-- в каждый вторичный индекс, поэтому (book_id) упорядочен как (book_id, id).
+
+-- Рецензии книги: новые первыми и по оценке; одна рецензия пользователя
+ALTER TABLE Reviews ADD INDEX ix_reviews_book (book_id);
+ALTER TABLE Reviews ADD INDEX ix_reviews_book_rating (book_id, rating);
+ALTER TABLE Reviews ADD UNIQUE INDEX uq_reviews_book_user (book_id, user_id);
+
+-- Книги жанра (фильтр главной страницы, EXISTS в поиске)
+ALTER TABLE Book_genre ADD INDEX ix_book_genre_genre_book (genre_id, book_id);
+
+-- Главная страница упорядочена по (year, id)
+ALTER TABLE Books ADD INDEX ix_books_year_id (year, id);
+
+-- Поиск обложки по содержимому и вход по логину
+ALTER TABLE Covers ADD UNIQUE INDEX uq_covers_md5_hash (md5_hash);
+ALTER TABLE Users ADD UNIQUE INDEX uq_users_login (login);
+
+-- Поиск в списке пользователей по началу фамилии или имени
+ALTER TABLE Users ADD INDEX ix_users_last_name (last_name);
+ALTER TABLE Users ADD INDEX ix_users_first_name (first_name);
@@ -0,0 +1,37 @@
+# Базы, созданные до 0001, могли получить внешние ключи без каскадов и под
+# другими именами: такие ключи пересоздаются с нужным правилом ON DELETE.
+
+# (таблица, колонка, связанная таблица, имя ограничения, правило)
+FOREIGN_KEYS = (
+    ('Users', 'role_id', 'Roles', 'fk_users_role', 'SET NULL'),
+    ('Books', 'cover_id', 'Covers', 'fk_books_cover', 'SET NULL'),
+    ('Book_genre', 'book_id', 'Books', 'fk_book_genre_book', 'CASCADE'),
+    ('Book_genre', 'genre_id', 'Genres', 'fk_book_genre_genre', 'CASCADE'),
+    ('Reviews', 'book_id', 'Books', 'fk_reviews_book', 'CASCADE'),
+    ('Reviews', 'user_id', 'Users', 'fk_reviews_user', 'CASCADE'),
+    ('Book_stats', 'book_id', 'Books', 'fk_book_stats_book', 'CASCADE'),
+)
+
+EXISTING_KEYS_QUERY = """
+    SELECT rc.CONSTRAINT_NAME, rc.DELETE_RULE
+    FROM information_schema.REFERENTIAL_CONSTRAINTS AS rc
+    JOIN information_schema.KEY_COLUMN_USAGE AS kcu
+        ON kcu.CONSTRAINT_SCHEMA = rc.CONSTRAINT_SCHEMA
+        AND kcu.CONSTRAINT_NAME = rc.CONSTRAINT_NAME
+        AND kcu.TABLE_NAME = rc.TABLE_NAME
+    WHERE rc.CONSTRAINT_SCHEMA = DATABASE()
+        AND rc.TABLE_NAME = %s AND kcu.COLUMN_NAME = %s
+"""
+
+
+def upgrade(cursor):
+    for table, column, referenced, name, rule in FOREIGN_KEYS:
+        cursor.execute(EXISTING_KEYS_QUERY, (table, column))
+        existing = cursor.fetchall()
+        if any(delete_rule == rule for _, delete_rule in existing):
+            continue
+        for constraint_name, _ in existing:
+            cursor.execute(f'ALTER TABLE {table} DROP FOREIGN KEY `{constraint_name}`')
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} '
+                       f'FOREIGN KEY ({column}) REFERENCES {referenced} (id) '
+                       f'ON DELETE {rule}')
@@ -0,0 +1,23 @@
+-- Похожие книги для страницы книги: до SIMILAR_BOOKS_COUNT соседей на книгу
+-- по сходству жанров и общим читателям (app/similar_books.py). Изменённые
+-- книги отмечаются в Book_similar_dirty и пересчитываются фоновой задачей;
+-- полный пересчёт:
+--   flask similar-books rebuild
+CREATE TABLE IF NOT EXISTS Book_similar (
+    book_id INT NOT NULL,
+    similar_book_id INT NOT NULL,
+    score FLOAT NOT NULL,
+    `rank` TINYINT UNSIGNED NOT NULL,
+    PRIMARY KEY (book_id, similar_book_id),
+    KEY ix_book_similar_similar (similar_book_id),
+    CONSTRAINT fk_book_similar_book FOREIGN KEY (book_id) REFERENCES Books (id)
+        ON DELETE CASCADE,
+    CONSTRAINT fk_book_similar_similar FOREIGN KEY (similar_book_id)
+        REFERENCES Books (id) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS Book_similar_dirty (
+    id INT NOT NULL AUTO_INCREMENT,
+    book_id INT NOT NULL,
+    PRIMARY KEY (id)
+) ENGINE=InnoDB;
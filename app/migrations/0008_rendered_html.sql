@@ -0,0 +1,13 @@
+-- Очищенный HTML описаний книг и рецензий (app/rendering.py) и версия
+-- отрисовки, которой он получен. Существующие записи получают HTML
+-- фоновой задачей rendering.rerender или командой:
+--   flask rendering rerender
+ALTER TABLE Books ADD COLUMN description_html TEXT NULL AFTER short_description;
+ALTER TABLE Books ADD COLUMN description_renderer SMALLINT NOT NULL DEFAULT 0
+    AFTER description_html;
+ALTER TABLE Books ADD INDEX ix_books_description_renderer (description_renderer);
+
+ALTER TABLE Reviews ADD COLUMN review_html TEXT NULL AFTER review_text;
+ALTER TABLE Reviews ADD COLUMN review_renderer SMALLINT NOT NULL DEFAULT 0
+    AFTER review_html;
+ALTER TABLE Reviews ADD INDEX ix_reviews_renderer (review_renderer);
@@ -0,0 +1,3 @@
+-- Фоновый пересчёт похожих книг (app/similar_books.py) считает книги по
+-- наборам жанров и берёт самые популярные книги набора
+ALTER TABLE Book_stats ADD INDEX ix_book_stats_genres (genre_ids, review_count);
@@ -1,25 +1,522 @@
+import contextlib
+import functools
+import inspect
+import itertools
+import threading
+import time
+from collections import deque
+
 import mysql.connector
-from flask import g
+from flask import current_app, g, has_request_context, session
+
+
+class ConnectionPool:
+    def __init__(self, db_config, *, size=5, max_overflow=10, timeout=30,
+                 recycle=3600, pre_ping=True) -> None:
+        self.db_config = db_config
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+
+        self._cond = threading.Condition()
+        # Свободные соединения: (соединение, время открытия)
+        self._idle = deque()
+        self._opened = 0
+        self._in_use = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._checkout_failures = 0
+        # Слушатели выполненных запросов (см. InstrumentedCursor)
+        self.listeners = []
+
+    def checkout(self, timeout=None):
+        # timeout — сколько секунд ждать свободного места (по умолчанию
+        # self.timeout)
+        if timeout is None:
+            timeout = self.timeout
+        cnx, created_at = self._reserve(timeout)
+
+        # Открытие и проверка соединения выполняются вне блокировки
+        try:
+            if cnx is not None and not self._is_usable(cnx, created_at):
+                self._discard(cnx)
+                cnx = None
+            if cnx is None:
+                cnx = mysql.connector.connect(**self.db_config)
+                created_at = time.monotonic()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._in_use -= 1
+                self._checkout_failures += 1
+                self._cond.notify()
+            raise
+
+        return PooledConnection(self, cnx, created_at)
+
+    def _reserve(self, timeout):
+        # Резервирует место в пуле: возвращает свободное соединение
+        # или (None, None), если разрешено открыть новое
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+        cnx = None
+        created_at = None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    cnx, created_at = self._idle.pop()
+                    break
+                if self._opened < self.size + self.max_overflow:
+                    self._opened += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._checkout_failures += 1
+                    if waited:
+                        self._wait_time += time.monotonic() - started
+                    msg = f'Нет свободных соединений с БД (ожидание {timeout:.1f} с)'
+                    raise mysql.connector.PoolError(msg)
+                if not waited:
+                    self._waits += 1
+                    waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            if waited:
+                self._wait_time += time.monotonic() - started
+        return cnx, created_at
+
+    def release(self, cnx, created_at):
+        keep = True
+        try:
+            # Сброс состояния: незавершённая транзакция не должна
+            # достаться следующему запросу
+            if cnx.in_transaction:
+                cnx.rollback()
+        except mysql.connector.Error:
+            keep = False
+
+        with self._cond:
+            self._in_use -= 1
+            if keep and len(self._idle) < self.size:
+                self._idle.append((cnx, created_at))
+                cnx = None
+            else:
+                self._opened -= 1
+            self._cond.notify()
+
+        if cnx is not None:
+            self._discard(cnx)
+
+    def dispose(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._opened -= len(idle)
+        for cnx, _ in idle:
+            self._discard(cnx)
+
+    def reset_after_fork(self):
+        # Соединения родительского процесса в дочернем не закрываются: закрытие
+        # отправило бы COM_QUIT по общему сокету. Блокировка могла быть занята
+        # в момент fork другим потоком родителя
+        self._cond = threading.Condition()
+        self._idle.clear()
+        self._opened = 0
+        self._in_use = 0
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'opened': self._opened,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waits': self._waits,
+                'wait_time': self._wait_time,
+                'checkout_failures': self._checkout_failures,
+            }
+
+    def _is_usable(self, cnx, created_at):
+        if self.recycle is not None and time.monotonic() - created_at > self.recycle:
+            return False
+        if self.pre_ping:
+            return cnx.is_connected()
+        return True
+
+    @staticmethod
+    def _discard(cnx):
+        with contextlib.suppress(mysql.connector.Error):
+            cnx.close()
+
+
+class PooledConnection:
+    # Обёртка над соединением из пула: close() возвращает соединение в пул,
+    # остальные атрибуты делегируются исходному соединению.
+    def __init__(self, pool, cnx, created_at) -> None:
+        self._pool = pool
+        self._cnx = cnx
+        self._created_at = created_at
+        self.on_commit = None
+
+    def __getattr__(self, name):
+        if self._cnx is None:
+            msg = 'Соединение уже возвращено в пул'
+            raise mysql.connector.InterfaceError(msg)
+        return getattr(self._cnx, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self.__getattr__('cursor')(*args, **kwargs)
+        if self._pool.listeners:
+            return InstrumentedCursor(cursor, self._pool.listeners)
+        return cursor
+
+    def commit(self):
+        self.__getattr__('commit')()
+        if self.on_commit is not None:
+            self.on_commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def is_closed(self):
+        return self._cnx is None
+
+    def close(self):
+        if self._cnx is not None:
+            cnx, self._cnx = self._cnx, None
+            self._pool.release(cnx, self._created_at)
+
+
+class QueryEvent:
+    __slots__ = ('duration', 'params', 'rows', 'statement')
+
+    def __init__(self, statement, params, duration, rows) -> None:
+        self.statement = statement
+        self.params = params
+        self.duration = duration
+        self.rows = rows
+
+
+class InstrumentedCursor:
+    # Курсор, сообщающий слушателям время каждого запроса. Строки, прочитанные
+    # позже через fetch*, добавляются к событию последнего запроса.
+    def __init__(self, cursor, listeners) -> None:
+        self._cursor = cursor
+        self._listeners = listeners
+        self._event = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._cursor.close()
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._count(1)
+            yield row
+
+    def _notify(self, statement, params, started):
+        rowcount = self._cursor.rowcount
+        self._event = QueryEvent(statement, params, time.perf_counter() - started,
+                                 max(rowcount, 0) if not self._cursor.with_rows else 0)
+        for listener in self._listeners:
+            listener(self._event)
+
+    def _count(self, rows):
+        if self._event is not None:
+            self._event.rows += rows
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._notify(operation, params, started)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._notify(operation, seq_params, started)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self._cursor.fetchmany(size)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._count(len(rows))
+        return rows
+
+
+class UnitOfWork:
+    # Одна транзакция: все изменения подтверждаются одним commit, а действия
+    # вне БД (например, удаление файлов) выполняются только после него.
+    def __init__(self, conn, *, dictionary=True) -> None:
+        self.conn = conn
+        self.cursor = conn.cursor(dictionary=dictionary)
+        self._after_commit = []
+
+    def after_commit(self, callback, *args, **kwargs):
+        self._after_commit.append((callback, args, kwargs))
+
+    def run_after_commit(self):
+        for callback, args, kwargs in self._after_commit:
+            try:
+                callback(*args, **kwargs)
+            except Exception:
+                current_app.logger.exception('Ошибка при выполнении %s после commit',
+                                             callback.__name__)
+
+
+class Replica:
+    # Реплика со своим пулом. Отставание проверяется не чаще раза в
+    # check_interval секунд одним из потоков; отстающая больше max_lag секунд
+    # или недоступная реплика исключается из ротации до следующей проверки.
+    def __init__(self, host, pool, max_lag, check_interval) -> None:
+        self.host = host
+        self.pool = pool
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = None
+        self.available = True
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def is_usable(self):
+        due = time.monotonic() - self._checked_at >= self.check_interval
+        if due and self._lock.acquire(blocking=False):
+            try:
+                self._check()
+            finally:
+                self._lock.release()
+        return self.available
+
+    def _check(self):
+        self._checked_at = time.monotonic()
+        try:
+            with self.pool.checkout() as conn, conn.cursor(dictionary=True) as cursor:
+                cursor.execute('SHOW REPLICA STATUS')
+                status = cursor.fetchone()
+        except mysql.connector.Error as e:
+            self.mark_down(e)
+            return
+        # NULL — репликация остановлена, пустой ответ — сервер не реплика
+        self.lag = status['Seconds_Behind_Source'] if status else None
+        available = self.lag is not None and self.lag <= self.max_lag
+        if self.available and not available:
+            current_app.logger.warning('Реплика %s исключена из ротации: '
+                                       'отставание %s с', self.host, self.lag)
+        self.available = available
+
+    def reset_after_fork(self):
+        self.pool.reset_after_fork()
+        self._lock = threading.Lock()
+        self._checked_at = float('-inf')
+
+    def mark_down(self, error):
+        self._checked_at = time.monotonic()
+        if self.available:
+            current_app.logger.warning('Реплика %s недоступна: %s', self.host, error)
+        self.available = False
+
+
+def replica_config(db_config, host):
+    name, _, port = host.partition(':')
+    config = {**db_config, 'host': name}
+    if port:
+        config['port'] = int(port)
+    return config
 
 
 class DBConnector:
-    def __init__(self, app) -> None:
-        self.app = app
+    def __init__(self, app=None) -> None:
+        self.pool = None
+        self.replicas = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        missing = [name for name in ('MYSQL_USER', 'MYSQL_HOST', 'MYSQL_DATABASE')
+                   if not app.config.get(name)]
+        if missing:
+            msg = f'Не заданы параметры подключения к БД: {", ".join(missing)}'
+            raise RuntimeError(msg)
+
         self.db_config = {
             'user': app.config['MYSQL_USER'],
-            'password': app.config['MYSQL_PASSWORD'],
+            'password': app.config.get('MYSQL_PASSWORD') or '',
             'host': app.config['MYSQL_HOST'],
             'database': app.config['MYSQL_DATABASE'],
         }
+        pool_options = {
+            'size': app.config.get('DB_POOL_SIZE', 5),
+            'max_overflow': app.config.get('DB_POOL_MAX_OVERFLOW', 10),
+            'timeout': app.config.get('DB_POOL_TIMEOUT', 30),
+            'recycle': app.config.get('DB_POOL_RECYCLE', 3600),
+            'pre_ping': app.config.get('DB_POOL_PRE_PING', True),
+        }
+        self.pool = ConnectionPool(self.db_config, **pool_options)
+
+        # Реплики получают собственные пулы с общими слушателями запросов
+        self.replicas = []
+        for host in app.config.get('MYSQL_REPLICA_HOSTS', ()):
+            pool = ConnectionPool(replica_config(self.db_config, host), **pool_options)
+            pool.listeners = self.pool.listeners
+            self.replicas.append(Replica(
+                host, pool, app.config.get('DB_REPLICA_MAX_LAG', 5),
+                app.config.get('DB_REPLICA_CHECK_INTERVAL', 5)))
+        self._next_replica = itertools.count()
+        self.read_after_write_window = app.config.get('DB_READ_AFTER_WRITE_WINDOW', 5)
+
+        app.teardown_appcontext(self.close)
+        if self.replicas:
+            app.after_request(self.remember_write)
+
+    def read_only(self, function):
+        # Обработчик только читает: его запросы через connect() могут
+        # выполняться на реплике. Генератор (например, строки для
+        # stream_template) выполняется уже после возврата из обработчика,
+        # поэтому признак ставится на всё время его работы
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                previous = g.get('db_read_only', False)
+                g.db_read_only = True
+                try:
+                    yield from function(*args, **kwargs)
+                finally:
+                    g.db_read_only = previous
+            return generator_wrapper
 
-        self.app.teardown_appcontext(self.close)
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            previous = g.get('db_read_only', False)
+            g.db_read_only = True
+            try:
+                return function(*args, **kwargs)
+            finally:
+                g.db_read_only = previous
+        return wrapper
+
+    def _reads_from_replica(self):
+        if not self.replicas or not g.get('db_read_only'):
+            return False
+        # Сессия, которая недавно записывала, читает с основного сервера,
+        # чтобы сразу видеть свои изменения
+        if g.get('db_committed'):
+            return False
+        return not (has_request_context()
+                    and session.get('db_primary_until', 0) > time.time())
+
+    def _usable_replicas(self):
+        start = next(self._next_replica)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.is_usable():
+                yield replica
+
+    def _checkout_replica(self):
+        for replica in self._usable_replicas():
+            try:
+                return replica.pool.checkout()
+            except mysql.connector.PoolError:
+                continue
+            except mysql.connector.Error as e:
+                replica.mark_down(e)
+        return None
 
     def connect(self):
+        if self._reads_from_replica():
+            conn = g.get('db_replica')
+            if conn is None or conn.is_closed():
+                conn = g.db_replica = self._checkout_replica()
+            if conn is not None:
+                return conn
+        return self.connect_primary()
+
+    def connect_primary(self):
         if 'db' not in g or g.db.is_closed():
-            g.db = mysql.connector.connect(**self.db_config)
+            g.db = self.pool.checkout()
+            g.db.on_commit = self._committed
         return g.db
 
+    def read_pool(self):
+        # Пул для отдельных соединений чтения (см. parallel.py)
+        if self._reads_from_replica():
+            for replica in self._usable_replicas():
+                return replica.pool
+        return self.pool
+
+    @staticmethod
+    def _committed():
+        g.db_committed = True
+
+    def remember_write(self, response):
+        if g.pop('db_committed', False):
+            session['db_primary_until'] = time.time() + self.read_after_write_window
+        return response
+
     def close(self, e=None):
-        db = g.pop('db', None)
-        if db is not None:
-            db.close()
\ No newline at end of file
+        for name in ('db', 'db_replica'):
+            db = g.pop(name, None)
+            if db is not None:
+                db.close()
+
+    @contextlib.contextmanager
+    def transaction(self, *, dictionary=True):
+        conn = self.connect_primary()
+        unit = UnitOfWork(conn, dictionary=dictionary)
+        try:
+            yield unit
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            unit.cursor.close()
+        unit.run_after_commit()
+
+    def pools(self):
+        return [self.pool, *(replica.pool for replica in self.replicas)]
+
+    def dispose(self):
+        for pool in self.pools():
+            pool.dispose()
+
+    def reset_after_fork(self):
+        if self.pool is None:
+            return
+        self.pool.reset_after_fork()
+        for replica in self.replicas:
+            replica.reset_after_fork()
+
+    def add_query_listener(self, listener):
+        self.pool.listeners.append(listener)
+
+    def pool_stats(self):
+        # Состояние пулов по именам: 'primary' и адреса реплик
+        stats = {'primary': self.pool.stats()}
+        for replica in self.replicas:
+            stats[replica.host] = replica.pool.stats()
+        return stats
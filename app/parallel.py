@@ -0,0 +1,191 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+import mysql.connector
+from extensions import db_connector
+from flask import current_app, g
+
+
+class QueryTimeoutError(RuntimeError):
+    pass
+
+
+class TaskCursor:
+    # Курсор задачи на собственном соединении пула. Соединение берётся при
+    # первом обращении: задача, ответ которой уже в кэше, его не занимает.
+    # Ожидание соединения не выходит за deadline запросов; если пул реплики
+    # не дал соединения, оно берётся из fallback_pool (основного сервера)
+    def __init__(self, pool, deadline, fallback_pool=None) -> None:
+        self.pool = pool
+        self.deadline = deadline
+        self.fallback_pool = fallback_pool
+        self._conn = None
+        self._cursor = None
+        self.connection_id = None
+        self.cancelled = False
+        # Блокировка связывает KILL QUERY с временем, пока соединение
+        # принадлежит задаче: close() не вернёт его в пул посреди KILL
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._cursor is None:
+            with self._lock:
+                if self.cancelled:
+                    msg = 'Задача отменена по таймауту'
+                    raise QueryTimeoutError(msg)
+                self._conn = self._checkout()
+                self.connection_id = self._conn.connection_id
+            self._cursor = self._conn.cursor(dictionary=True)
+        return getattr(self._cursor, name)
+
+    def _checkout(self):
+        try:
+            return self.pool.checkout(self._remaining())
+        except mysql.connector.Error:
+            if self.fallback_pool is None:
+                raise
+            current_app.logger.warning('Нет соединения с %s, запрос задачи '
+                                       'выполняется на основном сервере',
+                                       self.pool.db_config.get('host'))
+        # KILL QUERY должен уйти на сервер, где выполняется запрос
+        self.pool = self.fallback_pool
+        return self.pool.checkout(self._remaining())
+
+    def _remaining(self):
+        return max(self.deadline - time.monotonic(), 0)
+
+    def kill(self, kill_cursor):
+        # kill_cursor — соединение с тем же сервером, что и соединение задачи
+        with self._lock:
+            self.cancelled = True
+            if self.connection_id is None:
+                return False
+            kill_cursor.execute(f'KILL QUERY {int(self.connection_id)}')
+            return True
+
+    def close(self):
+        # После возврата соединения в пул его запросы уже не относятся к задаче
+        with self._lock:
+            self.connection_id = None
+        if self._conn is not None:
+            with contextlib.suppress(mysql.connector.Error):
+                self._cursor.close()
+            self._conn.close()
+
+
+def run_task(task, cursor, request_globals):
+    # У задачи свой контекст приложения: если она обратится к
+    # db_connector.connect(), соединения g.db и g.db_replica не будут общими с другими
+    # потоками. Остальные значения g (счётчики метрик и проверки SQL) общие
+    with current_app.app_context():
+        vars(g).update(request_globals)
+        try:
+            return task(cursor)
+        finally:
+            cursor.close()
+
+
+class ParallelQueries:
+    # Независимые запросы на чтение выполняются одновременно на разных
+    # соединениях пула. Потоков не больше max_workers; задачи, не уложившиеся
+    # в timeout, отменяются, а их запросы прерываются через KILL QUERY.
+    def __init__(self) -> None:
+        self.executor = None
+        self.max_workers = 0
+        self.timeout = 5
+
+    def configure(self, max_workers, timeout):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._create_executor()
+
+    def _create_executor(self):
+        self.executor = None
+        if self.max_workers > 0:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix='parallel-query')
+
+    def reset_after_fork(self):
+        # Потоки пула родителя в дочерний процесс не переходят: пул
+        # создаётся заново, старый не останавливается
+        self._create_executor()
+
+    @property
+    def enabled(self):
+        return self.executor is not None
+
+    def run(self, *tasks, timeout=None):
+        # Каждая задача — функция от курсора; результаты возвращаются
+        # в порядке задач. Без пула потоков задачи выполняются по очереди
+        # на соединении запроса
+        if not self.enabled or len(tasks) < 2:  # noqa: PLR2004
+            with db_connector.connect().cursor(dictionary=True) as cursor:
+                return [task(cursor) for task in tasks]
+
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        pool = db_connector.read_pool()
+        fallback_pool = db_connector.pool if pool is not db_connector.pool else None
+        cursors = [TaskCursor(pool, deadline, fallback_pool) for _ in tasks]
+        request_globals = {name: value for name, value in vars(g).items()
+                           if name not in ('db', 'db_replica')}
+        # Копия контекста передаёт задаче текущие приложение и запрос
+        futures = [self.executor.submit(contextvars.copy_context().run,
+                                        run_task, task, cursor, request_globals)
+                   for task, cursor in zip(tasks, cursors, strict=True)]
+        done, pending = concurrent.futures.wait(
+            futures, timeout, return_when=concurrent.futures.FIRST_EXCEPTION)
+
+        failed = next((future for future in done if future.exception()), None)
+        if pending:
+            self.cancel(pending, futures, cursors)
+        if failed is not None:
+            raise failed.exception()
+        if pending:
+            msg = f'Запросы не выполнены за {timeout} с'
+            raise QueryTimeoutError(msg)
+        return [future.result() for future in futures]
+
+    def cancel(self, pending, futures, cursors):
+        running = [cursor for future, cursor in zip(futures, cursors, strict=True)
+                   if future in pending and not future.cancel()]
+        for cursor in running:
+            cursor.cancelled = True
+        # Номер соединения имеет смысл только на своём сервере: KILL QUERY
+        # отправляется через пул, из которого задача взяла соединение
+        by_pool = {}
+        for cursor in running:
+            if cursor.connection_id is not None:
+                by_pool.setdefault(cursor.pool, []).append(cursor)
+        for pool, pool_cursors in by_pool.items():
+            # Срок запросов уже истёк: соединение для KILL берётся без
+            # ожидания, при занятом пуле запросы дорабатывают сами
+            try:
+                with pool.checkout(0) as conn, conn.cursor() as kill_cursor:
+                    for cursor in pool_cursors:
+                        cursor.kill(kill_cursor)
+            except mysql.connector.Error:
+                current_app.logger.exception('Не удалось прервать запросы на %s',
+                                             pool.db_config.get('host'))
+
+
+parallel_queries = ParallelQueries()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=parallel_queries.reset_after_fork)
+
+
+def query_timeout(error):
+    current_app.logger.warning('%s', error)
+    return 'Сервис перегружен, повторите запрос позже', 503, {'Retry-After': '1'}
+
+
+def init_parallel(app):
+    parallel_queries.configure(app.config['PARALLEL_QUERY_WORKERS'],
+                               app.config['PARALLEL_QUERY_TIMEOUT'])
+    app.register_error_handler(QueryTimeoutError, query_timeout)
@@ -0,0 +1,102 @@
+import functools
+import os
+import random
+import re
+import traceback
+from collections import Counter
+
+from extensions import db_connector
+from flask import current_app, g, has_request_context, request
+
+# Режимы: 'debug' проверяет каждый запрос, 'canary' — долю
+# DB_INSPECT_SAMPLE_RATE запросов, 'off' выключает проверку.
+MODES = ('off', 'debug', 'canary')
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Файлы обёрток БД не показываются в месте вызова
+SKIP_FILES = {os.path.join(APP_DIR, name)
+              for name in ('mysqldb.py', 'query_inspector.py')}
+
+COMMENT_RE = re.compile(r'/\*.*?\*/|--[^\n]*', re.DOTALL)
+LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\""
+                        r'|%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b')
+IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+SPACE_RE = re.compile(r'\s+')
+
+
+class QueryBudgetError(RuntimeError):
+    pass
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(statement):
+    # Запросы одной формы с разными значениями дают один отпечаток
+    normalized = COMMENT_RE.sub(' ', statement)
+    normalized = LITERAL_RE.sub('?', normalized)
+    normalized = IN_LIST_RE.sub('IN (?)', normalized)
+    return SPACE_RE.sub(' ', normalized).strip().upper()
+
+
+def call_site(limit=3):
+    frames = [frame for frame in traceback.extract_stack()
+              if frame.filename.startswith(APP_DIR)
+              and frame.filename not in SKIP_FILES]
+    return ''.join(traceback.format_list(frames[-limit:]))
+
+
+def start_request():
+    config = current_app.config
+    mode = config['DB_INSPECT_MODE']
+    sampled = random.random() < config['DB_INSPECT_SAMPLE_RATE']  # noqa: S311
+    if mode == 'debug' or (mode == 'canary' and sampled):
+        g.inspected_queries = Counter()
+
+
+def inspect_query(event):
+    if not has_request_context():
+        return
+    shapes = g.get('inspected_queries')
+    if shapes is None:
+        return
+
+    config = current_app.config
+    shape = fingerprint(event.statement)
+    shapes[shape] += 1
+    if shapes[shape] == config['DB_REPEAT_THRESHOLD']:
+        current_app.logger.warning(
+            'Возможный N+1 в %s: запрос повторён %d раз: %s\n%s',
+            request.endpoint, shapes[shape], shape, call_site())
+
+    if event.duration * 1000 > config['DB_SLOW_QUERY_MS']:
+        current_app.logger.warning(
+            'Медленный запрос в %s (%.1f мс): %s\n%s',
+            request.endpoint, event.duration * 1000, shape, call_site())
+
+
+def check_budget(response):
+    shapes = g.pop('inspected_queries', None)
+    if shapes is None:
+        return response
+
+    config = current_app.config
+    budget = config['QUERY_BUDGETS'].get(request.endpoint)
+    total = sum(shapes.values())
+    if budget is not None and total > budget:
+        msg = (f'{request.endpoint}: выполнено {total} SQL-запросов '
+               f'при бюджете {budget}: {dict(shapes)}')
+        if config['DB_INSPECT_STRICT']:
+            raise QueryBudgetError(msg)
+        current_app.logger.warning(msg)
+    return response
+
+
+def init_query_inspector(app):
+    mode = app.config['DB_INSPECT_MODE']
+    if mode not in MODES:
+        msg = f'DB_INSPECT_MODE должен быть одним из {MODES}'
+        raise ValueError(msg)
+    if mode == 'off':
+        return
+    app.before_request(start_request)
+    app.after_request(check_budget)
+    db_connector.add_query_listener(inspect_query)
@@ -0,0 +1,48 @@
+import mysql.connector
+from cache import CachedValue
+from extensions import db_connector
+
+
+class ReferenceData:
+    # Редко меняющиеся справочники (жанры, роли) хранятся в памяти процесса
+    # и перечитываются из БД по истечении ttl или после invalidate().
+    def __init__(self, queries, ttl=300) -> None:
+        self.ttl = ttl
+        self._queries = queries
+        self._values = {name: CachedValue(ttl) for name in queries}
+
+    def get(self, name):
+        return self._values[name].get(lambda: self._load(name), ttl=self.ttl)
+
+    def names_by_id(self, name):
+        return {row['id']: row['name'] for row in self.get(name)}
+
+    def preload(self):
+        for name in self._queries:
+            self.get(name)
+
+    def invalidate(self, name=None):
+        names = [name] if name is not None else list(self._values)
+        for item in names:
+            self._values[item].invalidate()
+
+    def _load(self, name):
+        with db_connector.connect().cursor(dictionary=True) as cursor:
+            cursor.execute(self._queries[name])
+            return tuple(cursor.fetchall())
+
+
+reference_data = ReferenceData({
+    'genres': 'SELECT id, name FROM Genres ORDER BY name',
+    'roles': 'SELECT id, name FROM Roles ORDER BY id',
+})
+
+
+def init_reference_data(app):
+    reference_data.ttl = app.config['REFERENCE_DATA_TTL']
+    with app.app_context():
+        try:
+            reference_data.preload()
+        except mysql.connector.Error as e:
+            # Справочники загрузятся при первом обращении
+            app.logger.warning('Не удалось загрузить справочники: %s', e)
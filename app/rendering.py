@@ -0,0 +1,115 @@
+import threading
+from functools import partial
+
+import bleach
+import click
+import jobs
+import markdown
+from bleach.linkifier import LinkifyFilter
+from extensions import db_connector
+from flask import current_app
+from flask.cli import AppGroup
+from markupsafe import Markup, escape
+
+cli = AppGroup('rendering', help='HTML описаний книг и рецензий.')
+
+# Описания книг и рецензии пишутся в Markdown и переводятся в очищенный HTML
+# один раз при сохранении; HTML хранится рядом с исходным текстом вместе
+# с версией, которой он получен. После изменения правил отрисовки версия
+# увеличивается, и фоновая задача rendering.rerender, которую ставит
+# flask db upgrade, обновляет старые записи.
+RENDERER_VERSION = 1
+
+ALLOWED_TAGS = frozenset({
+    'a', 'abbr', 'acronym', 'b', 'blockquote', 'br', 'code', 'em', 'h3', 'h4',
+    'h5', 'h6', 'hr', 'i', 'li', 'ol', 'p', 'pre', 'strong', 'ul',
+})
+ALLOWED_ATTRIBUTES = {'a': ['href', 'title'], 'abbr': ['title'], 'acronym': ['title']}
+ALLOWED_PROTOCOLS = frozenset({'http', 'https', 'mailto'})
+
+# Поля с исходным текстом: (таблица, текст, HTML, версия)
+RENDERED_FIELDS = (
+    ('Books', 'short_description', 'description_html', 'description_renderer'),
+    ('Reviews', 'review_text', 'review_html', 'review_renderer'),
+)
+
+# Экземпляры Markdown и Cleaner хранят состояние разбора, поэтому у каждого
+# потока свои
+_local = threading.local()
+
+
+def _renderer():
+    if not hasattr(_local, 'markdown'):
+        _local.markdown = markdown.Markdown(extensions=['nl2br', 'sane_lists'],
+                                            output_format='html')
+        _local.cleaner = bleach.Cleaner(
+            tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES,
+            protocols=ALLOWED_PROTOCOLS, strip=True,
+            filters=[partial(LinkifyFilter, callbacks=[bleach.callbacks.nofollow,
+                                                       bleach.callbacks.target_blank])])
+    return _local.markdown, _local.cleaner
+
+
+def render(text):
+    if not text:
+        return ''
+    converter, cleaner = _renderer()
+    try:
+        return cleaner.clean(converter.convert(text))
+    finally:
+        converter.reset()
+
+
+def stored_html(html, text):
+    # Запись, которую ещё не обработала фоновая задача, показывается как
+    # экранированный текст
+    if html is None:
+        return escape(text or '')
+    return Markup(html)  # noqa: S704
+
+
+def rerender(conn, *, force=False):
+    # Записи обновляются пачками по id; каждая пачка — отдельная транзакция,
+    # таблицы не блокируются на всё время пересчёта
+    batch_size = current_app.config['RENDER_BATCH_SIZE']
+    rendered = 0
+    for table, text_column, html_column, version_column in RENDERED_FIELDS:
+        version = RENDERER_VERSION + 1 if force else RENDERER_VERSION
+        last_id = 0
+        while True:
+            with conn.cursor() as cursor:
+                cursor.execute(f'SELECT id, {text_column} FROM {table} '  # noqa: S608
+                               f'WHERE id > %s AND {version_column} < %s '
+                               'ORDER BY id LIMIT %s', (last_id, version, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                cursor.executemany(f'UPDATE {table} SET {html_column} = %s, '  # noqa: S608
+                                   f'{version_column} = %s WHERE id = %s',
+                                   [(render(text), RENDERER_VERSION, row_id)
+                                    for row_id, text in rows])
+            conn.commit()
+            rendered += len(rows)
+            last_id = rows[-1][0]
+    return rendered
+
+
+@jobs.job('rendering.rerender')
+def rerender_job():
+    rendered = rerender(db_connector.connect())
+    current_app.logger.info('HTML обновлён для %d записей', rendered)
+
+
+def schedule_rerender():
+    # Ключ задачи содержит версию: задача для версии ставится один раз,
+    # повторно — только если прежняя исчерпала попытки
+    jobs.enqueue('rendering.rerender', key=f'rendering.rerender:{RENDERER_VERSION}')
+
+
+@cli.command('rerender')
+@click.option('--all', 'force', is_flag=True,
+              help='Пересоздать HTML всех записей, а не только устаревших')
+def rerender_command(force):
+    """Пересоздать HTML описаний книг и рецензий."""
+    rendered = rerender(db_connector.connect(), force=force)
+    click.echo(f'Обновлено записей: {rendered}')
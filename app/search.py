@@ -0,0 +1,78 @@
+import catalog
+from extensions import db_connector
+from flask import Blueprint, abort, render_template, request
+from reference_data import reference_data
+
+bp = Blueprint('search', __name__, url_prefix='/search')
+
+# Выражение должно совпадать со списком колонок FULLTEXT-индекса ft_books_search
+RELEVANCE_SQL = ('MATCH(Books.title, Books.author, Books.publisher, '
+                 'Books.short_description) AGAINST (%(q)s IN NATURAL LANGUAGE MODE)')
+SEARCH_QUERY = f"""
+    SELECT Books.id, Books.title, Books.year,
+           Book_stats.avg_rating,
+           COALESCE(Book_stats.review_count, 0) AS review_count,
+           Book_stats.genre_ids,
+           {RELEVANCE_SQL} AS relevance
+    FROM Books
+    LEFT JOIN Book_stats ON Book_stats.book_id = Books.id
+"""
+SEARCH_ORDER = ((RELEVANCE_SQL, 'relevance', float), ('Books.id', 'id', int))
+
+
+def parse_int(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def search_books(cursor, q, genre_id=None, year_from=None, year_to=None,
+                 after=None, before=None, per_page=catalog.PER_PAGE):
+    conditions = [RELEVANCE_SQL]
+    params = {'q': q}
+    if genre_id is not None:
+        conditions.append('EXISTS (SELECT 1 FROM Book_genre '
+                          'WHERE Book_genre.book_id = Books.id '
+                          'AND Book_genre.genre_id = %(genre_id)s)')
+        params['genre_id'] = genre_id
+    if year_from is not None:
+        conditions.append('Books.year >= %(year_from)s')
+        params['year_from'] = year_from
+    if year_to is not None:
+        conditions.append('Books.year <= %(year_to)s')
+        params['year_to'] = year_to
+
+    books, prev_cursor, next_cursor = catalog.fetch_keyset_page(
+        cursor, SEARCH_QUERY, SEARCH_ORDER, conditions=conditions, params=params,
+        after=after, before=before, per_page=per_page, salt='search-cursor')
+    catalog.attach_genre_names(books)
+    return books, prev_cursor, next_cursor
+
+
+@bp.route('')
+@db_connector.read_only
+def search():
+    q = request.args.get('q', '').strip()
+    filters = {
+        'genre': parse_int(request.args.get('genre')),
+        'year_from': parse_int(request.args.get('year_from')),
+        'year_to': parse_int(request.args.get('year_to')),
+    }
+    books, prev_cursor, next_cursor = [], None, None
+
+    if q:
+        with db_connector.connect().cursor(dictionary=True) as cursor:
+            try:
+                books, prev_cursor, next_cursor = search_books(
+                    cursor, q, filters['genre'], filters['year_from'],
+                    filters['year_to'], after=request.args.get('after'),
+                    before=request.args.get('before'))
+            except catalog.InvalidCursorError:
+                abort(400)
+
+    args = {'q': q, **{name: value for name, value in filters.items()
+                       if value is not None}}
+    return render_template('search.html', q=q, filters=filters, books=books,
+                           genres=reference_data.get('genres'), args=args,
+                           prev_cursor=prev_cursor, next_cursor=next_cursor)
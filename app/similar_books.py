@@ -0,0 +1,377 @@
+import math
+import time
+
+import book_stats
+import click
+import jobs
+from extensions import db_connector
+from flask import current_app
+from flask.cli import AppGroup
+
+cli = AppGroup('similar-books', help='Похожие книги для страницы книги.')
+
+# Сходство книг a и b:
+#   w * cos(жанры a, жанры b) + (1 - w) * cos(читатели a, читатели b),
+# где читатели книги — пользователи, оценившие её не ниже min_rating.
+# Кандидаты для книги — книги с общими читателями (разреженное произведение
+# матриц книга x читатель) и лучшие по жанрам книги её набора жанров, поэтому
+# top-k точный без попарного сравнения всех книг. Соседи хранятся в
+# Book_similar; изменённые книги отмечаются в Book_similar_dirty и
+# пересчитываются фоновой задачей similar_books.refresh, которая загружает
+# только эти книги и их кандидатов.
+
+
+class SimilarityModel:
+    def __init__(self, book_ids, genre_pairs, ratings, *, genre_weight=0.5,
+                 min_rating=4) -> None:
+        import numpy as np  # noqa: PLC0415
+        from scipy import sparse  # noqa: PLC0415
+
+        self.np = np
+        self.genre_weight = genre_weight
+        self.book_ids = np.sort(np.asarray(book_ids, dtype=np.int64))
+        count = len(self.book_ids)
+
+        # Набор жанров книги — её сигнатура; книги с одинаковым набором жанров
+        # имеют одну сигнатуру, сходство по жанрам считается между сигнатурами.
+        # Сигнатуры упорядочены по жанрам, их порядок не зависит от того,
+        # какие книги загружены
+        books, genres = self._pairs(genre_pairs)
+        book_genres = [set() for _ in range(count)]
+        for book, genre in zip(books.tolist(), genres.tolist(), strict=True):
+            book_genres[book].add(genre)
+        keys = [tuple(sorted(genre_set)) for genre_set in book_genres]
+        signature_keys = sorted(set(keys))
+        numbers = {key: number for number, key in enumerate(signature_keys)}
+        self.signature = np.array([numbers[key] for key in keys], dtype=np.int64)
+        genre_ids = sorted({genre for key in signature_keys for genre in key})
+        columns = {genre: column for column, genre in enumerate(genre_ids)}
+        signatures = np.zeros((len(signature_keys), len(columns)), dtype=np.float32)
+        for number, key in enumerate(signature_keys):
+            signatures[number, [columns[genre] for genre in key]] = 1
+        self.signature_vectors = self._normalize(signatures)
+
+        # Матрица книга x читатель с нормированными строками: произведение
+        # строк равно косинусу по общим читателям
+        books, users, values = self._pairs(ratings, with_values=True)
+        self.popularity = np.bincount(books, minlength=count)
+        liked = values >= min_rating
+        _, user_columns = np.unique(users[liked], return_inverse=True)
+        readers = sparse.csr_matrix(
+            (np.ones(int(liked.sum()), dtype=np.float32),
+             (books[liked], user_columns.reshape(-1))),
+            shape=(count, int(user_columns.max(initial=-1)) + 1))
+        readers.data[:] = 1
+        norms = np.sqrt(np.asarray(readers.sum(axis=1)).reshape(-1))
+        norms[norms == 0] = 1
+        self.readers = sparse.diags(1 / norms).astype(np.float32) @ readers
+        self.readers_t = self.readers.T.tocsr()
+
+        # Книги, упорядоченные по сигнатуре и убыванию популярности
+        self.by_signature = np.lexsort((-self.popularity, self.signature))
+        self.signature_starts = np.searchsorted(self.signature[self.by_signature],
+                                                np.arange(len(signatures) + 1))
+        self._fallback = {}
+
+    def _pairs(self, rows, *, with_values=False):
+        np = self.np
+        # Строки запроса -> (номер книги в матрице, значения); строки книг,
+        # удалённых между запросами, пропускаются
+        array = np.asarray(rows, dtype=np.int64).reshape(-1, 3 if with_values else 2)
+        array = array[np.isin(array[:, 0], self.book_ids)]
+        positions = np.searchsorted(self.book_ids, array[:, 0])
+        if with_values:
+            return positions, array[:, 1], array[:, 2]
+        return positions, array[:, 1]
+
+    def _normalize(self, matrix):
+        np = self.np
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def genre_similarity(self, books, others):
+        np = self.np
+        return np.einsum('ij,ij->i', self.signature_vectors[self.signature[books]],
+                         self.signature_vectors[self.signature[others]])
+
+    def fallback(self, signature, size):
+        # Лучшие по сходству жанров книги: сигнатуры по убыванию сходства,
+        # внутри сигнатуры — по популярности
+        if signature not in self._fallback:
+            np = self.np
+            similarity = self.signature_vectors @ self.signature_vectors[signature]
+            order = np.argsort(-similarity, kind='stable')
+            order = order[similarity[order] > 0]
+            sizes = np.diff(self.signature_starts)[order]
+            enough = int(np.searchsorted(np.cumsum(sizes), size)) + 1
+            self._fallback[signature] = np.concatenate(
+                [self.by_signature[self.signature_starts[group]:
+                                   self.signature_starts[group + 1]][:size]
+                 for group in order[:enough]] or [np.empty(0, dtype=np.int64)])[:size]
+        return self._fallback[signature]
+
+    def top_k(self, rows, k):
+        # Возвращает (книга, сосед, сходство, место) для строк rows
+        np = self.np
+        rows = np.asarray(rows, dtype=np.int64)
+        co_rated = (self.readers[rows] @ self.readers_t).tocoo()
+        fallback = [self.fallback(self.signature[row], k + 1) for row in rows]
+        fallback_rows = np.repeat(np.arange(len(rows)), [len(f) for f in fallback])
+
+        batch_rows = np.concatenate([co_rated.row, fallback_rows]).astype(np.int64)
+        others = np.concatenate([co_rated.col, *fallback]).astype(np.int64)
+        readers = np.concatenate([co_rated.data,
+                                  np.zeros(len(fallback_rows), dtype=np.float32)])
+        books = rows[batch_rows]
+        other = books != others
+        batch_rows, books, others, readers = (batch_rows[other], books[other],
+                                              others[other], readers[other])
+        scores = (self.genre_weight * self.genre_similarity(books, others)
+                  + (1 - self.genre_weight) * readers)
+
+        # Пара может попасть в кандидаты дважды: остаётся наибольшая оценка
+        keys = books * len(self.book_ids) + others
+        order = np.lexsort((-scores, keys))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = keys[order][1:] != keys[order][:-1]
+        order = order[first]
+        order = order[scores[order] > 0]
+
+        order = order[np.lexsort((others[order], -self.popularity[others[order]],
+                                  -scores[order], batch_rows[order]))]
+        starts = np.searchsorted(batch_rows[order], np.arange(len(rows)))
+        ranks = np.arange(len(order)) - starts[batch_rows[order]]
+        order, ranks = order[ranks < k], ranks[ranks < k]
+        return (self.book_ids[books[order]], self.book_ids[others[order]],
+                scores[order], ranks)
+
+    def rows_for(self, book_ids):
+        np = self.np
+        return np.intersect1d(self.book_ids, np.asarray(book_ids, dtype=np.int64),
+                              return_indices=True)[1]
+
+
+def genre_cosine(genres, others):
+    if not genres or not others:
+        return 0.0
+    return len(set(genres) & set(others)) / math.sqrt(len(genres) * len(others))
+
+
+def fallback_signatures(signature_counts, key, size):
+    # Сигнатуры, из которых SimilarityModel.fallback набирает size книг для
+    # сигнатуры key. Сигнатуры с тем же сходством, что у последней нужной,
+    # тоже берутся: модель может упорядочить их иначе из-за округления
+    similarity = {other: genre_cosine(key, other) for other in signature_counts}
+    ranked = sorted((other for other in similarity if similarity[other] > 0),
+                    key=lambda other: (-similarity[other], other))
+    chosen = []
+    total = 0
+    for other in ranked:
+        if total >= size and similarity[other] < similarity[chosen[-1]] - 1e-6:
+            break
+        chosen.append(other)
+        total += signature_counts[other]
+    return chosen
+
+
+def _select_in(cursor, query, ids, params=()):
+    # Запрос с условием IN ({}) выполняется пачками по SIMILAR_BOOKS_BATCH_SIZE
+    ids = list(ids)
+    batch_size = current_app.config['SIMILAR_BOOKS_BATCH_SIZE']
+    rows = []
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        cursor.execute(query.format(', '.join(['%s'] * len(batch))), [*batch, *params])
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+def _build_model(book_ids, genre_pairs, ratings):
+    config = current_app.config
+    return SimilarityModel(book_ids, genre_pairs, ratings,
+                           genre_weight=config['SIMILAR_BOOKS_GENRE_WEIGHT'],
+                           min_rating=config['SIMILAR_BOOKS_MIN_RATING'])
+
+
+def load_model(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT id FROM Books')
+        book_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT book_id, genre_id FROM Book_genre')
+        genre_pairs = cursor.fetchall()
+        cursor.execute('SELECT book_id, user_id, rating FROM Reviews')
+        ratings = cursor.fetchall()
+    return _build_model(book_ids, genre_pairs, ratings)
+
+
+def load_neighbourhood(conn, book_ids):
+    # Модель для пересчёта книг book_ids: сами книги, книги с их читателями
+    # и самые популярные книги сигнатур, из которых набираются списки по
+    # жанрам. Соседи этих книг получаются такими же, как в полной модели
+    config = current_app.config
+    min_rating = config['SIMILAR_BOOKS_MIN_RATING']
+    size = config['SIMILAR_BOOKS_COUNT'] + 1
+    with conn.cursor() as cursor:
+        related = set(book_ids)
+        related.update(row[0] for row in _select_in(
+            cursor, 'SELECT DISTINCT co.book_id FROM Reviews AS own '
+                    'JOIN Reviews AS co ON co.user_id = own.user_id '
+                    'WHERE own.book_id IN ({}) AND own.rating >= %s '
+                    'AND co.rating >= %s', book_ids, (min_rating, min_rating)))
+
+        cursor.execute('SELECT genre_ids, COUNT(*) FROM Book_stats GROUP BY genre_ids')
+        signature_counts = {tuple(book_stats.parse_genre_ids(genre_ids)): count
+                            for genre_ids, count in cursor.fetchall()}
+        keys = {}
+        for book_id, genre_id in _select_in(
+                cursor, 'SELECT book_id, genre_id FROM Book_genre '
+                        'WHERE book_id IN ({})', book_ids):
+            keys.setdefault(book_id, set()).add(genre_id)
+        needed = set()
+        for key in {tuple(sorted(genres)) for genres in keys.values()}:
+            needed.update(fallback_signatures(signature_counts, key, size))
+        for key in sorted(needed):
+            cursor.execute('SELECT book_id FROM Book_stats WHERE genre_ids = %s '
+                           'ORDER BY review_count DESC, book_id LIMIT %s',
+                           (book_stats.format_genre_ids(key), size))
+            related.update(row[0] for row in cursor.fetchall())
+
+        related = sorted(related)
+        existing = [row[0] for row in _select_in(
+            cursor, 'SELECT id FROM Books WHERE id IN ({})', related)]
+        genre_pairs = _select_in(cursor, 'SELECT book_id, genre_id FROM Book_genre '
+                                         'WHERE book_id IN ({})', existing)
+        ratings = _select_in(cursor, 'SELECT book_id, user_id, rating FROM Reviews '
+                                     'WHERE book_id IN ({})', existing)
+    return _build_model(existing, genre_pairs, ratings)
+
+
+def store(conn, model, rows):
+    # Соседи пересчитываются пачками; каждая пачка заменяет списки своих
+    # книг одной транзакцией, страницы книг всё время видят полный список
+    config = current_app.config
+    batch_size = config['SIMILAR_BOOKS_BATCH_SIZE']
+    stored = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        books, others, scores, ranks = model.top_k(batch, config['SIMILAR_BOOKS_COUNT'])
+        book_ids = model.book_ids[batch].tolist()
+        placeholders = ', '.join(['%s'] * len(book_ids))
+        with conn.cursor() as cursor:
+            cursor.execute('DELETE FROM Book_similar '
+                           f'WHERE book_id IN ({placeholders})', book_ids)  # noqa: S608
+            cursor.executemany('INSERT INTO Book_similar '
+                               '(book_id, similar_book_id, score, `rank`) '
+                               'VALUES (%s, %s, %s, %s)',
+                               list(zip(books.tolist(), others.tolist(),
+                                        scores.tolist(), ranks.tolist(), strict=True)))
+        conn.commit()
+        stored += len(book_ids)
+    return stored
+
+
+def rebuild(conn):
+    model = load_model(conn)
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM Book_similar_dirty')
+        last_dirty = cursor.fetchone()[0]
+    conn.commit()
+    rebuilt = store(conn, model, model.np.arange(len(model.book_ids)))
+    with conn.cursor() as cursor:
+        cursor.execute('DELETE FROM Book_similar_dirty WHERE id <= %s', (last_dirty,))
+    conn.commit()
+    return rebuilt
+
+
+def refresh(conn):
+    # Отметки, появившиеся во время пересчёта, остаются до следующей задачи
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT id, book_id FROM Book_similar_dirty')
+        dirty = cursor.fetchall()
+    conn.commit()
+    if not dirty:
+        return 0
+    book_ids = sorted({book_id for _, book_id in dirty})
+    model = load_neighbourhood(conn, book_ids)
+    refreshed = store(conn, model, model.rows_for(book_ids))
+    with conn.cursor() as cursor:
+        cursor.execute('DELETE FROM Book_similar_dirty WHERE id <= %s',
+                       (max(row_id for row_id, _ in dirty),))
+    conn.commit()
+    return refreshed
+
+
+def books_changed(cursor, book_ids):
+    cursor.executemany('INSERT INTO Book_similar_dirty (book_id) VALUES (%s)',
+                       [(book_id,) for book_id in book_ids])
+
+
+def book_changed(cursor, book_id):
+    books_changed(cursor, [book_id])
+
+
+def lists_with_book_changed(cursor, book_id):
+    cursor.execute('INSERT INTO Book_similar_dirty (book_id) '
+                   'SELECT book_id FROM Book_similar WHERE similar_book_id = %s',
+                   (book_id,))
+
+
+def book_genres_changed(cursor, book_id):
+    # Сходство по жанрам изменилось и в списке самой книги, и в списках,
+    # где она стоит соседом
+    book_changed(cursor, book_id)
+    lists_with_book_changed(cursor, book_id)
+
+
+def book_removed(cursor, book_id):
+    # Списки, где была удалённая книга, станут короче: их надо дополнить
+    lists_with_book_changed(cursor, book_id)
+
+
+def review_added(cursor, book_id, user_id, rating):
+    # Новый читатель меняет сходство книги со всеми книгами, которые он
+    # оценил высоко
+    book_changed(cursor, book_id)
+    if int(rating) >= current_app.config['SIMILAR_BOOKS_MIN_RATING']:
+        cursor.execute('INSERT INTO Book_similar_dirty (book_id) '
+                       'SELECT book_id FROM Reviews '
+                       'WHERE user_id = %s AND rating >= %s AND book_id <> %s',
+                       (user_id, current_app.config['SIMILAR_BOOKS_MIN_RATING'],
+                        book_id))
+
+
+def user_removed(cursor, user_id):
+    # Удалённый читатель меняет сходство всех книг, которые он оценивал
+    cursor.execute('INSERT INTO Book_similar_dirty (book_id) '
+                   'SELECT book_id FROM Reviews WHERE user_id = %s', (user_id,))
+
+
+def schedule_refresh():
+    # Изменения за интервал SIMILAR_BOOKS_REFRESH_DELAY собираются в одну
+    # задачу: ключ идемпотентности совпадает у всех вызовов интервала
+    delay = current_app.config['SIMILAR_BOOKS_REFRESH_DELAY']
+    window = int(time.time() // delay)
+    jobs.enqueue('similar_books.refresh', key=f'similar_books.refresh:{window}',
+                 delay=(window + 1) * delay - time.time())
+
+
+@jobs.job('similar_books.refresh')
+def refresh_job():
+    refreshed = refresh(db_connector.connect())
+    current_app.logger.info('Похожие книги пересчитаны для %d книг', refreshed)
+
+
+@cli.command('rebuild')
+def rebuild_command():
+    """Пересчитать похожие книги для всего каталога."""
+    rebuilt = rebuild(db_connector.connect())
+    click.echo(f'Пересчитано книг: {rebuilt}')
+
+
+@cli.command('refresh')
+def refresh_command():
+    """Пересчитать похожие книги для изменённых книг."""
+    refreshed = refresh(db_connector.connect())
+    click.echo(f'Пересчитано книг: {refreshed}')
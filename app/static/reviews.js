@@ -0,0 +1,45 @@
+"use strict"
+
+let loading = false;
+
+async function loadReviews(list, sentinel, observer) {
+    let nextCursor = list.dataset.nextCursor;
+    if (loading || !nextCursor) {
+        return;
+    }
+    loading = true;
+    try {
+        let url = new URL(list.dataset.url, window.location.origin);
+        url.searchParams.set("after", nextCursor);
+        let response = await fetch(url);
+        if (!response.ok) {
+            return;
+        }
+        let data = await response.json();
+        list.insertAdjacentHTML("beforeend", data.html);
+        list.dataset.nextCursor = data.next_cursor || "";
+        observer.unobserve(sentinel);
+        if (data.next_cursor) {
+            // Повторное наблюдение проверит, остался ли конец списка на экране
+            observer.observe(sentinel);
+        }
+    } finally {
+        loading = false;
+    }
+}
+
+window.addEventListener("load", function () {
+    let list = document.getElementById("reviews");
+    let sentinel = document.getElementById("reviews-sentinel");
+    if (!list || !sentinel || !list.dataset.nextCursor) {
+        return;
+    }
+    // Следующая порция рецензий запрашивается, когда конец списка
+    // приближается к области просмотра
+    let observer = new IntersectionObserver(function (entries) {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadReviews(list, sentinel, observer);
+        }
+    }, { rootMargin: "400px" });
+    observer.observe(sentinel);
+});
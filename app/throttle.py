@@ -0,0 +1,206 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# Ограничение попыток входа: корзины токенов по IP и по логину плюс растущая
+# блокировка после неудачных попыток. Проверка выполняется до обращения к БД.
+
+# Ключи без обращений дольше этого времени считаются сброшенными, секунды
+IDLE_TTL = 24 * 60 * 60
+# Неудачные попытки забываются по одной за столько секунд: общий адрес
+# с редкими ошибками ввода не накапливает блокировку
+FAILURE_WINDOW = 60
+
+
+class MemoryStore:
+    # Состояние ключей в памяти процесса: [токены (None — корзина полна),
+    # время пополнения, неудачные попытки, блокировка до, время последней
+    # неудачи]. Размер ограничен, давно не использованные ключи вытесняются
+    # первыми.
+    def __init__(self, maxsize=100_000) -> None:
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def _state(self, key, now):
+        state = self._data.get(key)
+        if state is None or now - state[1] > IDLE_TTL:
+            state = [None, now, 0.0, 0.0, now]
+            self._data[key] = state
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        self._data.move_to_end(key)
+        return state
+
+    def acquire(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(key, now)
+            if state[3] > now:
+                return state[3] - now
+            tokens = capacity if state[0] is None else state[0]
+            state[0] = min(capacity, tokens + (now - state[1]) * rate)
+            state[1] = now
+            if state[0] < 1:
+                return (1 - state[0]) / rate
+            state[0] -= 1
+            return 0
+
+    def failure(self, key, after, base, maximum, window=FAILURE_WINDOW):
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(key, now)
+            state[2] = decayed_failures(state[2], now - state[4], window) + 1
+            state[4] = now
+            delay = backoff_delay(state[2], after, base, maximum)
+            if delay:
+                state[3] = now + delay
+            return delay
+
+    def success(self, key):
+        with self._lock:
+            state = self._data.get(key)
+            if state is not None:
+                state[2] = 0.0
+                state[3] = 0.0
+
+    def __len__(self):
+        return len(self._data)
+
+
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'blocked_until')
+local blocked = tonumber(state[3]) or 0
+if blocked > now then
+    return tostring(blocked - now)
+end
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local retry = 0
+if tokens < 1 then
+    retry = (1 - tokens) / rate
+else
+    tokens = tokens - 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return tostring(retry)
+"""
+
+FAILURE_SCRIPT = """
+local now = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'failures', 'failed_at')
+local failures = tonumber(state[1]) or 0
+local failed_at = tonumber(state[2]) or now
+failures = math.max(failures - math.max(now - failed_at, 0) / tonumber(ARGV[6]), 0) + 1
+redis.call('HSET', KEYS[1], 'failures', tostring(failures), 'failed_at', tostring(now))
+local count = math.ceil(failures)
+local after = tonumber(ARGV[1])
+local delay = 0
+if count > after then
+    delay = math.min(tonumber(ARGV[2]) * 2 ^ (count - after - 1), tonumber(ARGV[3]))
+    redis.call('HSET', KEYS[1], 'blocked_until', tostring(now + delay))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return tostring(delay)
+"""
+
+
+class RedisStore:
+    # Общее состояние для нескольких процессов. Каждая операция — один
+    # Lua-скрипт, поэтому проверка и изменение корзины атомарны.
+    def __init__(self, url, prefix='login-throttle:') -> None:
+        import redis  # noqa: PLC0415
+
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self._acquire = self.client.register_script(ACQUIRE_SCRIPT)
+        self._failure = self.client.register_script(FAILURE_SCRIPT)
+
+    def acquire(self, key, capacity, rate):
+        return float(self._acquire(keys=[self.prefix + key],
+                                   args=[capacity, rate, time.time(), IDLE_TTL]))
+
+    def failure(self, key, after, base, maximum, window=FAILURE_WINDOW):
+        return float(self._failure(keys=[self.prefix + key],
+                                   args=[after, base, maximum, time.time(), IDLE_TTL,
+                                         window]))
+
+    def success(self, key):
+        self.client.hdel(self.prefix + key, 'failures', 'failed_at', 'blocked_until')
+
+
+def decayed_failures(failures, elapsed, window):
+    return max(failures - max(elapsed, 0) / window, 0)
+
+
+def backoff_delay(failures, after, base, maximum):
+    # Дробный остаток неудачи, которая ещё не забыта, считается целой
+    failures = math.ceil(failures)
+    if failures <= after:
+        return 0
+    return min(base * 2 ** (failures - after - 1), maximum)
+
+
+class LoginThrottle:
+    def __init__(self, store=None) -> None:
+        self.store = store if store is not None else MemoryStore()
+        self.enabled = True
+        self.ip_burst = 20
+        self.ip_rate = 10 / 60
+        self.login_burst = 5
+        self.login_rate = 5 / 60
+        self.backoff_after = 3
+        self.backoff_base = 1
+        self.backoff_max = 300
+        self.failure_window = FAILURE_WINDOW
+
+    def _keys(self, ip, login):
+        return f'ip:{ip}', f'login:{login.strip().lower()}'
+
+    def check(self, ip, login):
+        # Возвращает 0, если попытку можно выполнить, иначе сколько секунд ждать
+        if not self.enabled:
+            return 0
+        ip_key, login_key = self._keys(ip, login)
+        retry_after = self.store.acquire(ip_key, self.ip_burst, self.ip_rate)
+        if retry_after:
+            return retry_after
+        return self.store.acquire(login_key, self.login_burst, self.login_rate)
+
+    def failed(self, ip, login):
+        if self.enabled:
+            for key in self._keys(ip, login):
+                self.store.failure(key, self.backoff_after, self.backoff_base,
+                                   self.backoff_max, self.failure_window)
+
+    def succeeded(self, ip, login):
+        # Сбрасываются только неудачи логина: успешный вход в одну учётную
+        # запись не должен снимать блокировку с адреса перебора
+        if self.enabled:
+            self.store.success(self._keys(ip, login)[1])
+
+
+login_throttle = LoginThrottle()
+
+
+def init_throttle(app):
+    config = app.config
+    if config['THROTTLE_STORAGE_URL']:
+        login_throttle.store = RedisStore(config['THROTTLE_STORAGE_URL'])
+    else:
+        login_throttle.store = MemoryStore(config['THROTTLE_MAX_KEYS'])
+    login_throttle.enabled = config['THROTTLE_ENABLED']
+    login_throttle.ip_burst = config['THROTTLE_IP_BURST']
+    login_throttle.ip_rate = config['THROTTLE_IP_PER_MINUTE'] / 60
+    login_throttle.login_burst = config['THROTTLE_LOGIN_BURST']
+    login_throttle.login_rate = config['THROTTLE_LOGIN_PER_MINUTE'] / 60
+    login_throttle.backoff_after = config['THROTTLE_BACKOFF_AFTER']
+    login_throttle.backoff_base = config['THROTTLE_BACKOFF_BASE']
+    login_throttle.backoff_max = config['THROTTLE_BACKOFF_MAX']
+    login_throttle.failure_window = config['THROTTLE_FAILURE_WINDOW']
@@ -1,28 +1,44 @@
 import re
 
+import book_stats
+import catalog
 import mysql.connector
+import similar_books
 from autorization import (
     can_user,
+    forget_user,
 )
+from extensions import db_connector
 from flask import (
     Blueprint,
+    abort,
     flash,
     redirect,
     render_template,
     request,
+    stream_template,
     url_for,
 )
 from flask_login import (
     current_user,
     login_required,
 )
-
-from app import (
-    db_connector,
-)
+from reference_data import reference_data
 
 bp = Blueprint('users', __name__, url_prefix='/users')
 
+USERS_PER_PAGE = 50
+EXPORT_BATCH_SIZE = 500
+# Только колонки, которые выводит список; хэш пароля не читается
+USER_LIST_QUERY = """
+    SELECT Users.id, Users.login, Users.last_name, Users.first_name,
+           Users.middle_name, Users.created_at,
+           Roles.name AS role_name
+    FROM Users
+    LEFT JOIN Roles ON Users.role_id = Roles.id
+"""
+USER_ORDER = (('Users.id', 'id', int),)
+
 
 def is_valid_password(password):
     errors = {}
@@ -76,31 +92,62 @@ def validate_user_data(login, password, first_name, last_name):
 
 def get_roles():
     try:
-        with db_connector.connect().cursor(dictionary=True) as cursor:
-            cursor.execute('SELECT id, name FROM Roles')
-            roles = cursor.fetchall()
+        roles = reference_data.get('roles')
     except:  # noqa: E722
         flash('Ошибка получения ролей', category='danger')
         roles = []
     return roles
 
 
+def search_conditions(q):
+    if not q:
+        return [], {}
+    # Поиск по началу логина, фамилии или имени использует индексы колонок
+    prefix = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    condition = ('(Users.login LIKE %(prefix)s OR Users.last_name LIKE %(prefix)s '
+                 'OR Users.first_name LIKE %(prefix)s)')
+    return [condition], {'prefix': prefix}
+
+
+@db_connector.read_only
+def iter_users(conditions, params):
+    # Небуферизованный курсор: строки читаются из сокета порциями по мере
+    # вывода шаблона, поэтому память не зависит от числа пользователей
+    where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+    # Порядок тот же, что на странице списка: новые пользователи первыми
+    order = catalog.order_sql(USER_ORDER)
+    with db_connector.connect().cursor(dictionary=True, buffered=False) as cursor:
+        cursor.execute(f'{USER_LIST_QUERY} {where} ORDER BY {order}', params)  # noqa: S608
+        while rows := cursor.fetchmany(EXPORT_BATCH_SIZE):
+            yield from rows
+
+
 @bp.route('/users-list')
+@db_connector.read_only
 @can_user('read')
 def get_users_list():
+    q = request.args.get('q', '').strip()
+    conditions, params = search_conditions(q)
+
+    if request.args.get('export'):
+        # stream_template отдаёт страницу частями внутри stream_with_context,
+        # соединение с БД остаётся открытым до конца ответа
+        return stream_template('users-list.html', users=iter_users(conditions, params),
+                               q=q, export=True, args={'q': q} if q else {})
+
     with db_connector.connect().cursor(dictionary=True) as cursor:
-        query = """
-            SELECT Users.id, Users.login, Users.password, 
-                   Users.last_name, Users.first_name, Users.middle_name, 
-                   Users.created_at, 
-                   Roles.name as role_name 
-            FROM Users 
-            LEFT JOIN Roles ON Users.role_id = Roles.id
-        """  # noqa: W291
-        cursor.execute(query)
-        users = cursor.fetchall()
+        try:
+            users, prev_cursor, next_cursor = catalog.fetch_keyset_page(
+                cursor, USER_LIST_QUERY, USER_ORDER, conditions=conditions,
+                params=params, after=request.args.get('after'),
+                before=request.args.get('before'), per_page=USERS_PER_PAGE,
+                salt='users-cursor')
+        except catalog.InvalidCursorError:
+            abort(400)
 
-    return render_template('users-list.html', users=users)
+    return render_template('users-list.html', users=users, q=q, export=False,
+                           args={'q': q} if q else {},
+                           prev_cursor=prev_cursor, next_cursor=next_cursor)
 
 
 @bp.route('/create-user', methods=['GET', 'POST'])
@@ -193,6 +240,7 @@ def edit_user(user_id):
                     cursor.execute(query, (last_name, first_name,
                                            middle_name, user_id))
                     db_connector.connect().commit()
+            forget_user(user_id)
 
             flash('Запись пользователя успешно обновлена', category='success')
 
@@ -234,12 +282,17 @@ def delete_user(user_id):
             flash('Пользователь не найден', category='danger')
             return redirect(url_for('users.get_users_list'))
 
-        with db_connector.connect().cursor() as cursor:
+        with db_connector.transaction(dictionary=False) as unit:
+            # Рецензии удаляются каскадом (миграция 0006): агрегаты книг
+            # и похожие книги обновляются в той же транзакции до удаления
+            book_stats.remove_user_reviews(unit.cursor, user_id)
+            similar_books.user_removed(unit.cursor, user_id)
             query = """
                 DELETE FROM Users WHERE id = %s
             """
-            cursor.execute(query, (user_id,))
-            db_connector.connect().commit()
+            unit.cursor.execute(query, (user_id,))
+            unit.after_commit(similar_books.schedule_refresh)
+        forget_user(user_id)
 
         flash('Пользователь успешно удален', category='success')
         return redirect(url_for('users.get_users_list'))
@@ -292,6 +345,7 @@ def change_password():
             """  # noqa: W291
             cursor.execute(query, (new_password, cur_user_username))
             db_connector.connect().commit()
+        forget_user(current_user.id)
 
         flash('Пароль успешно изменен', category='success')
         return redirect(url_for('index'))
@@ -0,0 +1,6 @@
+from app import create_app
+
+# Точка входа WSGI-сервера, например:
+#   gunicorn --preload --workers 4 wsgi:application
+# С --preload приложение создаётся и прогревается один раз в главном процессе
+app = application = create_app()
@@ -0,0 +1,51 @@
+import bisect
+import itertools
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT_DIR, 'app')
+
+BENCH_LOGIN_PREFIX = 'benchuser'
+# Метки строк, созданных seed.py: по ним --reset удаляет только их
+BENCH_PUBLISHER_SUFFIX = ' (bench)'
+BENCH_COVER_PREFIX = 'bench-'
+BENCH_PASSWORD = 'Bench12345'
+READER_ROLE_ID = 3
+
+
+def load_app():
+    # Ограничение попыток входа мешало бы сценарию auth.login, метрики
+    # и проверка запросов не должны влиять на измерения
+    os.environ.setdefault('THROTTLE_ENABLED', '0')
+    os.environ.setdefault('METRICS_ENABLED', '0')
+    os.environ.setdefault('DB_INSPECT_MODE', 'off')
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    os.chdir(APP_DIR)
+    from app import create_app  # noqa: PLC0415
+
+    return create_app()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,  # noqa: S607
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class ZipfSampler:
+    # Выбор элемента с вероятностью 1 / rank^skew: несколько книг получают
+    # большую часть рецензий и просмотров, как в реальном каталоге
+    def __init__(self, items, skew, rng) -> None:
+        self.items = list(items)
+        self.rng = rng
+        weights = (1 / rank ** skew for rank in range(1, len(self.items) + 1))
+        self.cum_weights = list(itertools.accumulate(weights))
+
+    def __call__(self):
+        point = self.rng.random() * self.cum_weights[-1]
+        return self.items[bisect.bisect_left(self.cum_weights, point)]
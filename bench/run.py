@@ -0,0 +1,225 @@
+import json
+import os
+import random
+import threading
+import time
+from datetime import UTC, datetime
+
+import click
+from common import (
+    BENCH_LOGIN_PREFIX,
+    BENCH_PASSWORD,
+    ZipfSampler,
+    git_commit,
+    load_app,
+)
+from flask import g, has_app_context, request_started
+
+SCENARIOS = ('index', 'deep_page', 'view_book', 'write_review', 'login')
+DEFAULT_MIX = 'index=30,deep_page=10,view_book=45,write_review=5,login=10'
+
+
+class QueryCounter:
+    # Слушатель DBConnector: число SQL-запросов HTTP-запроса. Счётчик хранится
+    # в g, который parallel_queries передаёт задачам, поэтому учитываются и
+    # запросы из потоков пула. Итог запроса сохраняется для потока,
+    # выполнившего запрос
+    def __init__(self) -> None:
+        self._local = threading.local()
+
+    def __call__(self, _event):
+        queries = g.get('bench_queries') if has_app_context() else None
+        if queries is not None:
+            queries.append(1)
+
+    def start_request(self, _sender, **_extra):
+        g.bench_queries = []
+
+    def finish_request(self, _exc=None):
+        self._local.count = len(g.pop('bench_queries', []))
+
+    def init_app(self, app):
+        # request_started отправляется до всех before_request приложения
+        request_started.connect(self.start_request, app)
+        app.teardown_request(self.finish_request)
+
+    def take(self):
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            msg = f'Неизвестный сценарий {name}, доступны: {", ".join(SCENARIOS)}'
+            raise click.BadParameter(msg)
+        mix[name] = float(weight)
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for latency, _, _ in samples)
+    queries = sorted(count for _, count, _ in samples)
+    summary = {
+        'requests': len(samples),
+        'errors': sum(1 for _, _, ok in samples if not ok),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+    }
+    if not samples:
+        return summary
+    summary.update({
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'queries_p95': percentile(queries, 0.95),
+    })
+    return summary
+
+
+class Worker(threading.Thread):
+    def __init__(self, number, app, catalog, mix, counter, deadline, seed) -> None:
+        super().__init__(daemon=True)
+        self.number = number
+        self.app = app
+        self.catalog = catalog
+        self.mix = mix
+        self.counter = counter
+        self.deadline = deadline
+        self.rng = random.Random(seed + number)
+        self.pick_book = ZipfSampler(catalog['book_ids'], catalog['skew'], self.rng)
+        self.samples = {name: [] for name in SCENARIOS}
+        self.login = f'{BENCH_LOGIN_PREFIX}{number % catalog["users"]}'
+
+    def request(self, client, name):
+        if name == 'index':
+            return client.get('/')
+        if name == 'deep_page':
+            # Вторая половина каталога: страницы с наибольшим OFFSET
+            pages = self.catalog['pages']
+            return client.get(f'/page/{self.rng.randint(max(pages // 2, 1), pages)}')
+        if name == 'view_book':
+            return client.get(f'/books/{self.pick_book()}')
+        if name == 'write_review':
+            book_id = self.rng.choice(self.catalog['book_ids'])
+            return client.post(f'/books/{book_id}/review',
+                               data={'rating': self.rng.randint(0, 5),
+                                     'text': 'Рецензия нагрузочного теста'})
+        return client.post('/auth/login', data={'username': self.login,
+                                                'password': BENCH_PASSWORD})
+
+    def run(self):
+        client = self.app.test_client()
+        client.post('/auth/login', data={'username': self.login,
+                                         'password': BENCH_PASSWORD})
+        names = list(self.mix)
+        weights = list(self.mix.values())
+        while time.monotonic() < self.deadline:
+            name = self.rng.choices(names, weights)[0]
+            self.counter.take()
+            started = time.perf_counter()
+            response = self.request(client, name)
+            latency = time.perf_counter() - started
+            self.samples[name].append((latency, self.counter.take(),
+                                       response.status_code < 400))  # noqa: PLR2004
+
+
+def load_catalog(app, skew):
+    from extensions import db_connector  # noqa: PLC0415
+
+    with app.app_context(), db_connector.connect().cursor() as cursor:
+        cursor.execute('SELECT id FROM Books ORDER BY id')
+        book_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT COUNT(*) FROM Users WHERE login LIKE %s',
+                       (f'{BENCH_LOGIN_PREFIX}%',))
+        users = cursor.fetchone()[0]
+    if not book_ids or not users:
+        msg = 'Каталог пуст: сначала выполните bench/seed.py'
+        raise click.ClickException(msg)
+    per_page = 10
+    return {'book_ids': book_ids, 'users': users, 'skew': skew,
+            'pages': (len(book_ids) + per_page - 1) // per_page}
+
+
+@click.command(help='Нагрузить приложение через WSGI и вывести задержки '
+                    'и число SQL-запросов по сценариям в формате JSON.')
+@click.option('--concurrency', default=8, show_default=True)
+@click.option('--duration', default=30.0, show_default=True, help='Секунды измерения')
+@click.option('--warmup', default=5.0, show_default=True, help='Секунды прогрева')
+@click.option('--mix', default=DEFAULT_MIX, show_default=True,
+              help='Веса сценариев: имя=вес через запятую')
+@click.option('--skew', default=1.1, show_default=True,
+              help='Показатель Ципфа для выбора книг в view_book')
+@click.option('--seed', default=42, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), default=None,
+              help='Файл для JSON-отчёта (по умолчанию stdout)')
+def main(concurrency, duration, warmup, mix, skew, seed, output):
+    mix = parse_mix(mix)
+    # load_app меняет рабочий каталог
+    output = os.path.abspath(output) if output else None
+    app = load_app()
+    from extensions import db_connector  # noqa: PLC0415
+
+    app.config['TESTING'] = True
+    counter = QueryCounter()
+    counter.init_app(app)
+    db_connector.add_query_listener(counter)
+    catalog = load_catalog(app, skew)
+
+    if warmup > 0:
+        warmers = [Worker(number, app, catalog, mix, counter,
+                          time.monotonic() + warmup, seed)
+                   for number in range(concurrency)]
+        for worker in warmers:
+            worker.start()
+        for worker in warmers:
+            worker.join()
+
+    started = time.monotonic()
+    workers = [Worker(number, app, catalog, mix, counter, started + duration, seed)
+               for number in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    scenarios = {}
+    all_samples = []
+    for name in mix:
+        samples = [sample for worker in workers for sample in worker.samples[name]]
+        all_samples.extend(samples)
+        scenarios[name] = summarize(samples, elapsed)
+
+    report = {
+        'commit': git_commit(),
+        'started_at': datetime.now(UTC).isoformat(timespec='seconds'),
+        'config': {'concurrency': concurrency, 'duration': duration, 'warmup': warmup,
+                   'mix': mix, 'skew': skew, 'seed': seed,
+                   'books': len(catalog['book_ids']), 'users': catalog['users']},
+        'total': summarize(all_samples, elapsed),
+        'scenarios': scenarios,
+        'pools': db_connector.pool_stats(),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as out:
+            out.write(text + '\n')
+    else:
+        click.echo(text)
+
+
+if __name__ == '__main__':
+    main()
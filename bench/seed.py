@@ -0,0 +1,187 @@
+import hashlib
+import os
+import random
+import struct
+import zlib
+
+import click
+from common import (
+    BENCH_COVER_PREFIX,
+    BENCH_LOGIN_PREFIX,
+    BENCH_PASSWORD,
+    BENCH_PUBLISHER_SUFFIX,
+    READER_ROLE_ID,
+    ZipfSampler,
+    load_app,
+)
+
+BATCH_SIZE = 1000
+AUTHORS = ('Анна Петрова', 'Иван Соколов', 'Мария Лебедева', 'Олег Морозов',
+           'Елена Волкова', 'Дмитрий Козлов', 'Ольга Новикова', 'Сергей Павлов')
+PUBLISHERS = ('Эксмо', 'АСТ', 'Азбука', 'МИФ', 'Питер', 'Альпина')
+WORDS = ('книга', 'история', 'город', 'время', 'дорога', 'море', 'память',
+         'ночь', 'свет', 'тайна', 'дом', 'война', 'мир', 'огонь', 'сад')
+
+
+def png_bytes(index):
+    # Одноцветное изображение 1x1: у каждой обложки свой цвет и свой MD5
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+
+    color = struct.pack('>I', index)[1:]
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b'\x00' + color))
+            + chunk(b'IEND', b''))
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def insert_batches(conn, query, rows):
+    with conn.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            cursor.executemany(query, rows[start:start + BATCH_SIZE])
+            conn.commit()
+
+
+def fetch_ids(conn, query, params=()):
+    with conn.cursor() as cursor:
+        cursor.execute(query, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def reset_data(conn):
+    # Удаляются только строки, созданные seed.py: пользователи bench, книги
+    # с меткой издательства и их обложки. Рецензии, жанры книг и агрегаты
+    # этих книг удаляются каскадом (миграция 0006); агрегаты остальных книг
+    # пересчитываются после заполнения
+    with conn.cursor() as cursor:
+        cursor.execute('DELETE FROM Users WHERE login LIKE %s',
+                       (f'{BENCH_LOGIN_PREFIX}%',))
+        cursor.execute('DELETE FROM Books WHERE publisher LIKE %s',
+                       (f'%{BENCH_PUBLISHER_SUFFIX}',))
+        cursor.execute('DELETE FROM Covers WHERE file_name LIKE %s AND NOT EXISTS '
+                       '(SELECT 1 FROM Books WHERE Books.cover_id = Covers.id)',
+                       (f'{BENCH_COVER_PREFIX}%',))
+    conn.commit()
+
+
+def seed_genres(conn, count):
+    existing = fetch_ids(conn, 'SELECT id FROM Genres ORDER BY id')
+    missing = [(f'Жанр {number}',) for number in range(len(existing) + 1, count + 1)]
+    if missing:
+        insert_batches(conn, 'INSERT INTO Genres (name) VALUES (%s)', missing)
+    return fetch_ids(conn, 'SELECT id FROM Genres ORDER BY id')[:count]
+
+
+def seed_users(conn, count):
+    password_hash = hashlib.sha256(BENCH_PASSWORD.encode()).hexdigest()
+    rows = [(f'{BENCH_LOGIN_PREFIX}{number}', password_hash, f'Фамилия{number}',
+             f'Имя{number}', None, READER_ROLE_ID) for number in range(count)]
+    # Пользователи прошлого запуска без --reset остаются как есть
+    insert_batches(conn, 'INSERT IGNORE INTO Users (login, password, last_name, '
+                   'first_name, middle_name, role_id) VALUES (%s, %s, %s, %s, %s, %s)',
+                   rows)
+    return fetch_ids(conn, 'SELECT id FROM Users WHERE login LIKE '
+                     f"'{BENCH_LOGIN_PREFIX}%' ORDER BY id")[:count]
+
+
+def seed_covers(conn, count, covers_dir):
+    os.makedirs(covers_dir, exist_ok=True)
+    rows = []
+    for number in range(count):
+        data = png_bytes(number)
+        md5_hash = hashlib.md5(data).hexdigest()  # noqa: S324
+        file_name = f'{BENCH_COVER_PREFIX}{md5_hash}.png'
+        with open(os.path.join(covers_dir, file_name), 'wb') as out:
+            out.write(data)
+        rows.append((file_name, 'image/png', md5_hash))
+    # Содержимое обложек детерминировано: при повторном запуске записи уже есть
+    insert_batches(conn, 'INSERT IGNORE INTO Covers (file_name, mime_type, md5_hash) '
+                   'VALUES (%s, %s, %s)', rows)
+    return fetch_ids(conn, 'SELECT id FROM Covers WHERE file_name LIKE %s ORDER BY id',
+                     (f'{BENCH_COVER_PREFIX}%',))[:count]
+
+
+def seed_books(conn, rng, count, cover_ids, genre_ids):
+    last_id = fetch_ids(conn, 'SELECT COALESCE(MAX(id), 0) FROM Books')[0]
+    rows = [(f'{sentence(rng, 3)} {number}', sentence(rng, 30), rng.randint(1950, 2024),
+             rng.choice(PUBLISHERS) + BENCH_PUBLISHER_SUFFIX, rng.choice(AUTHORS),
+             rng.randint(80, 1200), rng.choice(cover_ids)) for number in range(count)]
+    insert_batches(conn, 'INSERT INTO Books (title, short_description, year, '
+                   'publisher, author, pages, cover_id) '
+                   'VALUES (%s, %s, %s, %s, %s, %s, %s)', rows)
+    # Жанры получают только что добавленные книги, книги каталога не меняются
+    book_ids = fetch_ids(conn, 'SELECT id FROM Books '
+                         'WHERE id > %s AND publisher LIKE %s ORDER BY id',
+                         (last_id, f'%{BENCH_PUBLISHER_SUFFIX}'))
+    book_genres = [(book_id, genre_id) for book_id in book_ids
+                   for genre_id in rng.sample(genre_ids, rng.randint(1, 3))]
+    insert_batches(conn, 'INSERT INTO Book_genre (book_id, genre_id) VALUES (%s, %s)',
+                   book_genres)
+    return book_ids
+
+
+def seed_reviews(conn, rng, count, book_ids, user_ids, skew):
+    # Одна рецензия на пару (книга, пользователь); у популярных книг число
+    # рецензий ограничено числом пользователей
+    pick_book = ZipfSampler(book_ids, skew, rng)
+    pairs = set()
+    attempts = 0
+    while len(pairs) < count and attempts < count * 10:
+        pairs.add((pick_book(), rng.choice(user_ids)))
+        attempts += 1
+    rows = [(book_id, user_id, rng.randint(0, 5), sentence(rng, rng.randint(10, 80)))
+            for book_id, user_id in pairs]
+    insert_batches(conn, 'INSERT INTO Reviews (book_id, user_id, rating, review_text) '
+                   'VALUES (%s, %s, %s, %s)', rows)
+    return len(rows)
+
+
+@click.command(help='Заполнить БД синтетическим каталогом для bench/run.py. '
+                    'Подключение задаётся переменными MYSQL_HOST, MYSQL_USER, '
+                    'MYSQL_PASSWORD и MYSQL_DATABASE.')
+@click.option('--books', default=10_000, show_default=True)
+@click.option('--reviews', default=100_000, show_default=True)
+@click.option('--users', default=2_000, show_default=True)
+@click.option('--genres', default=20, show_default=True)
+@click.option('--covers', default=200, show_default=True)
+@click.option('--skew', default=1.1, show_default=True,
+              help='Показатель распределения Ципфа для популярности книг')
+@click.option('--seed', default=42, show_default=True)
+@click.option('--reset', is_flag=True,
+              help='Удалить книги, обложки и пользователей, созданные seed.py, '
+                   'вместе с их рецензиями')
+def main(books, reviews, users, genres, covers, skew, seed, reset):
+    app = load_app()
+    import book_stats  # noqa: PLC0415
+    import facets  # noqa: PLC0415
+    import rendering  # noqa: PLC0415
+    import similar_books  # noqa: PLC0415
+    from extensions import db_connector  # noqa: PLC0415
+
+    rng = random.Random(seed)
+    with app.app_context():
+        conn = db_connector.connect()
+        if reset:
+            reset_data(conn)
+        genre_ids = seed_genres(conn, genres)
+        user_ids = seed_users(conn, users)
+        cover_ids = seed_covers(conn, covers, app.config['COVERS_DIR'])
+        book_ids = seed_books(conn, rng, books, cover_ids, genre_ids)
+        review_count = seed_reviews(conn, rng, reviews, book_ids, user_ids, skew)
+        book_stats.rebuild(conn)
+        facets.rebuild(conn)
+        similar_books.rebuild(conn)
+        rendering.rerender(conn)
+
+    click.echo(f'Книг: {len(book_ids)}, рецензий: {review_count}, '
+               f'пользователей: {len(user_ids)}, жанров: {len(genre_ids)}, '
+               f'обложек: {len(cover_ids)}')
+
+
+if __name__ == '__main__':
+    main()
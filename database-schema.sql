@@ -0,0 +1,146 @@
+-- Итоговая схема БД для справки. Источник истины — app/migrations:
+-- изменения схемы оформляются новой миграцией и применяются командой
+--   flask db upgrade
+-- Этот файл обновляется вместе с миграциями.
+
+CREATE TABLE Roles (
+    id INT NOT NULL AUTO_INCREMENT,
+    name VARCHAR(100) NOT NULL,
+    description TEXT,
+    PRIMARY KEY (id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE Users (
+    id INT NOT NULL AUTO_INCREMENT,
+    login VARCHAR(100) NOT NULL,
+    password CHAR(64) NOT NULL,
+    last_name VARCHAR(100) NOT NULL,
+    first_name VARCHAR(100) NOT NULL,
+    middle_name VARCHAR(100),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    role_id INT,
+    PRIMARY KEY (id),
+    UNIQUE KEY uq_users_login (login),
+    KEY ix_users_last_name (last_name),
+    KEY ix_users_first_name (first_name),
+    CONSTRAINT fk_users_role FOREIGN KEY (role_id) REFERENCES Roles (id)
+        ON DELETE SET NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE Genres (
+    id INT NOT NULL AUTO_INCREMENT,
+    name VARCHAR(100) NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE KEY uq_genres_name (name)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE Covers (
+    id INT NOT NULL AUTO_INCREMENT,
+    file_name VARCHAR(255) NOT NULL,
+    mime_type VARCHAR(100) NOT NULL,
+    md5_hash CHAR(32) NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE KEY uq_covers_md5_hash (md5_hash)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Главная страница упорядочена по (year, id); ft_books_search — поиск (/search)
+CREATE TABLE Books (
+    id INT NOT NULL AUTO_INCREMENT,
+    title VARCHAR(255) NOT NULL,
+    short_description TEXT NOT NULL,
+    description_html TEXT NULL,
+    description_renderer SMALLINT NOT NULL DEFAULT 0,
+    year INT NOT NULL,
+    publisher VARCHAR(255) NOT NULL,
+    author VARCHAR(255) NOT NULL,
+    pages INT NOT NULL,
+    cover_id INT,
+    PRIMARY KEY (id),
+    KEY ix_books_year_id (year, id),
+    KEY ix_books_description_renderer (description_renderer),
+    FULLTEXT KEY ft_books_search (title, author, publisher, short_description),
+    CONSTRAINT fk_books_cover FOREIGN KEY (cover_id) REFERENCES Covers (id)
+        ON DELETE SET NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE Book_genre (
+    book_id INT NOT NULL,
+    genre_id INT NOT NULL,
+    PRIMARY KEY (book_id, genre_id),
+    KEY ix_book_genre_genre_book (genre_id, book_id),
+    CONSTRAINT fk_book_genre_book FOREIGN KEY (book_id) REFERENCES Books (id)
+        ON DELETE CASCADE,
+    CONSTRAINT fk_book_genre_genre FOREIGN KEY (genre_id) REFERENCES Genres (id)
+        ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Рецензии книги: новые первыми (book_id, id) и по оценке; одна рецензия
+-- пользователя на книгу
+CREATE TABLE Reviews (
+    id INT NOT NULL AUTO_INCREMENT,
+    book_id INT NOT NULL,
+    user_id INT NOT NULL,
+    rating TINYINT NOT NULL,
+    review_text TEXT NOT NULL,
+    review_html TEXT NULL,
+    review_renderer SMALLINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (id),
+    KEY ix_reviews_book (book_id),
+    KEY ix_reviews_book_rating (book_id, rating),
+    UNIQUE KEY uq_reviews_book_user (book_id, user_id),
+    KEY ix_reviews_renderer (review_renderer),
+    CONSTRAINT fk_reviews_book FOREIGN KEY (book_id) REFERENCES Books (id)
+        ON DELETE CASCADE,
+    CONSTRAINT fk_reviews_user FOREIGN KEY (user_id) REFERENCES Users (id)
+        ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Агрегаты по книгам для главной страницы (flask book-stats rebuild/verify)
+CREATE TABLE Book_stats (
+    book_id INT NOT NULL,
+    review_count INT NOT NULL DEFAULT 0,
+    rating_sum INT NOT NULL DEFAULT 0,
+    avg_rating DECIMAL(6, 4) AS (rating_sum / NULLIF(review_count, 0)) VIRTUAL,
+    genre_ids VARCHAR(255) NOT NULL DEFAULT '',
+    PRIMARY KEY (book_id),
+    KEY ix_book_stats_genres (genre_ids, review_count),
+    CONSTRAINT fk_book_stats_book FOREIGN KEY (book_id) REFERENCES Books (id)
+        ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- Количество книг по жанрам и годам (flask facets rebuild/verify)
+CREATE TABLE Catalog_facets (
+    facet ENUM('genre', 'year') NOT NULL,
+    value INT NOT NULL,
+    book_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (facet, value)
+) ENGINE=InnoDB;
+
+-- Похожие книги (flask similar-books rebuild/refresh)
+CREATE TABLE Book_similar (
+    book_id INT NOT NULL,
+    similar_book_id INT NOT NULL,
+    score FLOAT NOT NULL,
+    `rank` TINYINT UNSIGNED NOT NULL,
+    PRIMARY KEY (book_id, similar_book_id),
+    KEY ix_book_similar_similar (similar_book_id),
+    CONSTRAINT fk_book_similar_book FOREIGN KEY (book_id) REFERENCES Books (id)
+        ON DELETE CASCADE,
+    CONSTRAINT fk_book_similar_similar FOREIGN KEY (similar_book_id)
+        REFERENCES Books (id) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+CREATE TABLE Book_similar_dirty (
+    id INT NOT NULL AUTO_INCREMENT,
+    book_id INT NOT NULL,
+    PRIMARY KEY (id)
+) ENGINE=InnoDB;
+
+-- Журнал применённых миграций (app/migrate.py)
+CREATE TABLE Schema_migrations (
+    version INT NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    checksum CHAR(64) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (version)
+) ENGINE=InnoDB;
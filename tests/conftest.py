@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# Модули приложения импортируются так же, как в app/wsgi.py: из каталога app
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'app')
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+
+class Clock:
+    def __init__(self, now=1000.0) -> None:
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('time.monotonic', clock)
+    return clock
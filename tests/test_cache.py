@@ -0,0 +1,49 @@
+from cache import CachedValue, TTLCache
+
+
+def test_cache_calls_loader_once_until_expiry(clock):
+    cache = TTLCache(ttl=10)
+    calls = []
+
+    def load():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get('a', load) == 1
+    assert cache.get('a', load) == 1
+    clock.advance(11)
+    assert cache.get('a', load) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_cache_evicts_least_recently_used(clock):
+    cache = TTLCache(maxsize=2)
+    for key in ('a', 'b', 'a', 'c'):
+        cache.get(key, lambda key=key: key)
+    assert cache.get('a', lambda: 'reloaded') == 'a'
+    assert cache.get('b', lambda: 'reloaded') == 'reloaded'
+
+
+def test_none_is_not_cached(clock):
+    cache = TTLCache()
+    cache.get('a', lambda: None)
+    assert cache.get('a', lambda: 1) == 1
+
+
+def test_value_loaded_before_invalidate_is_not_stored(clock):
+    cache = TTLCache()
+
+    def load_stale():
+        cache.invalidate('a')
+        return 'stale'
+
+    assert cache.get('a', load_stale) == 'stale'
+    assert cache.get('a', lambda: 'fresh') == 'fresh'
+
+
+def test_cached_value_invalidate(clock):
+    value = CachedValue(ttl=10)
+    assert value.get(lambda: 1) == 1
+    assert value.get(lambda: 2) == 1
+    value.invalidate()
+    assert value.get(lambda: 3) == 3
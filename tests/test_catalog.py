@@ -0,0 +1,49 @@
+import pytest
+from catalog import InvalidCursorError, decode_cursor, encode_cursor
+from flask import Flask
+
+
+@pytest.fixture(autouse=True)
+def app_context():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    with app.app_context():
+        yield
+
+
+def test_cursor_round_trip():
+    token = encode_cursor((2001, 15))
+    assert decode_cursor(token) == [2001, 15]
+
+
+def test_cursor_keeps_string_and_null_keys():
+    token = encode_cursor(['Иванов', None, 7], salt='users-cursor')
+    assert decode_cursor(token, salt='users-cursor', size=3) == ['Иванов', None, 7]
+
+
+def test_cursor_is_url_safe():
+    token = encode_cursor(['a b/c?d', 1])
+    assert all(char.isalnum() or char in '-_.' for char in token)
+
+
+@pytest.mark.parametrize('token', ['', 'garbage', None])
+def test_malformed_cursor_is_rejected(token):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(token)
+
+
+def test_tampered_cursor_is_rejected():
+    token = encode_cursor((2001, 15))
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(token[:-1] + ('A' if token[-1] != 'A' else 'B'))
+
+
+def test_cursor_of_other_list_is_rejected():
+    token = encode_cursor((2001, 15), salt='users-cursor')
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(token)
+
+
+def test_cursor_with_wrong_key_count_is_rejected():
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(encode_cursor((2001, 15, 3)))
@@ -0,0 +1,23 @@
+from migrate import split_statements
+
+
+def test_statements_are_split_at_line_end_semicolons():
+    sql = ('CREATE TABLE a (id INT);\n'
+           'INSERT INTO a VALUES (1); \n'
+           'ALTER TABLE a ADD COLUMN b INT\n    AFTER id;\n')
+    assert split_statements(sql) == ['CREATE TABLE a (id INT)',
+                                     'INSERT INTO a VALUES (1)',
+                                     'ALTER TABLE a ADD COLUMN b INT\n    AFTER id']
+
+
+def test_semicolon_inside_line_does_not_split():
+    sql = "INSERT INTO a VALUES ('x;y');\n"
+    assert split_statements(sql) == ["INSERT INTO a VALUES ('x;y')"]
+
+
+def test_comment_only_chunks_are_skipped():
+    sql = ('-- Заголовок миграции;\n'
+           '-- ещё комментарий\n'
+           'CREATE TABLE a (id INT);\n'
+           '-- хвост\n')
+    assert split_statements(sql) == ['-- ещё комментарий\nCREATE TABLE a (id INT)']
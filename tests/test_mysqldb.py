@@ -0,0 +1,160 @@
+import mysql.connector
+import pytest
+from mysqldb import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self, **config) -> None:
+        self.config = config
+        self.in_transaction = False
+        self.connected = True
+        self.closed = False
+        self.rollbacks = 0
+
+    def is_connected(self):
+        return self.connected
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    # Соединения, открытые пулом, в порядке открытия
+    opened = []
+
+    def connect(**config):
+        connection = FakeConnection(**config)
+        opened.append(connection)
+        connection.connection_id = len(opened)
+        return connection
+
+    monkeypatch.setattr(mysql.connector, 'connect', connect)
+    return opened
+
+
+def make_pool(**kwargs):
+    return ConnectionPool({'host': 'db'}, **kwargs)
+
+
+def test_released_connection_is_reused(opened):
+    pool = make_pool()
+    first = pool.checkout()
+    first.close()
+    second = pool.checkout()
+
+    assert len(opened) == 1
+    assert second.connection_id == 1
+    assert pool.stats()['opened'] == 1
+    assert pool.stats()['in_use'] == 1
+
+
+def test_connect_receives_pool_config(opened):
+    make_pool().checkout()
+    assert opened[0].config == {'host': 'db'}
+
+
+def test_checkout_fails_when_pool_and_overflow_are_exhausted(opened):
+    pool = make_pool(size=1, max_overflow=1, timeout=0)
+    pool.checkout()
+    pool.checkout()
+
+    with pytest.raises(mysql.connector.PoolError):
+        pool.checkout()
+    assert pool.stats()['checkout_failures'] == 1
+    assert len(opened) == 2
+
+
+def test_checkout_timeout_overrides_pool_timeout(opened):
+    pool = make_pool(size=1, max_overflow=0, timeout=30)
+    pool.checkout()
+
+    with pytest.raises(mysql.connector.PoolError):
+        pool.checkout(0)
+    assert pool.stats()['checkout_failures'] == 1
+
+
+def test_overflow_connections_are_closed_on_release(opened):
+    pool = make_pool(size=1, max_overflow=1)
+    first, second = pool.checkout(), pool.checkout()
+    first.close()
+    second.close()
+
+    assert [connection.closed for connection in opened] == [False, True]
+    assert pool.stats()['opened'] == 1
+    assert pool.stats()['idle'] == 1
+
+
+def test_release_rolls_back_open_transaction(opened):
+    pool = make_pool()
+    connection = pool.checkout()
+    opened[0].in_transaction = True
+    connection.close()
+
+    assert opened[0].rollbacks == 1
+    assert pool.stats()['idle'] == 1
+
+
+def test_connection_failing_ping_is_replaced(opened):
+    pool = make_pool()
+    pool.checkout().close()
+    opened[0].connected = False
+
+    connection = pool.checkout()
+
+    assert len(opened) == 2
+    assert opened[0].closed
+    assert connection.connection_id == 2
+
+
+def test_old_connection_is_recycled(opened, clock):
+    pool = make_pool(recycle=60, pre_ping=False)
+    pool.checkout().close()
+    clock.advance(61)
+
+    pool.checkout()
+
+    assert len(opened) == 2
+    assert opened[0].closed
+
+
+def test_failed_connect_frees_reserved_slot(monkeypatch):
+    def connect(**_config):
+        msg = 'Сервер недоступен'
+        raise mysql.connector.InterfaceError(msg)
+
+    monkeypatch.setattr(mysql.connector, 'connect', connect)
+    pool = make_pool(size=1, max_overflow=0, timeout=0)
+
+    for _ in range(2):
+        with pytest.raises(mysql.connector.InterfaceError):
+            pool.checkout()
+    stats = pool.stats()
+    assert (stats['opened'], stats['in_use'], stats['checkout_failures']) == (0, 0, 2)
+
+
+def test_closed_connection_is_not_usable(opened):
+    connection = make_pool().checkout()
+    connection.close()
+    connection.close()
+
+    assert connection.is_closed()
+    with pytest.raises(mysql.connector.InterfaceError):
+        connection.cursor()
+
+
+def test_dispose_closes_idle_connections(opened):
+    pool = make_pool()
+    busy = pool.checkout()
+    pool.checkout().close()
+
+    pool.dispose()
+
+    assert opened[1].closed
+    assert pool.stats()['opened'] == 1
+    busy.close()
+    assert pool.stats()['idle'] == 1
@@ -0,0 +1,116 @@
+import random
+import sqlite3
+
+import book_stats
+import numpy as np
+import pytest
+import similar_books
+from flask import Flask
+from similar_books import SimilarityModel
+
+GENRES = [(1, 1), (2, 1), (3, 2), (4, 1), (4, 2)]
+# Пользователи 10 и 11 высоко оценили книги 1 и 3, оценки пользователя 12
+# ниже порога и на сходство по читателям не влияют
+RATINGS = [(1, 10, 5), (1, 11, 4), (3, 10, 5), (3, 11, 5), (1, 12, 2), (4, 12, 2)]
+
+
+def neighbours(model, book_id, k):
+    books, others, scores, ranks = model.top_k(model.rows_for([book_id]), k)
+    assert set(books.tolist()) <= {book_id}
+    assert ranks.tolist() == list(range(len(others)))
+    return others.tolist(), scores.tolist()
+
+
+def test_scores_mix_genres_and_readers():
+    model = SimilarityModel([1, 2, 3, 4, 5], GENRES, RATINGS, genre_weight=0.6)
+    others, scores = neighbours(model, 1, 3)
+
+    assert others == [2, 4, 3]
+    assert scores == pytest.approx([0.6, 0.6 / np.sqrt(2), 0.4], abs=1e-6)
+
+
+def test_book_without_genres_and_readers_has_no_neighbours():
+    model = SimilarityModel([1, 2, 3, 4, 5], GENRES, RATINGS)
+    assert neighbours(model, 5, 3) == ([], [])
+
+
+def test_equal_scores_prefer_popular_books():
+    model = SimilarityModel([1, 2, 3], [(1, 1), (2, 1), (3, 1)],
+                            [(3, 10, 1), (3, 11, 1)])
+    assert neighbours(model, 1, 2)[0] == [3, 2]
+
+
+def test_rows_of_deleted_books_are_skipped():
+    model = SimilarityModel([1, 2], [(1, 1), (2, 1), (9, 1)], [(9, 10, 5)])
+    assert model.rows_for([1, 9]).tolist() == [0]
+    assert neighbours(model, 1, 3)[0] == [2]
+
+
+class Cursor:
+    # Курсор sqlite3 с параметрами в стиле mysql-connector
+    def __init__(self, connection) -> None:
+        self.cursor = connection.cursor()
+
+    def execute(self, query, params=()):
+        self.cursor.execute(query.replace('%s', '?'), list(params))
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cursor.close()
+
+
+class Connection:
+    def __init__(self, connection) -> None:
+        self.connection = connection
+
+    def cursor(self):
+        return Cursor(self.connection)
+
+
+@pytest.fixture
+def catalog():
+    rng = random.Random(7)
+    connection = sqlite3.connect(':memory:')
+    connection.executescript("""
+        CREATE TABLE Books (id INT);
+        CREATE TABLE Book_genre (book_id INT, genre_id INT);
+        CREATE TABLE Reviews (book_id INT, user_id INT, rating INT);
+        CREATE TABLE Book_stats (book_id INT, review_count INT, genre_ids TEXT);
+    """)
+    for book_id in range(1, 301):
+        genre_ids = rng.sample(range(1, 9), rng.choice([0, 1, 1, 2, 3]))
+        user_ids = rng.sample(range(1, 200), rng.choice([0, 1, 2, 3, 5, 8]))
+        connection.execute('INSERT INTO Books VALUES (?)', (book_id,))
+        connection.executemany('INSERT INTO Book_genre VALUES (?, ?)',
+                               [(book_id, genre_id) for genre_id in genre_ids])
+        connection.executemany('INSERT INTO Reviews VALUES (?, ?, ?)',
+                               [(book_id, user_id, rng.randint(1, 5))
+                                for user_id in user_ids])
+        connection.execute('INSERT INTO Book_stats VALUES (?, ?, ?)',
+                           (book_id, len(user_ids),
+                            book_stats.format_genre_ids(genre_ids)))
+
+    app = Flask(__name__)
+    app.config.update(SIMILAR_BOOKS_COUNT=6, SIMILAR_BOOKS_GENRE_WEIGHT=0.5,
+                      SIMILAR_BOOKS_MIN_RATING=4, SIMILAR_BOOKS_BATCH_SIZE=7)
+    with app.app_context():
+        yield Connection(connection), rng
+
+
+def test_neighbourhood_model_matches_full_model(catalog):
+    conn, rng = catalog
+    full = similar_books.load_model(conn)
+    for _ in range(20):
+        book_ids = sorted(rng.sample(range(1, 301), rng.randint(1, 15)))
+        part = similar_books.load_neighbourhood(conn, book_ids)
+
+        expected = full.top_k(full.rows_for(book_ids), 6)
+        actual = part.top_k(part.rows_for(book_ids), 6)
+        assert len(part.book_ids) < len(full.book_ids)
+        for expected_values, actual_values in zip(expected, actual, strict=True):
+            assert actual_values.tolist() == pytest.approx(expected_values.tolist())
@@ -0,0 +1,115 @@
+import pytest
+from throttle import LoginThrottle, MemoryStore, backoff_delay
+
+
+@pytest.fixture
+def store(clock):
+    return MemoryStore()
+
+
+def test_bucket_allows_burst_then_asks_to_wait(store):
+    assert [store.acquire('ip:1', 3, 1) for _ in range(3)] == [0, 0, 0]
+    assert store.acquire('ip:1', 3, 1) == pytest.approx(1)
+
+
+def test_bucket_refills_over_time(store, clock):
+    for _ in range(3):
+        store.acquire('ip:1', 3, 1)
+    clock.advance(2)
+
+    assert [store.acquire('ip:1', 3, 1) for _ in range(3)] == [0, 0, pytest.approx(1)]
+
+
+def test_keys_have_separate_buckets(store):
+    store.acquire('ip:1', 1, 1)
+    assert store.acquire('ip:2', 1, 1) == 0
+
+
+def test_backoff_starts_after_allowed_failures(store):
+    delays = [store.failure('login:a', 3, 1, 300) for _ in range(6)]
+    assert delays == [0, 0, 0, 1, 2, 4]
+
+
+def test_blocked_key_waits_for_backoff(store, clock):
+    for _ in range(5):
+        store.failure('login:a', 3, 1, 300)
+
+    assert store.acquire('login:a', 5, 1) == pytest.approx(2)
+    clock.advance(2)
+    assert store.acquire('login:a', 5, 1) == 0
+
+
+def test_failures_decay_over_window(store, clock):
+    for _ in range(4):
+        store.failure('ip:1', 3, 1, 300, window=60)
+    clock.advance(60 * 4)
+
+    assert store.failure('ip:1', 3, 1, 300, window=60) == 0
+
+
+def test_spaced_failures_do_not_accumulate(store, clock):
+    delays = []
+    for _ in range(20):
+        clock.advance(90)
+        delays.append(store.failure('ip:1', 3, 1, 300, window=60))
+    assert set(delays) == {0}
+
+
+def test_success_resets_failures_and_block(store):
+    for _ in range(5):
+        store.failure('login:a', 3, 1, 300)
+    store.success('login:a')
+
+    assert store.acquire('login:a', 5, 1) == 0
+    assert store.failure('login:a', 3, 1, 300) == 0
+
+
+def test_store_evicts_least_recently_used_keys(clock):
+    store = MemoryStore(maxsize=2)
+    for key in ('a', 'b', 'a', 'c'):
+        store.acquire(key, 1, 1)
+    assert len(store) == 2
+    assert store.acquire('a', 1, 1) > 0
+    assert store.acquire('b', 1, 1) == 0
+
+
+def test_backoff_delay_is_capped():
+    assert backoff_delay(3, 3, 1, 300) == 0
+    assert backoff_delay(3.2, 3, 1, 300) == 1
+    assert backoff_delay(20, 3, 1, 300) == 300
+
+
+@pytest.fixture
+def throttle(store):
+    return LoginThrottle(store)
+
+
+def test_login_bucket_is_shared_by_case_and_spaces(throttle):
+    throttle.login_burst = 2
+    assert throttle.check('10.0.0.1', 'Admin') == 0
+    assert throttle.check('10.0.0.2', ' admin ') == 0
+    assert throttle.check('10.0.0.3', 'ADMIN') > 0
+
+
+def test_ip_bucket_limits_many_logins(throttle):
+    throttle.ip_burst = 2
+    assert throttle.check('10.0.0.1', 'a') == 0
+    assert throttle.check('10.0.0.1', 'b') == 0
+    assert throttle.check('10.0.0.1', 'c') > 0
+
+
+def test_success_clears_login_but_not_ip_failures(throttle):
+    for _ in range(5):
+        throttle.failed('10.0.0.1', 'a')
+    throttle.succeeded('10.0.0.1', 'a')
+
+    assert throttle.check('10.0.0.2', 'a') == 0
+    assert throttle.check('10.0.0.1', 'b') > 0
+
+
+def test_disabled_throttle_allows_everything(throttle):
+    throttle.enabled = False
+    throttle.ip_burst = 0
+    for _ in range(10):
+        throttle.failed('10.0.0.1', 'a')
+    assert throttle.check('10.0.0.1', 'a') == 0